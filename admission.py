@@ -0,0 +1,228 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from prompt_builder import count_message_tokens
+
+# Admission control in front of Azure OpenAI. Requests reserve their estimated tokens
+# against tokens-per-minute and requests-per-minute budgets before being sent, wait
+# in a bounded FIFO queue while the budget refills, and are shed with Overloaded
+# (503 + Retry-After) when the queue is full or the wait would be too long.
+# A limit of 0 disables that budget; 429s from upstream pause admission either way.
+
+TPM_LIMIT = int(os.getenv("AZURE_TPM_LIMIT", "0"))
+RPM_LIMIT = int(os.getenv("AZURE_RPM_LIMIT", "0"))
+# Azure enforces quotas over short intervals, so the burst allowed is this many seconds of quota
+RATE_WINDOW = float(os.getenv("AZURE_RATE_WINDOW", "10"))
+QUEUE_SIZE = int(os.getenv("AZURE_QUEUE_SIZE", "64"))
+QUEUE_WAIT = float(os.getenv("AZURE_QUEUE_WAIT", "10"))  # seconds a request may wait for budget
+
+_POLL_INTERVAL = 0.05  # seconds between checks for requests behind the head of the queue
+
+
+class Overloaded(Exception):
+    """The upstream budget cannot take the request soon enough; retry after retry_after seconds."""
+
+    def __init__(self, retry_after, reason="upstream capacity exhausted"):
+        super().__init__(f"{reason}, retry after {retry_after:.1f} s")
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def estimate_tokens(payload):
+    """
+    Tokens Azure counts against the quota for a chat completion request:
+    the prompt plus max_tokens, since the completion length is not known up front.
+    """
+    return count_message_tokens(payload["messages"]) + payload.get("max_tokens", 0)
+
+
+class _Bucket:
+    """Token bucket holding window seconds of a per-minute limit. The level may go negative (debt)."""
+
+    def __init__(self, per_minute, window):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute * window / 60.0
+        self.level = self.capacity
+
+    def refill(self, elapsed):
+        self.level = min(self.capacity, self.level + elapsed * self.rate)
+
+    def wait_for(self, amount):
+        """Seconds until amount (capped at capacity) is available."""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+
+class Reservation:
+    """Budget taken by one admitted request, passed to UpstreamLimiter.reconcile() when it completes."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+
+class UpstreamLimiter:
+    """
+    FIFO admission queue over a TPM and an RPM token bucket.
+    acquire() (or acquire_async() from an event loop) blocks until the request's
+    estimated tokens fit, then reconcile() records the real usage.
+    """
+
+    def __init__(self, tpm=TPM_LIMIT, rpm=RPM_LIMIT, window=RATE_WINDOW, queue_size=QUEUE_SIZE, max_wait=QUEUE_WAIT):
+        self.tokens = _Bucket(tpm, window) if tpm > 0 else None
+        self.requests = _Bucket(rpm, window) if rpm > 0 else None
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self._queue = deque()
+        self._paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {"admitted": 0, "rejected": 0, "timed_out": 0, "throttled": 0, "extra_admitted": 0,
+                       "extra_refused": 0, "wait_seconds": 0.0, "estimated_tokens": 0, "actual_tokens": 0}
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        for bucket in (self.tokens, self.requests):
+            if bucket is not None:
+                bucket.refill(elapsed)
+
+    def _wait_for(self, tokens, now):
+        """Seconds until a request of this size can be admitted at the head of the queue."""
+        wait = max(0.0, self._paused_until - now)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_for(tokens))
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_for(1))
+        return wait
+
+    def _backlog_wait(self, tokens, now):
+        """Rough time until a new request could be admitted behind everything queued."""
+        wait = max(0.0, self._paused_until - now)
+        if self.tokens is not None:
+            queued = sum(t for t, _ in self._queue) + tokens
+            wait = max(wait, (queued - self.tokens.level) / self.tokens.rate)
+        if self.requests is not None:
+            wait = max(wait, (len(self._queue) + 1 - self.requests.level) / self.requests.rate)
+        return max(wait, _POLL_INTERVAL)
+
+    def _take(self, tokens):
+        for bucket, amount in ((self.tokens, tokens), (self.requests, 1)):
+            if bucket is not None:
+                bucket.level -= min(amount, bucket.capacity)
+
+    def _enter(self, tokens):
+        with self._lock:
+            if len(self._queue) >= self.queue_size:
+                self._stats["rejected"] += 1
+                raise Overloaded(self._backlog_wait(tokens, time.monotonic()), "admission queue full")
+            ticket = (tokens, object())
+            self._queue.append(ticket)
+            return ticket, time.monotonic()
+
+    def _try_admit(self, ticket, started):
+        """Returns a Reservation if the request is admitted now, otherwise the seconds to sleep."""
+        tokens = ticket[0]
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._wait_for(tokens, now) if self._queue[0] is ticket else _POLL_INTERVAL
+            if wait <= 0:
+                self._take(tokens)
+                self._queue.popleft()
+                self._stats["admitted"] += 1
+                self._stats["estimated_tokens"] += tokens
+                self._stats["wait_seconds"] += now - started
+                return Reservation(tokens)
+
+            remaining = started + self.max_wait - now
+            if self._queue[0] is ticket and wait > remaining:
+                # Shed now rather than hold the caller for a wait we already know is too long
+                self._queue.remove(ticket)
+                self._stats["timed_out"] += 1
+                raise Overloaded(self._backlog_wait(tokens, now))
+            if remaining <= 0:
+                self._queue.remove(ticket)
+                self._stats["timed_out"] += 1
+                raise Overloaded(self._backlog_wait(tokens, now))
+            return min(wait, remaining)
+
+    def _abandon(self, ticket):
+        with self._lock:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+
+    def acquire(self, tokens):
+        """Blocks until tokens fit the budget. Returns a Reservation or raises Overloaded."""
+        ticket, started = self._enter(tokens)
+        try:
+            while True:
+                result = self._try_admit(ticket, started)
+                if isinstance(result, Reservation):
+                    return result
+                time.sleep(result)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    async def acquire_async(self, tokens):
+        """acquire() for coroutines: waits with asyncio.sleep instead of blocking the loop."""
+        ticket, started = self._enter(tokens)
+        try:
+            while True:
+                result = self._try_admit(ticket, started)
+                if isinstance(result, Reservation):
+                    return result
+                await asyncio.sleep(result)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    def try_acquire(self, tokens):
+        """
+        Takes budget for an extra upstream attempt of an admitted request (a hedge or a failover)
+        only if it is free right now: nothing queued, no 429 pause and room in both buckets.
+        Returns a Reservation, or None without waiting; extra attempts never jump the queue.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._queue or self._wait_for(tokens, now) > 0:
+                self._stats["extra_refused"] += 1
+                return None
+            self._take(tokens)
+            self._stats["extra_admitted"] += 1
+            self._stats["estimated_tokens"] += tokens
+            return Reservation(tokens)
+
+    def reconcile(self, reservation, actual_tokens):
+        """
+        Records the tokens the upstream reported (the response's usage.total_tokens). Azure charges
+        the max_tokens estimate at request time, so unused tokens are not returned to the bucket;
+        a request that used more than its estimate is charged the difference.
+        """
+        if actual_tokens is None:
+            return
+        with self._lock:
+            self._stats["actual_tokens"] += actual_tokens
+            if self.tokens is not None and actual_tokens > reservation.tokens:
+                self.tokens.level -= actual_tokens - reservation.tokens
+
+    def throttled(self, retry_after):
+        """Records a 429 from upstream: nothing is admitted for retry_after seconds (1 s if unknown)."""
+        with self._lock:
+            self._stats["throttled"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + (retry_after or 1.0))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, waiting=len(self._queue))
+            if self.tokens is not None:
+                stats["tokens_available"] = round(self.tokens.level)
+        stats["mean_wait_ms"] = 1000 * stats["wait_seconds"] / stats["admitted"] if stats["admitted"] else 0.0
+        return stats
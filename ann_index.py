@@ -0,0 +1,257 @@
+import argparse
+import hashlib
+import time
+import numpy as np
+from search_engine import SUBSET_GATHER_FRACTION, ExactIndex, normalize, quantize, score, top_k
+
+# Rows scored per block during k-means assignment, bounding the temporary score matrix.
+ASSIGN_BLOCK_SIZE = 16384
+
+
+def _assign(vectors, centroids):
+    """Returns the id of the closest (highest cosine) centroid for every row of vectors."""
+    assignments = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], ASSIGN_BLOCK_SIZE):
+        block = vectors[start:start + ASSIGN_BLOCK_SIZE]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _spherical_kmeans(vectors, n_lists, n_iter, rng):
+    """Clusters unit vectors by cosine similarity. Empty clusters are re-seeded from random points."""
+    centroids = vectors[rng.choice(vectors.shape[0], n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_lists)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def vectors_digest(vectors):
+    """Content hash of a vector matrix (shape and float32 values), used to tell whether a saved index still fits."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    digest = hashlib.sha256(str(vectors.shape).encode("ascii"))
+    digest.update(vectors)
+    return digest.hexdigest()
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate index. Vectors are clustered into n_lists cells with
+    spherical k-means; a query only scores the vectors in its n_probe closest cells.
+    Raising n_probe trades latency for recall; n_probe == n_lists is exact search.
+    storage selects float32, float16 or int8 for the stored vectors (centroids stay float32).
+    digest is vectors_digest() of the vectors it was built from.
+    """
+
+    def __init__(self, vectors=None, n_lists=None, n_probe=8, n_iter=20, train_size=None, seed=0,
+                 storage="float32"):
+        self.n_probe = n_probe
+        self.storage = storage
+        self._positions = None  # Row id -> position in vectors, built on the first search_subset()
+        self.digest = None
+        if vectors is None:
+            return  # Populated by load()
+
+        self.digest = vectors_digest(vectors)
+        vectors = normalize(vectors)
+        n = vectors.shape[0]
+        if n_lists is None:
+            n_lists = int(np.sqrt(n))
+        n_lists = max(1, min(n_lists, n))
+        if train_size is None:
+            train_size = 256 * n_lists
+
+        rng = np.random.default_rng(seed)
+        train = vectors if n <= train_size else vectors[rng.choice(n, train_size, replace=False)]
+        self.centroids = _spherical_kmeans(train, n_lists, n_iter, rng)
+
+        # Store vectors grouped by cell so each cell is one contiguous slice.
+        assignments = _assign(vectors, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        self.ids = order.astype(np.int64)
+        self.vectors, self.scales = quantize(vectors[order], storage)
+        self.offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=self.offsets[1:])
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    @property
+    def nbytes(self):
+        """Memory held by the stored vectors, centroids and cell bookkeeping."""
+        scales_bytes = self.scales.nbytes if self.scales is not None else 0
+        return self.vectors.nbytes + scales_bytes + self.centroids.nbytes + self.ids.nbytes + self.offsets.nbytes
+
+    def search(self, queries, k, n_probe=None):
+        """
+        Returns (scores, ids) arrays of shape (n_queries, k), best match first.
+        If the probed cells hold fewer than k vectors, the remaining slots are id -1 with score -inf.
+        """
+        queries = normalize(queries)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        _, probed_cells = top_k(queries @ self.centroids.T, n_probe)
+
+        out_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        out_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        for qi, cells in enumerate(probed_cells):
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in cells])
+            if rows.size == 0:
+                continue
+            scores, picked = top_k(score(queries[qi:qi + 1], self.vectors[rows], self.scales), k)
+            found = picked.shape[1]
+            out_scores[qi, :found] = scores[0]
+            out_ids[qi, :found] = self.ids[rows[picked[0]]]
+        return out_scores, out_ids
+
+    def search_subset(self, queries, k, ids, n_probe=None):
+        """
+        search() restricted to the given row ids. A small subset is scored exactly, which is cheaper
+        than probing. A large one is probed as usual with non-members masked out; a query whose
+        probed cells hold fewer than k members falls back to scoring the subset exactly.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        queries = normalize(queries)
+        if len(ids) <= SUBSET_GATHER_FRACTION * len(self):
+            return self._score_subset(queries, k, ids)
+
+        member = np.zeros(len(self), dtype=bool)
+        member[ids] = True
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        _, probed_cells = top_k(queries @ self.centroids.T, n_probe)
+
+        k = min(k, len(ids))
+        out_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        out_ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        for qi, cells in enumerate(probed_cells):
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in cells])
+            rows = rows[member[self.ids[rows]]]
+            if rows.size < k:
+                scores, found = self._score_subset(queries[qi:qi + 1], k, ids)
+                out_scores[qi], out_ids[qi] = scores[0], found[0]
+                continue
+            scores, picked = top_k(score(queries[qi:qi + 1], self.vectors[rows], self.scales), k)
+            out_scores[qi] = scores[0]
+            out_ids[qi] = self.ids[rows[picked[0]]]
+        return out_scores, out_ids
+
+    def _score_subset(self, queries, k, ids):
+        if self._positions is None:
+            positions = np.empty_like(self.ids)
+            positions[self.ids] = np.arange(len(self.ids))
+            self._positions = positions
+        scores, picked = top_k(score(queries, self.vectors[self._positions[ids]], self.scales), k)
+        return scores, ids[picked]
+
+    def save(self, path):
+        """Writes the index to a single .npz file."""
+        np.savez(
+            path,
+            centroids=self.centroids,
+            vectors=self.vectors,
+            ids=self.ids,
+            offsets=self.offsets,
+            n_probe=np.array(self.n_probe),
+            storage=np.array(self.storage),
+            scales=self.scales if self.scales is not None else np.empty(0, dtype=np.float32),
+            digest=np.array(self.digest or ""),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index written by save()."""
+        index = cls()
+        with np.load(path) as data:
+            index.centroids = np.asarray(data["centroids"])
+            index.vectors = np.asarray(data["vectors"])
+            index.ids = np.asarray(data["ids"])
+            index.offsets = np.asarray(data["offsets"])
+            index.n_probe = int(data["n_probe"])
+            index.storage = str(data["storage"])
+            index.scales = np.asarray(data["scales"]) if index.storage == "int8" else None
+            index.digest = str(data["digest"]) if "digest" in data.files else None  # Older files: unknown
+        return index
+
+
+def recall_at_k(approx_ids, exact_ids):
+    """Fraction of the exact top-k neighbours that the approximate search also returned."""
+    k = exact_ids.shape[1]
+    hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx_ids, exact_ids))
+    return hits / (k * exact_ids.shape[0])
+
+
+def recall_latency_report(vectors, queries, k=10, n_probes=(1, 2, 4, 8, 16, 32), **build_params):
+    """
+    Builds an IVF index over vectors and measures recall@k and per-query latency
+    against exact search for each n_probe setting. Returns a list of result dicts,
+    starting with the exact baseline.
+    """
+    exact = ExactIndex(vectors)
+    start = time.perf_counter()
+    ivf = IVFIndex(vectors, **build_params)
+    build_seconds = time.perf_counter() - start
+
+    def timed(search_one):
+        latencies, results = [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            results.append(search_one(q[None, :]))
+            latencies.append((time.perf_counter() - t0) * 1000)
+        return np.vstack(results), np.array(latencies)
+
+    exact_ids, exact_ms = timed(lambda q: exact.search(q, k)[1])
+    report = [{
+        "backend": "exact",
+        "n_probe": None,
+        f"recall@{k}": 1.0,
+        "p50_ms": float(np.percentile(exact_ms, 50)),
+        "p95_ms": float(np.percentile(exact_ms, 95)),
+    }]
+    for n_probe in n_probes:
+        if n_probe > ivf.n_lists:
+            break
+        ivf_ids, ivf_ms = timed(lambda q: ivf.search(q, k, n_probe=n_probe)[1])
+        report.append({
+            "backend": "ivf",
+            "n_lists": ivf.n_lists,
+            "build_seconds": build_seconds,
+            "n_probe": n_probe,
+            f"recall@{k}": recall_at_k(ivf_ids, exact_ids),
+            "p50_ms": float(np.percentile(ivf_ms, 50)),
+            "p95_ms": float(np.percentile(ivf_ms, 95)),
+        })
+    return report
+
+
+def _synthetic_vectors(n, dim, n_topics, rng):
+    """Clustered random vectors, a rough stand-in for sentence embeddings of a legal corpus."""
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    return topics[rng.integers(0, n_topics, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall@k versus latency for the IVF index against exact search.")
+    parser.add_argument("--n", type=int, default=100000, help="number of synthetic chunks")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = _synthetic_vectors(args.n + args.queries, args.dim, max(16, args.n // 500), rng)
+    corpus, query_set = data[:args.n], data[args.n:]
+
+    print(f"{'backend':8} {'n_probe':>8} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in recall_latency_report(corpus, query_set, k=args.k, n_lists=args.n_lists):
+        print(f"{row['backend']:8} {str(row['n_probe']):>8} {row[f'recall@{args.k}']:>10.3f} "
+              f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
@@ -0,0 +1,102 @@
+import hashlib
+import threading
+import time
+import numpy as np
+
+
+def context_key(chunks):
+    """Order-independent identity of a retrieved context, built from the chunk contents."""
+    return frozenset(hashlib.sha1(chunk.encode("utf-8")).hexdigest() for chunk in chunks)
+
+
+class SemanticAnswerCache:
+    """
+    Caches LLM answers by question meaning rather than exact text.
+    An entry is (question embedding, retrieved context, answer). A new question is a hit
+    when its embedding has cosine similarity >= threshold with a stored question AND it
+    retrieved the same context, so a paraphrase is only served an answer grounded in the
+    same chunks. Holds at most max_size entries, evicting the least recently used.
+    """
+
+    def __init__(self, max_size=512, threshold=0.9, ttl=None):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl = ttl or None
+        self._vectors = None  # (max_size, dim) unit vectors, allocated on first store
+        self._entries = []    # slot -> {"context", "answer", "stored_at", "used_at"}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _matching_slot(self, query, context, expired=False):
+        """
+        Slot of the most similar live entry with the same context, or None. With expired,
+        entries past their ttl match too. Caller holds the lock.
+        """
+        if not self._entries:
+            return None
+        similarities = self._vectors[:len(self._entries)] @ query
+        now = time.monotonic()
+        for slot in np.argsort(-similarities):
+            if similarities[slot] < self.threshold:
+                break
+            entry = self._entries[slot]
+            if entry["context"] != context:
+                continue
+            if not expired and self.ttl is not None and now - entry["stored_at"] > self.ttl:
+                continue
+            return int(slot)
+        return None
+
+    def lookup(self, query_vector, context):
+        """Returns a cached answer for a question with this embedding and context, or None."""
+        query = self._unit(query_vector)
+        with self._lock:
+            slot = self._matching_slot(query, context)
+            if slot is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries[slot]["used_at"] = time.monotonic()
+            self._stats["hits"] += 1
+            return self._entries[slot]["answer"]
+
+    def store(self, query_vector, context, answer):
+        """Adds an answer, replacing a near-identical entry or evicting the least recently used one."""
+        if self.max_size <= 0:
+            return
+        query = self._unit(query_vector)
+        now = time.monotonic()
+        entry = {"context": context, "answer": answer, "stored_at": now, "used_at": now}
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                self._vectors = np.zeros((self.max_size, query.shape[0]), dtype=np.float32)
+                self._entries = []
+
+            # An expired match is refreshed in place rather than left beside a duplicate
+            slot = self._matching_slot(query, context, expired=True)
+            if slot is None and len(self._entries) < self.max_size:
+                slot = len(self._entries)
+                self._entries.append(entry)
+            else:
+                if slot is None:
+                    slot = min(range(len(self._entries)), key=lambda i: self._entries[i]["used_at"])
+                    self._stats["evictions"] += 1
+                self._entries[slot] = entry
+            self._vectors[slot] = query
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            self._entries = []
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), max_size=self.max_size)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
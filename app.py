@@ -1,13 +1,35 @@
 # app.py
-from flask import Flask, request, jsonify
+from dotenv import load_dotenv # To load environment variables from .env file
+
+# Load .env before the project modules below: they read their settings (AZURE_TPM_LIMIT,
+# LLM_HEDGE_*, RAG_*, PROMPT_*, ...) from the environment when they are imported
+load_dotenv()
+
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS # Import CORS to allow cross-origin requests from your frontend
-from rag_utils import load_documents, search # Import your RAG utilities
+from rag_utils import current_state, get_texts, is_ready, retrieve, start_background_load, start_reload, status # Import your RAG utilities
+from answer_cache import SemanticAnswerCache, context_key
+from query_cache import normalize_query
+from metadata_index import normalize_filters
+from singleflight import SingleFlight
+from prompt_builder import RETRIEVAL_CANDIDATES, count_message_tokens, pack_context
+from admission import Overloaded, UpstreamLimiter, estimate_tokens
+from llm_router import Deployment, LLMRouter, load_deployments
+from bhashini_config import BhashiniConfigError, pipeline_configs
+from translation_service import TranslationError, get_translation_service
+from voice_pipeline import ANSWER_LANGUAGE, StageTimer, recognize, speak
+from tts_cache import AUDIO_MIMETYPES, TTS_GENDER, get_tts_cache
+import azure_client
+import metrics
+import multiprocessing
 import os
+import signal
+import threading
+import time
 import openai # Keep if you plan to switch to the openai library directly (currently using 'requests')
-from dotenv import load_dotenv # To load environment variables from .env file
 import requests # To make HTTP requests to Azure OpenAI
-
-load_dotenv() # Load environment variables from .env file
+import json
+import re
 
 # Retrieve Azure OpenAI configuration from environment variables
 AZURE_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -15,19 +37,156 @@ AZURE_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 AZURE_DEPLOYMENT = os.getenv("AZURE_DEPLOYMENT_NAME")
 AZURE_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
 
+# Semantic answer cache: paraphrased questions that retrieve the same context reuse the LLM answer
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.9"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # seconds, 0 = no expiry
+
+# Shared secret for /admin endpoints (X-Admin-Token header); without it they only accept local requests
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes, allowing your frontend to connect
 
-# Initialize the RAG model (load documents and build search index)
-# This is called once when the Flask app starts.
-try:
-    load_documents()
-    print("RAG model initialized successfully.")
-except FileNotFoundError:
-    print("Error: 'bareacts.txt' not found. Please ensure it's in the 'legal_data/' directory relative to app.py.")
-    # In a production scenario, you might want to exit or disable AI features gracefully here.
-except Exception as e:
-    print(f"Error initializing RAG model: {e}")
+answer_cache = SemanticAnswerCache(
+    max_size=ANSWER_CACHE_SIZE, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL
+)
+
+# In-flight deduplication of identical (normalized) questions
+inflight = SingleFlight()
+
+# Routes each Azure OpenAI call to the fastest healthy deployment (AZURE_OPENAI_DEPLOYMENTS),
+# hedging slow attempts; without that variable the single deployment configured above is used
+router = LLMRouter(load_deployments(
+    Deployment("default", AZURE_ENDPOINT, AZURE_DEPLOYMENT, AZURE_API_KEY, AZURE_API_VERSION)
+))
+
+# Keeps Azure OpenAI calls within the deployment's TPM/RPM quota (AZURE_TPM_LIMIT, AZURE_RPM_LIMIT)
+upstream_limiter = UpstreamLimiter()
+
+# Counters the components keep anyway, exposed on /metrics when it is scraped
+metrics.register_stats("answer_cache", answer_cache.stats)
+metrics.register_stats("ask_inflight", inflight.stats)
+metrics.register_stats("llm_router", lambda: router.stats())
+metrics.register_stats("admission", upstream_limiter.stats)
+metrics.register_stats("azure", azure_client.stats)
+metrics.register_stats("bhashini_config", pipeline_configs.stats)
+metrics.register_value("ready", "1 once the RAG index is loaded and warmed up.", lambda: int(is_ready()))
+
+# Every request is timed per stage (see metrics.stage); the stages go out in a Server-Timing header
+@app.before_request
+def start_request_timing():
+    g.metrics_token = metrics.begin_request()
+
+@app.after_request
+def add_server_timing(response):
+    token = g.pop("metrics_token", None)
+    if token is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        response.headers["Server-Timing"] = metrics.end_request(token, route, request.method, response.status_code)
+        response.headers["Timing-Allow-Origin"] = "*"  # Lets the cross-origin frontend read Server-Timing
+    return response
+
+def overloaded_response(e):
+    """503 telling the client when the upstream budget should have room again."""
+    print(f"Shedding request: {e}")
+    return jsonify({ "error": "The AI service is busy. Please try again shortly." }), 503, {"Retry-After": e.retry_after_header()}
+
+def cache_bypassed(headers):
+    """
+    True if the client asked to skip the answer cache, via 'X-Cache-Bypass: 1' or 'Cache-Control: no-cache'.
+    """
+    if headers.get("X-Cache-Bypass", "").lower() in ("1", "true", "yes"):
+        return True
+    return "no-cache" in headers.get("Cache-Control", "").lower()
+
+# Initialize the RAG model (load documents and build search index) on a background thread,
+# so the process answers liveness checks immediately. /ready reports when it can take traffic.
+# Spawned encode workers (ingest.encode_parallel) re-import the main module; they must not load too.
+if multiprocessing.parent_process() is None:
+    start_background_load()
+
+def admin_allowed(headers, remote_addr):
+    """True if the request carries ADMIN_TOKEN, or comes from this host when no token is configured."""
+    if ADMIN_TOKEN:
+        return headers.get("X-Admin-Token") == ADMIN_TOKEN
+    return remote_addr in ("127.0.0.1", "::1")
+
+# SIGHUP rebuilds the corpus (or reloads its snapshot) in the background, like POST /admin/reload
+if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGHUP, lambda signum, frame: start_reload())
+
+def build_prompt(question, context):
+    """
+    Builds the user prompt for Azure OpenAI from the question and the retrieved RAG context.
+    Instructs the AI to use the provided context and suggest consulting a lawyer if context is insufficient.
+    """
+    return f"""You are a helpful legal assistant for Indian citizens. Use the following context to answer the user's question.
+        If the context does not contain enough information to answer the question, state that you cannot answer based on the provided context, and suggest consulting a qualified legal professional or visiting a legal aid center.
+        Provide clear, simple explanations suitable for common people.
+
+        Context:
+        {context}
+
+        Question: {question}"""
+
+def retrieve_context(question, filters=None):
+    """
+    Retrieves candidate chunks for the question and packs the best-scoring, non-duplicate ones
+    into the prompt token budget (see prompt_builder.pack_context). filters (see
+    metadata_index.normalize_filters) restricts retrieval to e.g. one act or persona.
+    Returns (query_vector, chunks, usage) where usage reports the context tokens kept and cut.
+    """
+    current = current_state()  # One state for ids and texts, even if a reload swaps it meanwhile
+    with metrics.stage("retrieval"):
+        query_vec, chunk_ids, scores = retrieve(question, k=RETRIEVAL_CANDIDATES, current=current, filters=filters)
+    with metrics.stage("context_pack"):
+        chunks, usage = pack_context(get_texts(chunk_ids, current), scores)
+    usage["prompt_tokens"] = 0  # Filled in once a prompt is actually sent
+    return query_vec, chunks, usage
+
+def azure_payload(prompt, stream=False):
+    """
+    Payload for the Azure OpenAI chat completion API.
+    With stream=True the completion is returned incrementally as server-sent events.
+    """
+    payload = {
+        "messages": [
+            { "role": "system", "content": "You are a legal expert for Indian citizens." },
+            { "role": "user", "content": prompt }
+        ],
+        "temperature": 0.5, # Controls randomness: lower for more deterministic, higher for more creative
+        "max_tokens": 800,  # Maximum number of tokens (words/pieces) in the response
+        "top_p": 0.95       # Controls diversity via nucleus sampling
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def iter_azure_stream(response):
+    """
+    Yields the content deltas of a streaming Azure chat completion.
+    Each SSE line is 'data: {json}' and the stream ends with 'data: [DONE]'.
+    Azure may send chunks with empty 'choices' (e.g. content filter results); those are skipped.
+    A stream that ends without [DONE] was cut off upstream and raises ChunkedEncodingError.
+    """
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        choices = json.loads(data).get("choices") or []
+        if choices:
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+    raise requests.exceptions.ChunkedEncodingError("Azure OpenAI stream ended before [DONE]")
+
+def sse(data, event=None):
+    """Formats one server-sent event carrying a JSON payload."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
 
 # Define a simple root route for health checking and initial access
 @app.route('/')
@@ -38,75 +197,134 @@ def home():
     """
     return "LegalEase Flask API is running! Access /ask for RAG functionality."
 
+# Readiness probe: only route traffic to this worker once the index is loaded and warmed up
+@app.route('/ready')
+def ready():
+    """
+    Returns 200 once the RAG index is ready to serve, 503 with loading progress otherwise.
+    """
+    body = dict(status, ready=is_ready())
+    return jsonify(body), (200 if body["ready"] else 503)
+
+# Hot reload of the legal corpus without a restart
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """
+    Builds a new index from legal_data/ (or loads the snapshot file given as {"snapshot": path})
+    in the background and swaps it in atomically; /ask keeps answering from the current one.
+    Progress and errors show up in /ready as reloading / reload_error / version.
+    """
+    if not admin_allowed(request.headers, request.remote_addr):
+        return jsonify({"error": "Forbidden"}), 403
+    if not is_ready():
+        return jsonify({"error": "The legal knowledge base is still loading."}), 409
+    snapshot_path = (request.get_json(silent=True) or {}).get("snapshot")
+    if snapshot_path and not os.path.isfile(snapshot_path):
+        return jsonify({"error": f"Snapshot not found: {snapshot_path}"}), 400
+    if not start_reload(snapshot_path=snapshot_path):
+        return jsonify({"error": "A reload is already in progress."}), 409
+    return jsonify({"reloading": True, "version": status["version"]}), 202
+
+# Values clients can filter /ask on, with chunk counts
+@app.route('/filters')
+def list_filters():
+    """
+    Returns the acts, years, personas and sources in the corpus with their chunk counts,
+    so the persona screens can build their filter menus.
+    """
+    if not is_ready():
+        return jsonify({"error": "The legal knowledge base is still loading."}), 503, {"Retry-After": "5"}
+    return jsonify(current_state().metadata_index.facets())
+
+def request_filters(body):
+    """Canonical filters from a request body's optional "filters" object. Raises ValueError if invalid."""
+    return normalize_filters((body or {}).get("filters"))
+
+def answer_question(question, bypass=False, filters=None):
+    """
+    Retrieves relevant legal chunks for the question and gets an answer from Azure OpenAI,
+    unless the semantic answer cache already holds one for the same context.
+    Returns (answer, cache_status, usage) where cache_status is "hit", "miss" or "bypass"
+    and usage holds the prompt token count (0 for a cache hit) and the context tokens cut.
+    """
+    # Step 1: Retrieve relevant chunks and fit them into the prompt token budget
+    query_vec, chunks, usage = retrieve_context(question, filters)
+    context = "\n\n".join(chunks) # Combine chunks into a single context string
+
+    # A paraphrase of a recent question with the same retrieved context reuses its answer
+    chunks_key = context_key(chunks)
+    if not bypass:
+        with metrics.stage("answer_cache"):
+            cached_answer = answer_cache.lookup(query_vec, chunks_key)
+        if cached_answer is not None:
+            return cached_answer, "hit", usage
+
+    # Step 2: Construct the prompt and payload for Azure OpenAI with the RAG context
+    with metrics.stage("prompt_build"):
+        payload = azure_payload(build_prompt(question, context))
+        usage["prompt_tokens"] = count_message_tokens(payload["messages"])
+    print(f"Prompt tokens: {usage['prompt_tokens']} (context {usage['context_tokens']}, cut {usage['context_tokens_saved']})")
+
+    # Step 3: Wait for room in the upstream quota (or raise Overloaded), then call Azure OpenAI
+    with metrics.stage("admission"):
+        reservation = upstream_limiter.acquire(estimate_tokens(payload))
+    with metrics.stage("llm"):
+        response = router.post(payload, on_throttled=upstream_limiter.throttled, limiter=upstream_limiter)
+        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+        data = response.json() # Parse the JSON response from Azure OpenAI
+
+    # Step 4: Extract the AI's answer from the response
+    try:
+        ai_answer = data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        print(f"Unexpected response structure from Azure OpenAI: {data}")
+        raise KeyError("choices")
+    upstream_limiter.reconcile(reservation, (data.get("usage") or {}).get("total_tokens"))
+    answer_cache.store(query_vec, chunks_key, ai_answer)
+    return ai_answer, ("bypass" if bypass else "miss"), usage
+
 # Define the /ask endpoint for AI queries
 @app.route("/ask", methods=["POST"])
 def ask():
     """
     Handles POST requests for AI queries.
     Retrieves relevant legal chunks using RAG and sends them to Azure OpenAI for an answer.
+    An optional "filters" object, e.g. {"persona": "tenants"} or {"act": "Consumer Protection Act"},
+    restricts retrieval to matching chunks (see GET /filters for the available values).
     """
     question = request.json.get("question")
     if not question:
         return jsonify({"error": "No question provided"}), 400
-
     try:
-        # Step 1: Retrieve relevant chunks using the RAG search function
-        chunks = search(question)
-        context = "\n\n".join(chunks) # Combine chunks into a single context string
-
-        # Step 2: Construct the prompt for Azure OpenAI with the RAG context
-        # Instruct the AI to use the provided context and suggest consulting a lawyer if context is insufficient.
-        prompt = f"""You are a helpful legal assistant for Indian citizens. Use the following context to answer the user's question.
-        If the context does not contain enough information to answer the question, state that you cannot answer based on the provided context, and suggest consulting a qualified legal professional or visiting a legal aid center.
-        Provide clear, simple explanations suitable for common people.
+        filters = request_filters(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not is_ready():
+        return jsonify({"error": "The legal knowledge base is still loading. Please try again shortly."}), 503, {"Retry-After": "5"}
 
-        Context:
-        {context}
-
-        Question: {question}"""
-
-        # Prepare headers for the Azure OpenAI API request
-        headers = {
-            "Content-Type": "application/json",
-            "api-key": AZURE_API_KEY
-        }
-
-        # Prepare the payload for the Azure OpenAI chat completion API
-        payload = {
-            "messages": [
-                { "role": "system", "content": "You are a legal expert for Indian citizens." },
-                { "role": "user", "content": prompt }
-            ],
-            "temperature": 0.5, # Controls randomness: lower for more deterministic, higher for more creative
-            "max_tokens": 800,  # Maximum number of tokens (words/pieces) in the response
-            "top_p": 0.95       # Controls diversity via nucleus sampling
-        }
-
-        # Step 3: Make the request to Azure OpenAI
-        response = requests.post(
-            f"{AZURE_ENDPOINT}/openai/deployments/{AZURE_DEPLOYMENT}/chat/completions?api-version={AZURE_API_VERSION}",
-            headers=headers,
-            json=payload
+    try:
+        # Concurrent identical questions share one retrieval and one Azure call
+        bypass = cache_bypassed(request.headers)
+        (ai_answer, cache_status, usage), shared = inflight.do(
+            (normalize_query(question), bypass, filters),
+            lambda: answer_question(question, bypass, filters)
         )
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-
-        data = response.json() # Parse the JSON response from Azure OpenAI
 
-        # Step 4: Extract the AI's answer from the response
-        ai_answer = data["choices"][0]["message"]["content"]
-        
-        # Return the AI's answer in a JSON response
+        # Return the AI's answer in a JSON response, with the prompt size for cost tracking
         return jsonify({
-            "answer": ai_answer
-        })
+            "answer": ai_answer,
+            "usage": usage
+        }), 200, {"X-Answer-Cache": cache_status, "X-Coalesced": "1" if shared else "0"}
 
+    except Overloaded as e:
+        # The upstream quota is exhausted and the admission queue is full or too slow
+        return overloaded_response(e)
     except requests.exceptions.RequestException as e:
         # Handle errors related to the HTTP request itself (e.g., network issues, invalid API key)
         print(f"Request to Azure OpenAI failed: {e}")
         return jsonify({ "error": f"Failed to connect to AI service or Azure API error: {e}" }), 500
     except KeyError:
         # Handle cases where the response structure from Azure OpenAI is not as expected
-        print(f"Unexpected response structure from Azure OpenAI: {data}")
         return jsonify({ "error": "Unexpected AI response format. Please check Azure deployment." }), 500
     except RuntimeError as e:
         # Handle errors from rag_utils (e.g., RAG index not loaded)
@@ -117,6 +335,252 @@ def ask():
         print(f"An unexpected error occurred in Flask API: {e}")
         return jsonify({ "error": f"An internal server error occurred: {e}" }), 500
 
+# Streaming variant of /ask: relays the answer token by token as server-sent events
+@app.route("/ask/stream", methods=["POST"])
+def ask_stream():
+    """
+    Same input as /ask (including filters), but responds with a text/event-stream:
+      data: {"token": "..."}            one event per content delta
+      event: done / data: {"answer": "...", "usage": {...}}   full answer once the stream completes
+      event: error / data: {"error": "..."}   if retrieval or Azure fails, including mid-stream
+    A cached answer is sent as a single token event followed by done.
+    """
+    question = request.json.get("question")
+    if not question:
+        return jsonify({"error": "No question provided"}), 400
+    try:
+        filters = request_filters(request.json)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not is_ready():
+        return jsonify({"error": "The legal knowledge base is still loading. Please try again shortly."}), 503, {"Retry-After": "5"}
+
+    try:
+        query_vec, chunks, usage = retrieve_context(question, filters)
+    except RuntimeError as e:
+        print(f"RAG error: {e}")
+        return jsonify({ "error": f"RAG model not ready or search failed: {e}" }), 500
+    bypass = cache_bypassed(request.headers)
+    chunks_key = context_key(chunks)
+    with metrics.stage("answer_cache"):
+        cached_answer = None if bypass else answer_cache.lookup(query_vec, chunks_key)
+
+    # Admission happens before the stream starts, so an exhausted quota is still a plain 503
+    if cached_answer is None:
+        with metrics.stage("prompt_build"):
+            payload = azure_payload(build_prompt(question, "\n\n".join(chunks)), stream=True)
+            usage["prompt_tokens"] = count_message_tokens(payload["messages"])
+        try:
+            with metrics.stage("admission"):
+                reservation = upstream_limiter.acquire(estimate_tokens(payload))
+        except Overloaded as e:
+            return overloaded_response(e)
+
+    def generate():
+        if cached_answer is not None:
+            yield sse({"token": cached_answer})
+            yield sse({"answer": cached_answer, "usage": usage}, event="done")
+            return
+
+        parts = []
+        started = time.perf_counter()
+        try:
+            with metrics.stage("llm_stream"), router.post(payload, stream=True, on_throttled=upstream_limiter.throttled,
+                                                          limiter=upstream_limiter) as response:
+                response.raise_for_status()
+                for delta in iter_azure_stream(response):
+                    if not parts:
+                        metrics.observe_stage("llm_first_token", time.perf_counter() - started)
+                    parts.append(delta)
+                    yield sse({"token": delta})
+        except requests.exceptions.RequestException as e:
+            print(f"Streaming request to Azure OpenAI failed: {e}")
+            yield sse({"error": f"Failed to connect to AI service or Azure API error: {e}"}, event="error")
+            return
+        except (ValueError, AttributeError) as e:
+            print(f"Unexpected streaming response from Azure OpenAI: {e}")
+            yield sse({"error": "Unexpected AI response format. Please check Azure deployment."}, event="error")
+            return
+
+        answer = "".join(parts)
+        # Streams carry no usage; each delta is roughly one completion token
+        upstream_limiter.reconcile(reservation, usage["prompt_tokens"] + len(parts))
+        answer_cache.store(query_vec, chunks_key, answer)
+        yield sse({"answer": answer, "usage": usage}, event="done")
+
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Tell reverse proxies not to buffer the stream
+        "X-Answer-Cache": "hit" if cached_answer is not None else ("bypass" if bypass else "miss"),
+    }
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+# Voice round trip: speech in the user's language in, spoken answer sentences out
+@app.route("/ask/voice", methods=["POST"])
+def ask_voice():
+    """
+    Takes {"audio": "<base64>", "audio_format": "wav", "language": "hi", "filters": {...}}
+    and responds with a text/event-stream:
+      event: transcript / data: {"text": "...", "question": "..."}   what was heard, and its English form
+      data: {"index": n, "text": "...", "translation": "...", "audio_url": "/audio/<id>.wav", "audio_format": "wav",
+             "audio_cached": false}     one event per answer sentence, in order, as soon as its audio is ready
+      event: done / data: {"answer": "...", "translation": "...", "usage": {...}, "timings": {...}}
+      event: error / data: {"error": "..."}
+    timings breaks the request down by stage (asr, question_translation, retrieval, translation
+    and tts summed over sentences) and milestone (llm_first_token, first_sentence, first_audio).
+    """
+    body = request.get_json(silent=True) or {}
+    audio = body.get("audio")
+    language = body.get("language", ANSWER_LANGUAGE)
+    if not audio:
+        return jsonify({"error": "No audio provided"}), 400
+    try:
+        filters = request_filters(body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not is_ready():
+        return jsonify({"error": "The legal knowledge base is still loading. Please try again shortly."}), 503, {"Retry-After": "5"}
+
+    timer = StageTimer()
+    service = get_translation_service()
+    try:
+        with timer.stage("asr"):
+            transcript = recognize(audio, body.get("audio_format", "wav"), language, service)
+        if not transcript:
+            return jsonify({"error": "No speech was recognized in the audio."}), 422
+        question = transcript
+        if language != ANSWER_LANGUAGE:
+            with timer.stage("question_translation"):
+                question = service.translate(transcript, language, ANSWER_LANGUAGE)
+        with timer.stage("retrieval"):
+            query_vec, chunks, usage = retrieve_context(question, filters)
+    except (TranslationError, BhashiniConfigError) as e:
+        print(f"Bhashini request failed: {e}")
+        return jsonify({"error": f"Speech or translation service failed: {e}"}), 502
+    except RuntimeError as e:
+        print(f"RAG error: {e}")
+        return jsonify({ "error": f"RAG model not ready or search failed: {e}" }), 500
+
+    chunks_key = context_key(chunks)
+    cached_answer = None if cache_bypassed(request.headers) else answer_cache.lookup(query_vec, chunks_key)
+    if cached_answer is None:
+        payload = azure_payload(build_prompt(question, "\n\n".join(chunks)), stream=True)
+        usage["prompt_tokens"] = count_message_tokens(payload["messages"])
+        try:
+            reservation = upstream_limiter.acquire(estimate_tokens(payload))
+        except Overloaded as e:
+            return overloaded_response(e)
+
+    def answer_deltas():
+        if cached_answer is not None:
+            yield cached_answer
+            return
+        parts = []
+        with router.post(payload, stream=True, on_throttled=upstream_limiter.throttled,
+                         limiter=upstream_limiter) as response:
+            response.raise_for_status()
+            for delta in iter_azure_stream(response):
+                timer.mark("llm_first_token")
+                parts.append(delta)
+                yield delta
+        timer.mark("llm_done")
+        upstream_limiter.reconcile(reservation, usage["prompt_tokens"] + len(parts))
+        answer_cache.store(query_vec, chunks_key, "".join(parts))
+
+    def generate():
+        yield sse({"text": transcript, "question": question}, event="transcript")
+        sentences = []
+        try:
+            for sentence in speak(answer_deltas(), language, timer, service):
+                sentences.append(sentence)
+                audio_id = sentence.pop("audio_id")
+                yield sse(dict(sentence, audio_url=f"/audio/{audio_id}.{sentence['audio_format']}"))
+        except requests.exceptions.RequestException as e:
+            print(f"Streaming request to Azure OpenAI failed: {e}")
+            yield sse({"error": f"Failed to connect to AI service or Azure API error: {e}"}, event="error")
+            return
+        except (TranslationError, BhashiniConfigError) as e:
+            print(f"Bhashini request failed: {e}")
+            yield sse({"error": f"Speech or translation service failed: {e}"}, event="error")
+            return
+        except (KeyError, IndexError, TypeError) as e:
+            # A malformed Bhashini or Azure payload must still end the stream with an error event
+            print(f"Unexpected response while voicing the answer: {e!r}")
+            yield sse({"error": "Unexpected response from the speech or AI service."}, event="error")
+            return
+        except (ValueError, AttributeError) as e:
+            print(f"Unexpected streaming response from Azure OpenAI: {e}")
+            yield sse({"error": "Unexpected AI response format. Please check Azure deployment."}, event="error")
+            return
+
+        timings = timer.report()
+        print(f"Voice answer in {language}: {len(sentences)} sentences, timings {timings}")
+        yield sse({
+            "answer": " ".join(s["text"] for s in sentences),
+            "translation": " ".join(s["translation"] for s in sentences),
+            "usage": usage,
+            "timings": timings,
+        }, event="done")
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
+# Prometheus scrape endpoint: stage latency histograms, cache/upstream counters, index size and memory
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# Synthesized speech, served as binary files from the content-addressed TTS cache
+AUDIO_NAME = re.compile(r"^([0-9a-f]{64})(?:\.\w+)?$")
+TTS_MAX_CHARS = int(os.getenv("TTS_MAX_CHARS", "2000"))
+
+def audio_response(audio_id, path, audio_format, cached):
+    """
+    The audio file with its raw bytes (no base64). send_file answers Range requests with 206
+    and If-None-Match with 304; the content never changes for an id, so clients may cache it for good.
+    """
+    response = send_file(path, mimetype=AUDIO_MIMETYPES.get(audio_format, "application/octet-stream"),
+                         conditional=True, etag=audio_id, max_age=31536000)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    response.headers["Content-Location"] = f"/audio/{audio_id}.{audio_format}"
+    response.headers["X-TTS-Cache"] = "hit" if cached else "miss"
+    return response
+
+@app.route("/audio/<name>")
+def audio(name):
+    match = AUDIO_NAME.match(name)
+    found = get_tts_cache().lookup(match.group(1)) if match else None
+    if found is None:
+        return jsonify({"error": "Audio not found"}), 404
+    path, audio_format = found
+    try:
+        return audio_response(match.group(1), path, audio_format, True)
+    except FileNotFoundError:  # Evicted between lookup() and send_file()
+        return jsonify({"error": "Audio not found"}), 404
+
+@app.route("/tts", methods=["POST"])
+def tts():
+    """
+    Takes {"text": "...", "language": "hi", "gender": "female"} and returns the spoken text as
+    binary audio, from the TTS cache when the same text was spoken before.
+    """
+    body = request.get_json(silent=True) or {}
+    text = (body.get("text") or "").strip()
+    if not text:
+        return jsonify({"error": "No text provided"}), 400
+    if len(text) > TTS_MAX_CHARS:
+        return jsonify({"error": f"Text is longer than {TTS_MAX_CHARS} characters"}), 413
+    try:
+        audio_id, path, audio_format, cached = get_tts_cache().get(
+            text, body.get("language", ANSWER_LANGUAGE), body.get("gender", TTS_GENDER))
+    except (TranslationError, BhashiniConfigError) as e:
+        print(f"Bhashini request failed: {e}")
+        return jsonify({"error": f"Speech service failed: {e}"}), 502
+    try:
+        return audio_response(audio_id, path, audio_format, cached)
+    except FileNotFoundError:  # Evicted by a concurrent store before send_file() opened it
+        return jsonify({"error": "Audio was evicted from the cache, please retry"}), 503, {"Retry-After": "1"}
+
 # Run the Flask application
 if __name__ == "__main__":
     # Ensure the Flask app runs on port 5000 and is accessible externally (0.0.0.0)
@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+
+import app as flask_app  # Shared Azure configuration, prompt building and answer cache
+import azure_client
+import metrics
+from answer_cache import context_key
+from query_cache import normalize_query
+from admission import Overloaded, estimate_tokens
+from llm_router import UpstreamError
+from prompt_builder import count_message_tokens
+from rag_utils import current_state, is_ready, start_reload, status
+from singleflight import AsyncSingleFlight
+
+# asyncio serving mode with the same /, /ready, /filters, /ask, /metrics and /admin/reload contract as app.py.
+# The Azure round trip is awaited instead of holding a thread, so concurrency is
+# no longer capped by the number of worker threads. Retrieval is CPU-bound and
+# runs on a small thread pool.
+#
+#   python async_app.py          (listens on 0.0.0.0:5000, like app.py)
+
+SEARCH_WORKERS = int(os.getenv("ASYNC_SEARCH_WORKERS", "4"))
+
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="rag-search")
+
+# In-flight deduplication of identical (normalized) questions
+inflight = AsyncSingleFlight()
+
+
+async def post_chat(session, payload):
+    """
+    Async counterpart of app.router.post(): sends a chat completion to the best deployment,
+    hedging and failing over like the threaded app. Returns the parsed JSON.
+    """
+    limiter = flask_app.upstream_limiter
+    return await flask_app.router.post_async(session, payload, on_throttled=limiter.throttled, limiter=limiter)
+
+
+def json_error(message, status_code, headers=None):
+    return web.json_response({"error": message}, status=status_code, headers=headers)
+
+
+async def home(request):
+    return web.Response(text="LegalEase async API is running! Access /ask for RAG functionality.")
+
+
+async def ready(request):
+    body = dict(status, ready=is_ready())
+    return web.json_response(body, status=200 if body["ready"] else 503)
+
+
+async def list_filters(request):
+    """Same contract as app.list_filters()."""
+    if not is_ready():
+        return json_error("The legal knowledge base is still loading.", 503, {"Retry-After": "5"})
+    return web.json_response(current_state().metadata_index.facets())
+
+
+async def admin_reload(request):
+    """Same contract as app.admin_reload()."""
+    if not flask_app.admin_allowed(request.headers, request.remote):
+        return json_error("Forbidden", 403)
+    if not is_ready():
+        return json_error("The legal knowledge base is still loading.", 409)
+    try:
+        snapshot_path = (await request.json()).get("snapshot")
+    except (ValueError, AttributeError):
+        snapshot_path = None
+    if snapshot_path and not os.path.isfile(snapshot_path):
+        return json_error(f"Snapshot not found: {snapshot_path}", 400)
+    if not start_reload(snapshot_path=snapshot_path):
+        return json_error("A reload is already in progress.", 409)
+    return web.json_response({"reloading": True, "version": status["version"]}, status=202)
+
+
+async def answer_question(session, question, bypass=False, filters=None):
+    """Async counterpart of app.answer_question(). Returns (answer, cache_status, usage)."""
+    loop = asyncio.get_running_loop()
+    # The copied context carries the request's timing, so retrieval stages reach its Server-Timing
+    query_vec, chunks, usage = await loop.run_in_executor(
+        search_executor, contextvars.copy_context().run, flask_app.retrieve_context, question, filters)
+
+    chunks_key = context_key(chunks)
+    if not bypass:
+        with metrics.stage("answer_cache"):
+            cached_answer = flask_app.answer_cache.lookup(query_vec, chunks_key)
+        if cached_answer is not None:
+            return cached_answer, "hit", usage
+
+    with metrics.stage("prompt_build"):
+        payload = flask_app.azure_payload(flask_app.build_prompt(question, "\n\n".join(chunks)))
+        usage["prompt_tokens"] = count_message_tokens(payload["messages"])
+    with metrics.stage("admission"):
+        reservation = await flask_app.upstream_limiter.acquire_async(estimate_tokens(payload))
+    with metrics.stage("llm"):
+        data = await post_chat(session, payload)
+    ai_answer = data["choices"][0]["message"]["content"]
+    flask_app.upstream_limiter.reconcile(reservation, (data.get("usage") or {}).get("total_tokens"))
+    flask_app.answer_cache.store(query_vec, chunks_key, ai_answer)
+    return ai_answer, ("bypass" if bypass else "miss"), usage
+
+
+async def ask(request):
+    """
+    Same contract as app.ask(): POST {"question": ..., "filters": {...}} returns {"answer": ..., "usage": ...} or {"error": ...}.
+    """
+    try:
+        body = await request.json()
+        question = body.get("question")
+    except (ValueError, AttributeError):
+        body, question = None, None
+    if not question:
+        return json_error("No question provided", 400)
+    try:
+        filters = flask_app.request_filters(body)
+    except ValueError as e:
+        return json_error(str(e), 400)
+    if not is_ready():
+        return json_error("The legal knowledge base is still loading. Please try again shortly.", 503, {"Retry-After": "5"})
+
+    try:
+        bypass = flask_app.cache_bypassed(request.headers)
+        (ai_answer, cache_status, usage), shared = await inflight.do(
+            (normalize_query(question), bypass, filters),
+            lambda: answer_question(request.app["azure_session"], question, bypass, filters),
+        )
+        return web.json_response(
+            {"answer": ai_answer, "usage": usage},
+            headers={"X-Answer-Cache": cache_status, "X-Coalesced": "1" if shared else "0"},
+        )
+
+    except Overloaded as e:
+        print(f"Shedding request: {e}")
+        return json_error("The AI service is busy. Please try again shortly.", 503, {"Retry-After": e.retry_after_header()})
+    except (UpstreamError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Request to Azure OpenAI failed: {e}")
+        return json_error(f"Failed to connect to AI service or Azure API error: {e}", 500)
+    except (KeyError, IndexError, TypeError):
+        print("Unexpected response structure from Azure OpenAI")
+        return json_error("Unexpected AI response format. Please check Azure deployment.", 500)
+    except RuntimeError as e:
+        print(f"RAG error: {e}")
+        return json_error(f"RAG model not ready or search failed: {e}", 500)
+    except Exception as e:
+        print(f"An unexpected error occurred in async API: {e}")
+        return json_error(f"An internal server error occurred: {e}", 500)
+
+
+async def metrics_endpoint(request):
+    """Same contract as app.metrics_endpoint()."""
+    return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+@web.middleware
+async def server_timing(request, handler):
+    """Times every request per stage, like the before/after_request hooks in app.py."""
+    token = metrics.begin_request()
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "unmatched"
+    try:
+        response = await handler(request)
+    except web.HTTPException as e:
+        metrics.end_request(token, route, request.method, e.status)
+        raise
+    except BaseException:
+        metrics.end_request(token, route, request.method, 500)
+        raise
+    response.headers["Server-Timing"] = metrics.end_request(token, route, request.method, response.status)
+    response.headers["Timing-Allow-Origin"] = "*"  # Lets the cross-origin frontend read Server-Timing
+    return response
+
+
+@web.middleware
+async def cors(request, handler):
+    """Allows cross-origin requests from the frontend, like flask_cors in app.py."""
+    if request.method == "OPTIONS":
+        response = web.Response()
+    else:
+        response = await handler(request)
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-Cache-Bypass, Cache-Control"
+    response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+    return response
+
+
+async def _open_session(application):
+    timeout = aiohttp.ClientTimeout(sock_connect=azure_client.CONNECT_TIMEOUT, sock_read=azure_client.READ_TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=0, keepalive_timeout=60)
+    application["azure_session"] = aiohttp.ClientSession(timeout=timeout, connector=connector)
+
+
+async def _close_session(application):
+    await application["azure_session"].close()
+
+
+def create_app():
+    """Builds the aiohttp application. The RAG index is already loading (started by importing app.py)."""
+    application = web.Application(middlewares=[cors, server_timing])
+    application.router.add_get("/", home)
+    application.router.add_get("/ready", ready)
+    application.router.add_get("/filters", list_filters)
+    application.router.add_get("/metrics", metrics_endpoint)
+    application.router.add_post("/ask", ask)
+    application.router.add_post("/admin/reload", admin_reload)
+    application.on_startup.append(_open_session)
+    application.on_cleanup.append(_close_session)
+    return application
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
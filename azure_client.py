@@ -0,0 +1,133 @@
+import email.utils
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared upstream HTTP client for Azure OpenAI. One pooled Session keeps TCP+TLS
+# connections alive across requests; every call has connect/read timeouts and
+# retries throttling (429) and server errors (5xx) with jittered backoff.
+
+CONNECT_TIMEOUT = float(os.getenv("AZURE_CONNECT_TIMEOUT", "5"))   # seconds
+READ_TIMEOUT = float(os.getenv("AZURE_READ_TIMEOUT", "60"))        # seconds between bytes received
+MAX_RETRIES = int(os.getenv("AZURE_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("AZURE_BACKOFF_BASE", "0.5"))       # seconds, doubled per attempt
+BACKOFF_MAX = float(os.getenv("AZURE_BACKOFF_MAX", "8"))
+RETRY_AFTER_MAX = float(os.getenv("AZURE_RETRY_AFTER_MAX", "30"))  # longest Retry-After we are willing to wait
+POOL_SIZE = int(os.getenv("AZURE_POOL_SIZE", "20"))                # kept-alive connections per host
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "retries": 0, "connection_errors": 0, "throttled": 0, "server_errors": 0}
+
+
+def get_session():
+    """Returns the process-wide pooled Session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def retry_delay(attempt, response=None):
+    """
+    Delay before retry number attempt (0-based). Honours the upstream's Retry-After
+    (capped at RETRY_AFTER_MAX); otherwise uses full-jitter exponential backoff.
+    """
+    if response is not None:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return min(retry_after, RETRY_AFTER_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def post(url, headers=None, json=None, stream=False, timeout=None, max_retries=None, on_throttled=None):
+    """
+    POSTs through the pooled session, retrying connection failures, 429 and 5xx responses.
+    Returns the final response; when retries run out on a retryable status, that response
+    is returned so the caller's raise_for_status() reports it. Read timeouts are not retried,
+    since the upstream may already be generating the answer.
+    on_throttled, if given, is called with the Retry-After seconds (or None) of every 429.
+    """
+    session = get_session()
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+
+    for attempt in range(max_retries + 1):
+        _count("requests")
+        try:
+            response = session.post(url, headers=headers, json=json, stream=stream, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout):
+            _count("connection_errors")
+            if attempt == max_retries:
+                raise
+            _count("retries")
+            time.sleep(retry_delay(attempt))
+            continue
+
+        if response.status_code == 429:
+            _count("throttled")
+            if on_throttled is not None:
+                on_throttled(parse_retry_after(response.headers.get("Retry-After")))
+        elif response.status_code >= 500:
+            _count("server_errors")
+        if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+            return response
+
+        delay = retry_delay(attempt, response)
+        response.close()
+        _count("retries")
+        time.sleep(delay)
+
+
+def stats():
+    """
+    Request/retry counters plus connection reuse figures from the urllib3 pools.
+    connection_reuse is the fraction of HTTP requests that did not need a new connection.
+    """
+    with _stats_lock:
+        result = dict(_stats)
+
+    connections = pooled_requests = 0
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    pooled_requests += pool.num_requests
+    result["connections_opened"] = connections
+    result["connection_reuse"] = 1 - connections / pooled_requests if pooled_requests else 0.0
+    return result
@@ -0,0 +1,353 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+from ann_index import IVFIndex, recall_at_k
+from ingest import iter_corpus
+from metadata_index import MetadataIndex, tag_chunk
+from search_engine import ExactIndex, normalize
+from snapshot import read_snapshot, write_snapshot
+
+# Indexing and retrieval benchmarks on synthetic corpora. Chunk texts are generated
+# bare-act sections and vectors are clustered random (or precomputed, --vectors), so
+# the figures do not depend on the embedding model. Results are written as JSON and
+# compared with a stored baseline; a metric that got worse by more than the tolerance
+# is reported as a regression and the exit status is 1.
+#
+#   python benchmarks.py --sizes 1k 100k               compare with benchmark_baseline.json
+#   python benchmarks.py --sizes 1k 100k 1m --save-baseline
+#
+# The committed benchmark_baseline.json is the CI gate; it was saved with
+#   python benchmarks.py --sizes 1k 10k --repeat 5
+# and a CI run must use the same arguments. Re-save it when the CI machine changes.
+#
+# Peak memory is what tracemalloc saw during the step (NumPy arrays included); timings
+# of query latency are taken with tracemalloc off.
+
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000, "1m": 1000000}
+RESULTS_PATH = "benchmark_results.json"
+BASELINE_PATH = os.getenv("BENCHMARK_BASELINE", "benchmark_baseline.json")
+CHUNKING_LIMIT = 100000  # Larger corpora skip the ingest step (it would write hundreds of MB of text)
+MODEL_NAME = "benchmark-synthetic"
+
+# Metric name suffix -> absolute change below which a difference is treated as noise
+LOWER_IS_BETTER = {"_s": 0.05, "_ms": 0.5, "_mb": 1.0}
+HIGHER_IS_BETTER = ("_qps", "_per_s")
+RECALL_TOLERANCE = 0.01  # recall may drop this much (absolute) before it counts as a regression
+
+ACTS = [
+    ("Rent Control Act", 1999), ("Consumer Protection Act", 2019), ("Payment of Gratuity Act", 1972),
+    ("Right of Children to Free and Compulsory Education Act", 2009), ("Information Technology Act", 2000),
+    ("Maintenance and Welfare of Parents and Senior Citizens Act", 2007),
+    ("Protection of Women from Domestic Violence Act", 2005), ("Micro, Small and Medium Enterprises Development Act", 2006),
+]
+SUBJECTS = ["The landlord", "Every employer", "The State Government", "Any person aggrieved", "The tenant",
+            "A consumer", "The appropriate authority", "Every school", "The Controller", "The District Commission"]
+VERBS = ["shall", "may", "shall not"]
+ACTIONS = ["file a complaint before", "give notice in writing to", "pay the amount due to", "refer the dispute to",
+           "furnish the prescribed particulars to", "make an application to", "recover possession from"]
+OBJECTS = ["the Controller", "the District Commission", "the competent authority", "the Tribunal",
+           "the aggrieved party", "the Magistrate", "the employee", "the senior citizen"]
+CLAUSES = ["within thirty days of the order", "in such form as may be prescribed", "subject to the provisions of this Act",
+           "notwithstanding anything contained in any other law", "after giving a reasonable opportunity of being heard",
+           "on payment of such fee as may be prescribed"]
+SECTIONS_PER_CHAPTER = 25
+SECTIONS_PER_FILE = 5000
+
+
+def synthetic_sections(n, seed=0):
+    """Yields n (act, year, chapter number, section number, text) tuples, spread over ACTS."""
+    rng = np.random.default_rng(seed)
+    picks = [rng.integers(0, len(words), (n, 3)) for words in (SUBJECTS, VERBS, ACTIONS, OBJECTS, CLAUSES)]
+    n_sentences = rng.integers(2, 4, n)  # two or three sentences, ~30-45 words
+    per_act = -(-n // len(ACTS))
+    for i in range(n):
+        act, year = ACTS[i // per_act]
+        number = i % per_act + 1
+        sentences = [
+            f"{SUBJECTS[picks[0][i, j]]} {VERBS[picks[1][i, j]]} {ACTIONS[picks[2][i, j]]} "
+            f"{OBJECTS[picks[3][i, j]]} {CLAUSES[picks[4][i, j]]}."
+            for j in range(n_sentences[i])
+        ]
+        yield act, year, (number - 1) // SECTIONS_PER_CHAPTER + 1, number, " ".join(sentences)
+
+
+def write_documents(n, data_dir, seed=0):
+    """Writes n sections as bare-act text files that ingest.iter_corpus() chunks into about n chunks."""
+    handle, written, current = None, 0, None
+    for act, year, chapter, number, text in synthetic_sections(n, seed):
+        if handle is None or (act, (number - 1) // SECTIONS_PER_FILE) != current:
+            if handle is not None:
+                handle.close()
+            current = (act, (number - 1) // SECTIONS_PER_FILE)
+            name = f"{act.lower().replace(' ', '_').replace(',', '')}_{current[1]}.txt"
+            handle = open(os.path.join(data_dir, name), "w", encoding="utf-8")
+            handle.write(f"THE {act.upper()}, {year}\n\n")
+        if number % SECTIONS_PER_CHAPTER == 1:
+            handle.write(f"CHAPTER {chapter}\n\n")
+        handle.write(f"{number}. {text}\n\n")
+        written += 1
+    if handle is not None:
+        handle.close()
+    return written
+
+
+def synthetic_chunks(n, seed=0):
+    """Chunk texts and metadata as ingest would produce them, without writing documents."""
+    texts, metadata = [], []
+    for act, year, chapter, number, text in synthetic_sections(n, seed):
+        chunk = tag_chunk({"act": f"{act}, {year}", "chapter": f"CHAPTER {chapter}", "section": f"Section {number}",
+                           "text": text, "source": f"{act}.txt", "offset": None})
+        texts.append(chunk.pop("text"))
+        metadata.append(chunk)
+    return texts, metadata
+
+
+def synthetic_vectors(n, n_queries, dim, seed=0, block=65536):
+    """
+    Clustered random unit vectors standing in for chunk embeddings, and queries drawn from the
+    same clusters. Many small, overlapping clusters keep neighbourhoods spread over several IVF
+    cells, so recall reacts to index changes (tight clusters give recall 1.0 at any setting).
+    Generated block by block so a 1M x 384 corpus needs no float64 temporaries.
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((max(16, n // 20), dim)).astype(np.float32)
+    out = np.empty((n + n_queries, dim), dtype=np.float32)
+    for start in range(0, len(out), block):
+        rows = min(block, len(out) - start)
+        out[start:start + rows] = topics[rng.integers(0, len(topics), rows)]
+        out[start:start + rows] += rng.standard_normal((rows, dim), dtype=np.float32)
+    return normalize(out[:n]), normalize(out[n:])
+
+
+def measure(fn):
+    """Runs fn() once. Returns (result, seconds, peak traced MB)."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+
+def latency(search, queries, batch_size):
+    """Single-query percentiles (ms) and batch figures for search(query_matrix)."""
+    search(queries[:1])  # Warm-up: first-touch page faults, lazy structures
+    single = []
+    for q in queries:
+        start = time.perf_counter()
+        search(q[None, :])
+        single.append((time.perf_counter() - start) * 1000)
+    batches = []
+    for start_row in range(0, len(queries), batch_size):
+        start = time.perf_counter()
+        search(queries[start_row:start_row + batch_size])
+        batches.append((time.perf_counter() - start) * 1000)
+    return {
+        "single_p50_ms": float(np.percentile(single, 50)),
+        "single_p95_ms": float(np.percentile(single, 95)),
+        "single_p99_ms": float(np.percentile(single, 99)),
+        "batch_p50_ms": float(np.percentile(batches, 50)),
+        "batch_p95_ms": float(np.percentile(batches, 95)),
+        "batch_qps": len(queries) / (sum(batches) / 1000),
+    }
+
+
+def run_size(n, args, vectors=None):
+    """Benchmarks one corpus size. Returns {metric: value}."""
+    results = {"chunks": n}
+    workdir = tempfile.mkdtemp(prefix="legalease-bench-")
+    try:
+        # Ingest: chunk bare-act documents (texts and metadata for the other steps come from here)
+        if n <= CHUNKING_LIMIT:
+            data_dir = os.path.join(workdir, "docs")
+            os.makedirs(data_dir)
+            write_documents(n, data_dir, args.seed)
+            chunks, seconds, peak = measure(lambda: list(iter_corpus(data_dir)))
+            results.update(chunking_s=seconds, chunking_peak_mb=peak, chunking_chunks_per_s=len(chunks) / seconds)
+            texts = [chunk.pop("text") for chunk in chunks]
+            metadata = chunks
+            del chunks
+            shutil.rmtree(data_dir)
+        else:
+            texts, metadata = synthetic_chunks(n, args.seed)
+        n = min(n, len(texts))
+        results["chunks"] = n
+
+        if vectors is None:
+            corpus, queries = synthetic_vectors(n, args.queries, args.dim, args.seed)
+        else:
+            corpus, queries = vectors[:n], vectors[-args.queries:]
+        del texts[n:], metadata[n:]
+
+        # Snapshot round trip: what a restart pays instead of re-encoding
+        snapshot_path = os.path.join(workdir, "bench.snap")
+        _, results["snapshot_write_s"], results["snapshot_write_peak_mb"] = measure(
+            lambda: write_snapshot(snapshot_path, texts, metadata, corpus, MODEL_NAME))
+        del texts, metadata, corpus  # From here on everything reads the snapshot, as after a restart
+        snap, results["snapshot_load_s"], results["snapshot_load_peak_mb"] = measure(lambda: read_snapshot(snapshot_path))
+
+        # Index builds
+        exact, results["build_exact_s"], results["build_exact_peak_mb"] = measure(
+            lambda: ExactIndex(snap.vectors, normalized=True))
+        results["exact_index_mb"] = exact.nbytes / 2**20
+        ivf, results["build_ivf_s"], results["build_ivf_peak_mb"] = measure(
+            lambda: IVFIndex(snap.vectors, n_probe=args.n_probe))
+        results["ivf_index_mb"] = ivf.nbytes / 2**20
+        metadata_index, results["build_metadata_s"], results["build_metadata_peak_mb"] = measure(
+            lambda: MetadataIndex(snap.texts, snap.metadata))
+
+        # Query latency and recall
+        for name, value in latency(lambda q: exact.search(q, args.k), queries, args.batch_size).items():
+            results[f"exact_{name}"] = value
+        for name, value in latency(lambda q: ivf.search(q, args.k), queries, args.batch_size).items():
+            results[f"ivf_{name}"] = value
+        _, exact_ids = exact.search(queries, args.k)
+        _, ivf_ids = ivf.search(queries, args.k)
+        results[f"ivf_recall_at_{args.k}"] = recall_at_k(ivf_ids, exact_ids)
+
+        # Filtered retrieval: a broad filter (one persona) and a narrow one (one act)
+        for label, filters in (("persona", {"persona": "tenants"}), ("act", {"act": ACTS[-1][0]})):
+            subset = metadata_index.select(filters)
+            results[f"filter_{label}_fraction"] = len(subset) / n
+            if len(subset):
+                stats = latency(lambda q: exact.search_subset(q, args.k, subset), queries, args.batch_size)
+                results[f"filter_{label}_single_p50_ms"] = stats["single_p50_ms"]
+                results[f"filter_{label}_single_p95_ms"] = stats["single_p95_ms"]
+        del snap, exact, ivf
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def environment():
+    """Where the results came from; comparisons across different machines are flagged."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPUs)",
+    }
+
+
+def compare(current, baseline, tolerance):
+    """
+    Compares every metric present in both result sets. Returns (rows, regressions) where
+    each row is (size, metric, baseline value, current value, relative change, verdict).
+    """
+    rows, regressions = [], []
+    for size, metrics in current["results"].items():
+        before = baseline.get("results", {}).get(size)
+        if not before:
+            continue
+        for name, value in metrics.items():
+            old = before.get(name)
+            if not isinstance(old, (int, float)) or not isinstance(value, (int, float)):
+                continue
+            change = (value - old) / old if old else 0.0
+            verdict = ""
+            # Rates first: "_per_s" also ends in the duration suffix "_s"
+            floor = next((f for suffix, f in LOWER_IS_BETTER.items() if name.endswith(suffix)), None)
+            if "recall" in name:
+                verdict = "REGRESSION" if value < old - RECALL_TOLERANCE else ("better" if value > old + RECALL_TOLERANCE else "")
+            elif name.endswith(HIGHER_IS_BETTER):
+                verdict = "REGRESSION" if change < -tolerance else ("better" if change > tolerance else "")
+            elif floor is not None and abs(value - old) >= floor:
+                verdict = "REGRESSION" if change > tolerance else ("better" if change < -tolerance else "")
+            rows.append((size, name, old, value, change, verdict))
+            if verdict == "REGRESSION":
+                regressions.append((size, name, old, value, change))
+    return rows, regressions
+
+
+def print_results(results):
+    for size, metrics in results.items():
+        print(f"\n{size} ({metrics['chunks']} chunks)")
+        for name, value in metrics.items():
+            if name != "chunks":
+                print(f"  {name:32} {value:>12.4f}" if isinstance(value, float) else f"  {name:32} {value:>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Indexing and retrieval benchmarks on synthetic corpora.")
+    parser.add_argument("--sizes", nargs="+", default=["1k", "100k", "1m"], help=f"corpus sizes: {', '.join(SIZES)} or a number")
+    parser.add_argument("--dim", type=int, default=384, help="vector dimension (all-MiniLM-L6-v2: 384)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--n-probe", type=int, default=int(os.getenv("RAG_IVF_PROBE", "8")))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vectors", help="precomputed embeddings (.npy, rows >= largest size + queries) instead of random ones")
+    parser.add_argument("--output", default=RESULTS_PATH, help="where to write the results JSON")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="results JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown/growth reported as a regression")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per size; each metric is the median of the runs")
+    args = parser.parse_args()
+
+    sizes = {label: SIZES[label.lower()] if label.lower() in SIZES else int(label) for label in args.sizes}
+    vectors = None
+    if args.vectors:
+        vectors = np.load(args.vectors, mmap_mode="r")
+        if len(vectors) < max(sizes.values()) + args.queries:
+            parser.error(f"{args.vectors} has {len(vectors)} rows, need {max(sizes.values()) + args.queries}")
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        args.dim = vectors.shape[1]
+
+    report = {"environment": environment(),
+              "parameters": {"dim": args.dim, "queries": args.queries, "k": args.k, "batch_size": args.batch_size,
+                             "n_probe": args.n_probe, "seed": args.seed, "vectors": args.vectors or "synthetic",
+                             "repeat": args.repeat},
+              "results": {}}
+    for label, n in sizes.items():
+        print(f"Benchmarking {label} ({n} chunks)...")
+        start = time.perf_counter()
+        runs = [run_size(n, args, vectors) for _ in range(max(1, args.repeat))]
+        report["results"][label] = {name: float(np.median([run[name] for run in runs]))
+                                    if isinstance(value, float) else value for name, value in runs[0].items()}
+        print(f"  done in {time.perf_counter() - start:.1f} s")
+
+    print_results(report["results"])
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    exit_code = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("parameters") != report["parameters"]:
+            print(f"Note: baseline parameters differ ({baseline.get('parameters')}); only comparable metrics are shown.")
+        if baseline.get("environment", {}).get("machine") != report["environment"]["machine"]:
+            print(f"Note: baseline is from {baseline.get('environment', {}).get('machine')}, timings may not be comparable.")
+        rows, regressions = compare(report, baseline, args.tolerance)
+        print(f"\nAgainst {args.baseline} (commit {baseline.get('environment', {}).get('commit')}):")
+        for size, name, old, value, change, verdict in rows:
+            if verdict:
+                print(f"  {size:5} {name:32} {old:>12.4f} -> {value:>12.4f} {change:>+8.1%} {verdict}")
+        print(f"{len(rows)} metrics compared, {len(regressions)} regression(s) beyond {args.tolerance:.0%}.")
+        exit_code = 1 if regressions else 0
+    elif args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to store one.")
+    raise SystemExit(exit_code)
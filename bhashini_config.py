@@ -0,0 +1,296 @@
+import json
+import os
+import threading
+import time
+import requests
+
+from singleflight import SingleFlight
+
+# Bhashini pipeline configuration cache. The ULCA getModelsPipeline call returns the
+# serviceId of the model for a task and language pair, plus the inference endpoint and
+# its auth header. Entries are keyed by (task, source language, target language), kept
+# for BHASHINI_CONFIG_TTL, refreshed in the background before they expire and persisted
+# to disk, so inference calls normally never wait for a config round trip.
+
+CONFIG_ENDPOINT = os.getenv("BHASHINI_CONFIG_ENDPOINT", "https://meity-auth.ulcacontrib.org/ulca/apis/v0/model/getModelsPipeline")
+PIPELINE_ID = os.getenv("BHASHINI_PIPELINE_ID", "64392f96daac500b55c543cd")  # MeitY pipeline
+CONFIG_TTL = float(os.getenv("BHASHINI_CONFIG_TTL", "21600"))           # seconds an entry is fresh
+# Once this fraction of the TTL has passed, a lookup still returns the entry but refreshes it in the background
+REFRESH_AHEAD = float(os.getenv("BHASHINI_CONFIG_REFRESH_AHEAD", "0.8"))
+# An expired entry is still used for this long if ULCA cannot be reached to refresh it
+STALE_GRACE = float(os.getenv("BHASHINI_CONFIG_STALE_GRACE", "86400"))
+FETCH_TIMEOUT = float(os.getenv("BHASHINI_CONFIG_TIMEOUT", "20"))
+# Holds the inference auth token, so the file is created readable by the owner only
+CACHE_PATH = os.getenv("BHASHINI_CONFIG_CACHE", os.path.join("legal_data", ".bhashini", "pipeline_configs.json"))
+CACHE_FORMAT_VERSION = 1
+
+TASKS = ("asr", "translation", "tts")
+
+
+class BhashiniConfigError(Exception):
+    """No usable pipeline configuration: ULCA failed or did not offer a model for the language pair."""
+
+
+class TaskConfig:
+    """The model and inference endpoint for one (task, source, target) key."""
+
+    def __init__(self, task, source, target, service_id, model_id, language, inference_endpoint,
+                 auth_key, auth_value, fetched_at):
+        self.task = task
+        self.source = source
+        self.target = target
+        self.service_id = service_id
+        self.model_id = model_id
+        self.language = language
+        self.inference_endpoint = inference_endpoint
+        self.auth_key = auth_key
+        self.auth_value = auth_value
+        self.fetched_at = fetched_at
+
+    @property
+    def key(self):
+        return (self.task, self.source, self.target)
+
+    def headers(self):
+        """Headers for a call to inference_endpoint."""
+        return {"Content-Type": "application/json", self.auth_key: self.auth_value}
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def config_key(task, source, target=None):
+    """Cache key for a task: ASR and TTS have no target language."""
+    if task not in TASKS:
+        raise ValueError(f"Unknown Bhashini task: {task} (expected one of {', '.join(TASKS)})")
+    return (task, source, target if task == "translation" else None)
+
+
+def _task_payload(task, source, target):
+    language = {"sourceLanguage": source}
+    if target:
+        language["targetLanguage"] = target
+    return {"taskType": task, "config": {"language": language}}
+
+
+def fetch_pipeline_configs(keys, endpoint=None, timeout=FETCH_TIMEOUT):
+    """
+    Asks ULCA for the configuration of every key in one getModelsPipeline call.
+    Returns {key: TaskConfig}; raises BhashiniConfigError if the call fails or a key got no model.
+    """
+    keys = list(keys)
+    headers = {
+        "Content-Type": "application/json",
+        "userID": os.getenv("BHASHINI_USER_ID", ""),
+        "ulcaApiKey": os.getenv("BHASHINI_API_KEY", ""),
+    }
+    payload = {
+        "pipelineTasks": [_task_payload(*key) for key in keys],
+        "controlConfig": {"dataTracking": True},
+        "pipelineRequestConfig": {"pipelineId": PIPELINE_ID},
+    }
+    try:
+        response = requests.post(endpoint or CONFIG_ENDPOINT, headers=headers, json=payload, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise BhashiniConfigError(f"getModelsPipeline failed: {e}")
+
+    inference = data.get("pipelineInferenceAPIEndPoint") or {}
+    api_key = inference.get("inferenceApiKey") or {}
+    if not (inference.get("callbackUrl") and api_key.get("name") and api_key.get("value")):
+        raise BhashiniConfigError("getModelsPipeline response has no inference endpoint or key")
+
+    # Models are matched to keys by language; a model without language details goes to the
+    # request task in the same position, which is how ULCA orders its response.
+    configs = {}
+    entries = data.get("pipelineResponseConfig") or []
+    fetched_at = time.time()
+    for position, entry in enumerate(entries):
+        task = entry.get("taskType")
+        for model in entry.get("config") or []:
+            language = model.get("language") or {}
+            if language.get("sourceLanguage"):
+                key = (task, language["sourceLanguage"], language.get("targetLanguage") if task == "translation" else None)
+            elif position < len(keys) and keys[position][0] == task:
+                key = keys[position]
+            else:
+                continue
+            if key in configs or not model.get("serviceId"):
+                continue
+            configs[key] = TaskConfig(*key, model["serviceId"], model.get("modelId"), language,
+                                      inference["callbackUrl"], api_key["name"], api_key["value"], fetched_at)
+
+    missing = [key for key in keys if key not in configs]
+    if missing:
+        raise BhashiniConfigError(f"No Bhashini model offered for {', '.join('/'.join(filter(None, k)) for k in missing)}")
+    return {key: configs[key] for key in keys}
+
+
+class PipelineConfigCache:
+    """
+    TTL cache of TaskConfig by (task, source, target), persisted as JSON at path.
+    get() returns fresh entries immediately and refreshes ageing ones in the background;
+    concurrent misses for a key share one getModelsPipeline call. A persisted file written
+    for a different config endpoint or pipeline is ignored.
+    """
+
+    def __init__(self, path=CACHE_PATH, endpoint=None, ttl=CONFIG_TTL, refresh_ahead=REFRESH_AHEAD,
+                 stale_grace=STALE_GRACE, fetch=fetch_pipeline_configs):
+        self.path = path
+        self.endpoint = endpoint or CONFIG_ENDPOINT
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.stale_grace = stale_grace
+        self.fetch = fetch
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # Serializes writers of the temporary file
+        self._inflight = SingleFlight()
+        self._stats = {"hits": 0, "misses": 0, "fetches": 0, "background_refreshes": 0,
+                       "fetch_errors": 0, "stale_served": 0}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if (data.get("version"), data.get("endpoint"), data.get("pipeline_id")) != (
+                    CACHE_FORMAT_VERSION, self.endpoint, PIPELINE_ID):
+                return
+            for entry in data["entries"]:
+                config = TaskConfig.from_dict(entry)
+                self._entries[config.key] = config
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Bhashini config cache could not be read ({e}), starting empty.")
+            self._entries = {}
+
+    def _save(self):
+        """Writes every entry to a temporary file and renames it over the cache file."""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._save_lock:
+            with self._lock:
+                entries = [config.to_dict() for config in self._entries.values()]
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_FORMAT_VERSION, "endpoint": self.endpoint, "pipeline_id": PIPELINE_ID,
+                           "entries": entries}, f)
+            os.replace(tmp_path, self.path)
+
+    def _fetch(self, keys):
+        """Fetches keys from ULCA, stores and persists them. Returns {key: TaskConfig}."""
+        with self._lock:
+            self._stats["fetches"] += 1
+        try:
+            configs = self.fetch(keys, endpoint=self.endpoint)
+        except BhashiniConfigError:
+            with self._lock:
+                self._stats["fetch_errors"] += 1
+            raise
+        with self._lock:
+            self._entries.update(configs)
+        self._persist()
+        return configs
+
+    def _persist(self):
+        """Saves the cache file; an unwritable cache only costs a refetch after restart, so it is logged."""
+        try:
+            self._save()
+        except OSError as e:
+            print(f"Bhashini config cache could not be written: {e}")
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self._stats["background_refreshes"] += 1
+
+        def run():
+            try:
+                self._inflight.do(key, lambda: self._fetch([key]))
+            except BhashiniConfigError as e:
+                print(f"Background refresh of Bhashini config {key} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name="bhashini-config-refresh", daemon=True).start()
+
+    def get(self, task, source, target=None):
+        """
+        Returns the TaskConfig for a task and language pair, fetching it only if it is missing
+        or expired. If that fetch fails, an entry expired less than stale_grace ago is returned
+        instead; otherwise BhashiniConfigError is raised.
+        """
+        key = config_key(task, source, target)
+        now = time.time()
+        with self._lock:
+            config = self._entries.get(key)
+            if config is not None and now - config.fetched_at < self.ttl:
+                self._stats["hits"] += 1
+                refresh = now - config.fetched_at >= self.ttl * self.refresh_ahead
+            else:
+                self._stats["misses"] += 1
+                refresh = None
+        if refresh is not None:
+            if refresh:
+                self._refresh_in_background(key)
+            return config
+
+        try:
+            configs, _ = self._inflight.do(key, lambda: self._fetch([key]))
+            return configs[key]
+        except BhashiniConfigError as e:
+            if config is not None and now - config.fetched_at < self.ttl + self.stale_grace:
+                print(f"Using expired Bhashini config for {key}: {e}")
+                with self._lock:
+                    self._stats["stale_served"] += 1
+                return config
+            raise
+
+    def prefetch(self, keys):
+        """
+        Makes sure every (task, source, target) key is cached, fetching all missing or expired
+        ones in a single call. Returns {key: TaskConfig}.
+        """
+        keys = [config_key(*key) for key in keys]
+        now = time.time()
+        with self._lock:
+            stale = [key for key in keys if key not in self._entries or now - self._entries[key].fetched_at >= self.ttl]
+        if stale:
+            self._fetch(stale)
+        with self._lock:
+            return {key: self._entries[key] for key in keys}
+
+    def invalidate(self, task=None, source=None, target=None):
+        """Drops one key, or every entry when called without arguments (e.g. after a 401 from inference)."""
+        with self._lock:
+            if task is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(config_key(task, source, target), None)
+        self._persist()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+# Process-wide cache used by the Bhashini callers
+pipeline_configs = PipelineConfigCache()
+
+
+def get_pipeline_config(task, source, target=None):
+    """Shorthand for pipeline_configs.get()."""
+    return pipeline_configs.get(task, source, target)
@@ -1,6 +1,7 @@
 import os
 import requests
 from dotenv import load_dotenv
+import azure_client
 
 # Load environment variables from .env file
 load_dotenv()
@@ -55,8 +56,8 @@ def check_azure_openai_credentials():
         )
         print(f"Attempting to connect to: {request_url}")
 
-        # Make the POST request to Azure OpenAI
-        response = requests.post(
+        # Make the POST request to Azure OpenAI through the same pooled, retrying client as app.py
+        response = azure_client.post(
             request_url,
             headers=headers,
             json=payload,
@@ -77,6 +78,7 @@ def check_azure_openai_credentials():
         print("Test AI Response (snippet):")
         print(f"'{ai_response_content}'")
         print("\nYour Azure OpenAI credentials appear to be correct and functional.")
+        print(f"Upstream client stats: {azure_client.stats()}")
 
     except requests.exceptions.HTTPError as e:
         print(f"\nERROR: HTTP Error occurred: {e.response.status_code} - {e.response.reason}")
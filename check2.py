@@ -6,141 +6,53 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+# Imported after load_dotenv so .env can set the BHASHINI_CONFIG_* options
+from bhashini_config import BhashiniConfigError, pipeline_configs
+
 # --- Configuration ---
 BHASHINI_USER_ID = os.getenv("BHASHINI_USER_ID")
 BHASHINI_ULCA_API_KEY = os.getenv("BHASHINI_API_KEY")
 
-# Endpoint for fetching pipeline configurations
-BHASHINI_PIPELINE_CONFIG_ENDPOINT = "https://meity-auth.ulcacontrib.org/ulca/apis/v0/model/getModelsPipeline"
-BHASHINI_SPECIFIC_PIPELINE_ID = "64392f96daac500b55c543cd" # MeitY Pipeline ID
-
-# Global store for dynamically fetched pipeline configurations
-# This will hold: {"translation": {...}, "asr": {...}, "tts": {...}, "inferenceEndpoint": "...", "computeAuthKey": "...", "computeAuthValue": "..."}
-global_pipeline_configs = {}
+# Pipeline configurations (serviceId, inference endpoint and auth per task and language pair)
+# come from the shared cache in bhashini_config.py, which persists them across runs.
+# Language pair each check below uses, by task: (source language, target language)
+check_languages = {"asr": ("en", None), "translation": ("en", "hi"), "tts": ("en", None)}
 
 def fetch_all_pipeline_configs(asr_source_lang="en", translation_source_lang="en", translation_target_lang="hi", tts_input_lang="en"):
     """
-    Fetches configurations for ASR, Translation, and TTS in a single call
-    and stores them globally for subsequent inference calls. This method is crucial
-    for obtaining the correct dynamic service IDs and inference endpoint.
+    Makes sure the configurations for ASR, Translation and TTS are available, fetching any
+    that are not cached (or have expired) in a single getModelsPipeline call.
+    This method is crucial for obtaining the correct dynamic service IDs and inference endpoint.
     """
-    global global_pipeline_configs
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'userID': BHASHINI_USER_ID,
-        'ulcaApiKey': BHASHINI_ULCA_API_KEY,
-        # Default headers for a general HTTP call, removed mobile-mimicking headers for simplicity
-    }
-    
-    # Construct the payload to request configs for ASR, Translation, and TTS
-    # based on the comprehensive structure that worked in Postman.
-    payload = {
-        "pipelineTasks": [
-            {
-                "taskType": "asr",
-                "config": {
-                    "language": {
-                        "sourceLanguage": asr_source_lang
-                    }
-                }
-            },
-            {
-                "taskType": "translation",
-                "config": {
-                    "language": {
-                        "sourceLanguage": translation_source_lang,
-                        "targetLanguage": translation_target_lang
-                    }
-                }
-            },
-            {  
-                "taskType": "tts",
-                "config": {
-                    "language": {
-                        "sourceLanguage": tts_input_lang # Language of the text input for TTS
-                    }
-                }
-            }
-        ],
-        "controlConfig": {
-            "dataTracking": True 
-        },
-        "pipelineRequestConfig": {
-            "pipelineId": BHASHINI_SPECIFIC_PIPELINE_ID
-        }
-    }
-
-    print(f"\nDEBUG: Calling overall pipeline config endpoint: {BHASHINI_PIPELINE_CONFIG_ENDPOINT}")
-    print(f"DEBUG: Pipeline Config Request Headers: {headers}")
-    print(f"DEBUG: Pipeline Config Request Payload: {json.dumps(payload, indent=2)}")
-
+    check_languages.update({
+        "asr": (asr_source_lang, None),
+        "translation": (translation_source_lang, translation_target_lang),
+        "tts": (tts_input_lang, None),
+    })
+    keys = [(task, source, target) for task, (source, target) in check_languages.items()]
     try:
-        response = requests.post(BHASHINI_PIPELINE_CONFIG_ENDPOINT, headers=headers, json=payload, timeout=20)
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-        data = response.json()
-        
-        # Store common inference endpoint and auth details
-        if data.get("pipelineInferenceAPIEndPoint"):
-            inference_api_endpoint_info = data["pipelineInferenceAPIEndPoint"]
-            global_pipeline_configs["inferenceEndpoint"] = inference_api_endpoint_info.get("callbackUrl")
-            
-            inference_api_key_info = inference_api_endpoint_info.get("inferenceApiKey")
-            if inference_api_key_info:
-                global_pipeline_configs["computeAuthKey"] = inference_api_key_info.get("name")
-                global_pipeline_configs["computeAuthValue"] = inference_api_key_info.get("value")
-
-        # Extract specific configs (serviceId, modelId, language_info) for each task type
-        if data.get("pipelineResponseConfig") and len(data["pipelineResponseConfig"]) > 0:
-            for task_config_entry in data["pipelineResponseConfig"]:
-                task_type = task_config_entry.get("taskType")
-                if task_type and task_config_entry.get("config") and len(task_config_entry["config"]) > 0:
-                    # Take the first available config for that task type
-                    config_details = task_config_entry["config"][0]
-                    global_pipeline_configs[task_type] = {
-                        "serviceId": config_details.get("serviceId"),
-                        "modelId": config_details.get("modelId"), # modelId can be useful for other calls/feedback
-                        "language_info": config_details.get("language") # Store full language object for reference
-                    }
-        
-        # Validate that we got all expected configurations
-        if (global_pipeline_configs.get("inferenceEndpoint") and 
-            global_pipeline_configs.get("computeAuthKey") and
-            global_pipeline_configs.get("computeAuthValue") and
-            global_pipeline_configs.get("asr") and 
-            global_pipeline_configs.get("translation") and 
-            global_pipeline_configs.get("tts")):
-            print("\nDEBUG: Successfully fetched all pipeline configurations.")
-            return True
-        else:
-            print(f"ERROR: Failed to fetch all required pipeline configs. Full response: {json.dumps(data, indent=2)}")
-            global_pipeline_configs = {} # Clear partial config
-            return False
-    except requests.exceptions.RequestException as e:
+        pipeline_configs.prefetch(keys)
+    except BhashiniConfigError as e:
         print(f"ERROR: Failed to fetch overall pipeline config: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"  Response status: {e.response.status_code}")
-            print(f"  Response body: {e.response.text}")
-        global_pipeline_configs = {}
         return False
+    print(f"\nDEBUG: Pipeline configurations ready (cache: {pipeline_configs.stats()}).")
+    return True
 
 
 def get_task_specific_pipeline_info(task_type):
-    """Retrieves specific pipeline info for a given task from the globally stored configs."""
-    if not global_pipeline_configs:
-        print("ERROR: Pipeline configurations not fetched yet. Call fetch_all_pipeline_configs first.")
-        return None
-    
-    task_info = global_pipeline_configs.get(task_type)
-    if not task_info:
-        print(f"ERROR: No pipeline configuration found for task type: {task_type}")
+    """Retrieves specific pipeline info for a given task from the config cache."""
+    source, target = check_languages[task_type]
+    try:
+        config = pipeline_configs.get(task_type, source, target)
+    except BhashiniConfigError as e:
+        print(f"ERROR: No pipeline configuration for task type {task_type}: {e}")
         return None
-    
+
     return {
-        "serviceId": task_info["serviceId"],
-        "inferenceEndpoint": global_pipeline_configs["inferenceEndpoint"],
-        "computeAuthKey": global_pipeline_configs["computeAuthKey"],
-        "computeAuthValue": global_pipeline_configs["computeAuthValue"]
+        "serviceId": config.service_id,
+        "inferenceEndpoint": config.inference_endpoint,
+        "computeAuthKey": config.auth_key,
+        "computeAuthValue": config.auth_value
     }
 
 
@@ -0,0 +1,129 @@
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """
+    Collects texts submitted by concurrent request threads and encodes them together.
+    A batch is flushed when it holds max_batch_size texts or max_wait_ms after its
+    first text arrived, whichever comes first. Each caller gets back its own vector.
+    """
+
+    def __init__(self, encode, max_batch_size=32, max_wait_ms=5.0):
+        self.encode_batch = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "items": 0, "max_batch": 0, "encode_seconds": 0.0}
+
+    def submit(self, text):
+        """Queues one text and returns a Future resolving to its embedding vector."""
+        if self._thread is None:
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text, timeout=None):
+        """Blocks until the batch holding text has been encoded and returns its vector."""
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect(self):
+        """Blocks for the first item, then gathers more until the batch is full or the wait expires."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            start = time.perf_counter()
+            try:
+                vectors = np.asarray(self.encode_batch(texts), dtype=np.float32)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start
+
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+            with self._stats_lock:
+                self._stats["batches"] += 1
+                self._stats["items"] += len(batch)
+                self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+                self._stats["encode_seconds"] += elapsed
+
+    def stats(self):
+        """Batch counters; mean_batch close to 1 means requests are not overlapping."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["mean_batch"] = stats["items"] / stats["batches"] if stats["batches"] else 0.0
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+def measure(encode, queries, concurrency, max_batch_size, max_wait_ms):
+    """
+    Sends queries from `concurrency` threads through a fresh batcher.
+    Returns throughput (queries/second), p50/p95 latency in ms and the batcher stats.
+    """
+    batcher = EmbeddingBatcher(encode, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    batcher.encode(queries[0])  # Start the worker thread outside the timed region
+
+    def one(text):
+        t0 = time.perf_counter()
+        batcher.encode(text)
+        return (time.perf_counter() - t0) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = np.array(list(pool.map(one, queries)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "max_batch_size": max_batch_size,
+        "max_wait_ms": max_wait_ms,
+        "qps": len(queries) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_batch": batcher.stats()["mean_batch"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput versus latency of batched query encoding.")
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--max-batch", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--max-wait-ms", type=float, nargs="+", default=[2.0, 5.0])
+    args = parser.parse_args()
+
+    from rag_utils import get_model
+    model = get_model()
+    sample = [f"What does section {i} of the act say about tenant eviction?" for i in range(args.requests)]
+
+    print(f"{'conc':>5} {'batch':>6} {'wait':>6} {'qps':>9} {'p50 ms':>8} {'p95 ms':>8} {'mean batch':>11}")
+    for concurrency in args.concurrency:
+        for max_batch in args.max_batch:
+            for max_wait in args.max_wait_ms:
+                row = measure(lambda b: model.encode(b, convert_to_numpy=True), sample, concurrency, max_batch, max_wait)
+                print(f"{concurrency:>5} {max_batch:>6} {max_wait:>6.1f} {row['qps']:>9.1f} "
+                      f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['mean_batch']:>11.1f}")
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import re
+import numpy as np
+
+# Embeddings are cached next to the corpus so every worker on the host can reuse them.
+CACHE_DIR = os.path.join("legal_data", ".embeddings")
+CACHE_FORMAT_VERSION = 1
+
+
+def chunk_hash(text, model_name):
+    """
+    Returns the content address of a chunk: a SHA-256 over the model name and the chunk text.
+    The same text embedded by a different model gets a different key.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _manifest_path(cache_dir, model_name):
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+    return os.path.join(cache_dir, f"{safe_name}.json")
+
+
+def _load_cache(cache_dir, model_name):
+    """
+    Loads the cached vectors (memory-mapped) for model_name.
+    Returns (hashes, vectors) or ([], None) if the cache is missing, stale or corrupt.
+    """
+    manifest_path = _manifest_path(cache_dir, model_name)
+    if not os.path.exists(manifest_path):
+        return [], None
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        if manifest.get("version") != CACHE_FORMAT_VERSION or manifest.get("model") != model_name:
+            print("Embedding cache is stale (format or model changed), rebuilding.")
+            return [], None
+
+        hashes = manifest["hashes"]
+        vectors = np.load(os.path.join(cache_dir, manifest["vectors_file"]), mmap_mode="r")
+        if vectors.dtype != np.float32 or vectors.shape != (len(hashes), manifest["dim"]):
+            print("Embedding cache is corrupt (shape mismatch), rebuilding.")
+            return [], None
+        return hashes, vectors
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Embedding cache could not be read ({e}), rebuilding.")
+        return [], None
+
+
+def _save_cache(cache_dir, model_name, hashes, vectors):
+    """
+    Writes the vectors and then the manifest that points at them.
+    Both are written to temporary files and renamed, so readers never see a half-written cache.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = _manifest_path(cache_dir, model_name)
+
+    # The vectors file name carries a digest of its row keys, pairing it with exactly one manifest.
+    keys_digest = hashlib.sha256("".join(hashes).encode("ascii")).hexdigest()[:16]
+    vectors_file = os.path.basename(manifest_path)[:-len(".json")] + f"-{keys_digest}.npy"
+    vectors_path = os.path.join(cache_dir, vectors_file)
+
+    tmp_vectors_path = vectors_path + ".tmp"
+    with open(tmp_vectors_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+    os.replace(tmp_vectors_path, vectors_path)
+
+    previous_vectors_file = None
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                previous_vectors_file = json.load(f).get("vectors_file")
+        except (OSError, ValueError):
+            pass
+
+    manifest = {
+        "version": CACHE_FORMAT_VERSION,
+        "model": model_name,
+        "dim": int(vectors.shape[1]),
+        "vectors_file": vectors_file,
+        "hashes": hashes,
+    }
+    tmp_manifest_path = manifest_path + ".tmp"
+    with open(tmp_manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest_path, manifest_path)
+
+    if previous_vectors_file and previous_vectors_file != vectors_file:
+        try:
+            os.remove(os.path.join(cache_dir, previous_vectors_file))
+        except OSError:
+            pass
+
+
+def encode_with_cache(texts, encode, model_name, cache_dir=CACHE_DIR):
+    """
+    Returns a float32 (len(texts), dim) array of embeddings for texts.
+    Chunks whose hash is already in the on-disk cache are reused; only new or changed
+    chunks are passed to encode(list_of_texts). The cache is rewritten to hold exactly
+    the current chunks whenever anything changed.
+    """
+    hashes = [chunk_hash(text, model_name) for text in texts]
+    cached_hashes, cached_vectors = _load_cache(cache_dir, model_name)
+
+    # Fast path: corpus unchanged, serve the memory-mapped array as is.
+    if cached_vectors is not None and cached_hashes == hashes:
+        print(f"Loaded {len(hashes)} embeddings from cache.")
+        return cached_vectors
+
+    row_of = {h: i for i, h in enumerate(cached_hashes)}
+    missing = [i for i, h in enumerate(hashes) if h not in row_of]
+    print(f"Embedding cache: {len(hashes) - len(missing)} hits, {len(missing)} chunks to encode.")
+
+    new_vectors = None
+    if missing:
+        new_vectors = np.asarray(encode([texts[i] for i in missing]), dtype=np.float32)
+        if new_vectors.ndim != 2 or new_vectors.shape[0] != len(missing):
+            raise ValueError("encode() returned an unexpected shape")
+
+    hit_rows = [i for i, h in enumerate(hashes) if h in row_of]
+    if new_vectors is not None and hit_rows and cached_vectors.shape[1] != new_vectors.shape[1]:
+        # Same model name but a different output size: nothing in the cache can be trusted.
+        print("Embedding cache is stale (dimension changed), re-encoding all chunks.")
+        missing, hit_rows = list(range(len(texts))), []
+        new_vectors = np.asarray(encode(texts), dtype=np.float32)
+
+    dim = new_vectors.shape[1] if new_vectors is not None else cached_vectors.shape[1]
+    vectors = np.empty((len(texts), dim), dtype=np.float32)
+    if new_vectors is not None:
+        vectors[missing] = new_vectors
+    if hit_rows:
+        vectors[hit_rows] = cached_vectors[[row_of[hashes[i]] for i in hit_rows]]
+
+    try:
+        _save_cache(cache_dir, model_name, hashes, vectors)
+    except OSError as e:
+        # A read-only deployment can still serve; it just won't benefit from the cache.
+        print(f"Warning: could not write embedding cache: {e}")
+
+    return vectors
@@ -0,0 +1,190 @@
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from metadata_index import tag_chunk
+
+DATA_DIR = "legal_data"
+DOCUMENT_EXTENSIONS = (".txt", ".md")
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces; 200 whitespace tokens stays safely under that.
+MAX_CHUNK_TOKENS = int(os.getenv("RAG_MAX_CHUNK_TOKENS", "200"))
+MIN_CHUNK_TOKENS = 5
+# Part of the snapshot fingerprint; bump when chunk boundaries or metadata tagging change
+CHUNKER_VERSION = 2
+ENCODE_BATCH_SIZE = int(os.getenv("RAG_ENCODE_BATCH_SIZE", "64"))
+ENCODE_WORKERS = int(os.getenv("RAG_ENCODE_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+
+# Structural headings found in bare acts. Each one starts a new chunk.
+ACT_HEADING = re.compile(r"^\s*(?:THE\s+)?(.{3,100}?\bACT\b,?\s*\d{4})\.?\s*$", re.IGNORECASE)
+PART_HEADING = re.compile(r"^\s*PART\s+([IVXLC]+[A-Z]?|\d+[A-Z]?)\b", re.IGNORECASE)
+CHAPTER_HEADING = re.compile(r"^\s*CHAPTER\s+([IVXLC]+[A-Z]?|\d+[A-Z]?)\b", re.IGNORECASE)
+SECTION_HEADING = re.compile(r"^\s*(?:(?:Section|Sec\.)\s+(\d+[A-Z]*)\b|(\d+[A-Z]*)\.\s+\S)")
+ARTICLE_HEADING = re.compile(r"^\s*Article\s+(\d+[A-Z]*)\b")
+SCHEDULE_HEADING = re.compile(r"^\s*(?:THE\s+)?(\w+\s+)?SCHEDULE\s*$", re.IGNORECASE)
+
+# Fallbacks for flat files where each paragraph names its own act or article.
+# An act name is capitalised words, optionally joined by lowercase connectors ("Right to Information")
+# and with parenthesised parts ("(POCSO)", "(Prevention of Atrocities)"); the year may be missing.
+# A bare "This Act" / "The Act" refers back to the surrounding act and is not a mention.
+ACT_MENTION = re.compile(
+    r"\b(?!(?:This|That|The|Such|Said|Any|An?)\s+Act\b)([A-Z][\w&'-]*(?:\s+(?:(?:of|to|and|for|from|on|in)\s+)*(?:[A-Z][\w&'-]*|\([^()\n]+\)))*\s+Act)\b(?:,?\s+(\d{4}))?"
+)
+PROVISION_MENTION = re.compile(r"\b(Article|Section)\s+(\d+[A-Z]*)\b")
+
+
+def iter_documents(data_dir=DATA_DIR):
+    """Yields the path of every document under data_dir in a stable order, skipping hidden directories."""
+    for root, dirs, files in os.walk(data_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if name.endswith(DOCUMENT_EXTENSIONS) and not name.startswith("."):
+                yield os.path.join(root, name)
+
+
+def _iter_lines(path):
+    """Streams (byte_offset, line) pairs from a UTF-8 file without reading it into memory."""
+    offset = 0
+    with open(path, "rb") as f:
+        for raw in f:
+            yield offset, raw.decode("utf-8", errors="replace").rstrip("\r\n")
+            offset += len(raw)
+
+
+def _split_long_line(offset, line, max_tokens):
+    """Splits a line holding more than max_tokens words into windows, each with its own byte offset."""
+    words = list(re.finditer(r"\S+", line))
+    for i in range(0, len(words), max_tokens):
+        window = words[i:i + max_tokens]
+        start, end = window[0].start(), window[-1].end()
+        yield offset + len(line[:start].encode("utf-8")), line[start:end], len(window)
+
+
+def iter_chunks(path, data_dir=DATA_DIR, max_tokens=MAX_CHUNK_TOKENS):
+    """
+    Streams one document and yields chunk dicts with keys text, act, chapter, section, source,
+    offset (byte offset of the chunk in the file), year and personas (see metadata_index.py).
+    A chunk ends at every Act/Part/Chapter/Section/Article/Schedule heading and whenever it
+    would exceed max_tokens. Outside a section or article, each paragraph is its own chunk;
+    inside one, paragraphs are packed together up to the token cap. Fragments shorter than
+    MIN_CHUNK_TOKENS (bare headings such as "CHAPTER II") are carried into the next chunk.
+    """
+    source = os.path.relpath(path, data_dir)
+    context = {"act": None, "chapter": None, "section": None}
+    lines, start, n_tokens = [], None, 0
+
+    def make_chunk():
+        chunk = dict(context, text="\n".join(lines).strip(), source=source, offset=start)
+        if chunk["act"] is None:
+            match = ACT_MENTION.search(chunk["text"])
+            if match:
+                name = re.sub(r"^The ", "", match.group(1))
+                chunk["act"] = f"{name}, {match.group(2)}" if match.group(2) else name
+        if chunk["section"] is None:
+            match = PROVISION_MENTION.search(chunk["text"])
+            if match:
+                chunk["section"] = f"{match.group(1)} {match.group(2)}"
+        return tag_chunk(chunk)
+
+    for offset, line in _iter_lines(path):
+        stripped = line.strip()
+
+        heading = None
+        if ACT_HEADING.match(stripped) and len(stripped.split()) <= 15:
+            heading = {"act": ACT_HEADING.match(stripped).group(1), "chapter": None, "section": None}
+        elif PART_HEADING.match(stripped) or CHAPTER_HEADING.match(stripped):
+            heading = {"chapter": stripped, "section": None}
+        elif ARTICLE_HEADING.match(stripped):
+            heading = {"section": "Article " + ARTICLE_HEADING.match(stripped).group(1)}
+        elif SECTION_HEADING.match(stripped):
+            match = SECTION_HEADING.match(stripped)
+            heading = {"section": "Section " + (match.group(1) or match.group(2))}
+        elif SCHEDULE_HEADING.match(stripped):
+            heading = {"chapter": stripped, "section": None}
+
+        line_tokens = len(stripped.split())
+        boundary = heading is not None or (not stripped and context["section"] is None)
+        over_cap = lines and n_tokens + line_tokens > max_tokens
+        if over_cap and line_tokens > max_tokens and n_tokens < MIN_CHUNK_TOKENS:
+            over_cap = False  # A short carried heading joins the first window of the long line instead
+        if (boundary and n_tokens >= MIN_CHUNK_TOKENS) or over_cap:
+            yield make_chunk()
+            lines, start, n_tokens = [], None, 0
+        if heading is not None:
+            context.update(heading)
+        if not stripped:
+            if lines:
+                lines.append("")
+            continue
+
+        if line_tokens > max_tokens:
+            for window_offset, window, window_tokens in _split_long_line(offset, line, max_tokens):
+                if start is None:
+                    start = window_offset
+                lines.append(window)
+                yield make_chunk()
+                lines, start, n_tokens = [], None, 0
+            continue
+
+        if start is None:
+            start = offset
+        lines.append(line)
+        n_tokens += line_tokens
+
+    if n_tokens:
+        yield make_chunk()
+
+
+def iter_corpus(data_dir=DATA_DIR, max_tokens=MAX_CHUNK_TOKENS):
+    """Yields the chunks of every document under data_dir, one file at a time."""
+    for path in iter_documents(data_dir):
+        yield from iter_chunks(path, data_dir, max_tokens)
+
+
+# --- Parallel encoding ---
+
+_worker_model = None
+
+
+def _init_worker(model_name):
+    """Loads one model per worker process. Torch is pinned to one thread so workers don't oversubscribe cores."""
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_batch(batch):
+    return _worker_model.encode(batch, convert_to_numpy=True)
+
+
+def encode_parallel(texts, model_name, local_encode, batch_size=ENCODE_BATCH_SIZE, workers=ENCODE_WORKERS):
+    """
+    Encodes texts in batches of batch_size and returns a float32 (len(texts), dim) array.
+    Small jobs (or workers <= 1) run in-process through local_encode(batch). Larger jobs
+    are spread over a process pool with at most 2 * workers batches in flight, so memory
+    stays bounded regardless of corpus size. Workers are spawned, not forked: this runs on
+    the loader threads of a server that may already hold torch and the model, and a forked
+    child of a multithreaded process can deadlock on a lock another thread was holding.
+    """
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if workers <= 1 or len(batches) <= workers:
+        return np.vstack([np.asarray(local_encode(b), dtype=np.float32) for b in batches])
+
+    results = [None] * len(batches)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(model_name,)) as pool:
+        in_flight = {}
+        next_batch = 0
+        while next_batch < len(batches) or in_flight:
+            while next_batch < len(batches) and len(in_flight) < 2 * workers:
+                in_flight[next_batch] = pool.submit(_encode_batch, batches[next_batch])
+                next_batch += 1
+            done = min(in_flight)
+            results[done] = np.asarray(in_flight.pop(done).result(), dtype=np.float32)
+    return np.vstack(results)
@@ -0,0 +1,434 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import aiohttp
+import requests
+
+import azure_client
+from admission import estimate_tokens
+
+# Routes chat completions across several Azure OpenAI deployments (regions/models).
+# Each request goes to the deployment with the best rolling latency and error rate.
+# If it hasn't answered within that deployment's p95 latency, a hedged copy is sent
+# to the next best deployment and whichever answers first wins; the other is dropped.
+# Deployments that keep failing are ejected for a cooldown, then receive one probe
+# request (half-open) and rejoin the rotation if it succeeds. Given the admission limiter,
+# every hedge and failover is charged to the upstream quota first, and skipped if the
+# quota has no headroom: extra attempts must not cause the 429s admission prevents.
+#
+# AZURE_OPENAI_DEPLOYMENTS is a JSON list such as
+#   [{"name": "india-south", "endpoint": "https://...", "deployment": "gpt-35"},
+#    {"name": "east-us", "endpoint": "https://...", "api_key": "..."}]
+# Missing fields fall back to the single-deployment AZURE_OPENAI_* variables.
+
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "1").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))          # seconds
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "5"))    # until enough latency samples
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "10"))
+LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "100"))              # recent requests kept per deployment
+EJECT_AFTER = int(os.getenv("LLM_EJECT_AFTER", "3"))                      # consecutive failures
+EJECT_COOLDOWN = float(os.getenv("LLM_EJECT_COOLDOWN", "10"))             # seconds, doubled per repeated ejection
+EJECT_COOLDOWN_MAX = float(os.getenv("LLM_EJECT_COOLDOWN_MAX", "120"))
+ATTEMPT_WORKERS = int(os.getenv("LLM_ATTEMPT_WORKERS", "64"))
+
+ERROR_DECAY = 0.2    # weight of the latest outcome in the error rate moving average
+ERROR_PENALTY = 4.0  # a deployment failing every request scores 5x its latency
+
+
+class UpstreamError(Exception):
+    """Azure OpenAI answered with a non-success status on every deployment tried."""
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+
+class Deployment:
+    """One Azure OpenAI deployment and its rolling health figures."""
+
+    def __init__(self, name, endpoint, deployment, api_key, api_version):
+        self.name = name
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.api_key = api_key
+        self.api_version = api_version
+        # Seconds to the full response (blocking) or to the response headers (streaming)
+        self.latencies = {False: deque(maxlen=LATENCY_WINDOW), True: deque(maxlen=LATENCY_WINDOW)}
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.probing = False
+        self.in_flight = 0
+        self.counts = {"requests": 0, "failures": 0, "wins": 0}
+
+    def url(self):
+        """Chat completions URL of this deployment."""
+        return f"{self.endpoint}/openai/deployments/{self.deployment}/chat/completions?api-version={self.api_version}"
+
+    def headers(self):
+        """Headers for the Azure OpenAI API request."""
+        return {"Content-Type": "application/json", "api-key": self.api_key}
+
+    def state(self, now):
+        if self.ejected_until > now:
+            return "ejected"
+        return "half-open" if self.ejections else "healthy"
+
+    def score(self, stream):
+        """Lower is better: median latency weighted by the recent error rate. Unmeasured deployments score 0."""
+        samples = self.latencies[stream]
+        latency = _percentile(samples, 50) if samples else 0.0
+        return latency * (1 + ERROR_PENALTY * self.error_rate)
+
+
+def load_deployments(default):
+    """Deployments listed in AZURE_OPENAI_DEPLOYMENTS, or [default] when it is not set."""
+    raw = os.getenv("AZURE_OPENAI_DEPLOYMENTS")
+    if not raw:
+        return [default]
+    deployments = []
+    for i, config in enumerate(json.loads(raw)):
+        deployments.append(Deployment(
+            name=config.get("name") or f"deployment-{i}",
+            endpoint=config.get("endpoint") or default.endpoint,
+            deployment=config.get("deployment") or default.deployment,
+            api_key=config.get("api_key") or default.api_key,
+            api_version=config.get("api_version") or default.api_version,
+        ))
+    return deployments
+
+
+class LLMRouter:
+    """
+    Sends each chat completion to the best deployment, hedges slow attempts and fails over
+    on connection errors, 429 and 5xx. post() serves threaded callers, post_async() event loops.
+    """
+
+    def __init__(self, deployments, hedge=HEDGE_ENABLED, eject_after=EJECT_AFTER,
+                 cooldown=EJECT_COOLDOWN, cooldown_max=EJECT_COOLDOWN_MAX):
+        self.deployments = list(deployments)
+        self.hedge = hedge
+        self.eject_after = eject_after
+        self.cooldown = cooldown
+        self.cooldown_max = cooldown_max
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=ATTEMPT_WORKERS, thread_name_prefix="llm-attempt")
+        self._stats = {"requests": 0, "failovers": 0, "hedged": 0, "hedge_wins": 0, "cancelled": 0,
+                       "hedges_skipped": 0, "failovers_skipped": 0}
+
+    def _choose(self, exclude, stream, last_resort=False):
+        """
+        Picks the deployment for the next attempt and marks it in flight. An ejected deployment
+        whose cooldown has passed gets the next request as its probe. With last_resort, the
+        deployment closest to the end of its ejection is used when every one is ejected.
+        Returns (deployment, is_probe) or None.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [d for d in self.deployments if d.name not in exclude]
+            probes = [d for d in candidates if d.state(now) == "half-open" and not d.probing]
+            healthy = sorted((d for d in candidates if d.state(now) == "healthy"), key=lambda d: d.score(stream))
+            if probes:
+                chosen = probes[0]
+                chosen.probing = True
+            elif healthy:
+                chosen = healthy[0]
+            elif last_resort and candidates:
+                chosen = min(candidates, key=lambda d: d.ejected_until)
+            else:
+                return None
+            chosen.in_flight += 1
+            chosen.counts["requests"] += 1
+            return chosen, bool(probes)
+
+    def _record(self, deployment, probe, stream, latency, failed, throttled=False, retry_after=None):
+        """
+        Updates a deployment's health after an attempt; ejects it or marks it recovered.
+        A throttled (429) deployment is only skipped until its Retry-After has passed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            deployment.error_rate += ERROR_DECAY * ((1.0 if failed else 0.0) - deployment.error_rate)
+            if not failed:
+                deployment.latencies[stream].append(latency)
+                deployment.consecutive_failures = 0
+                if probe:
+                    print(f"LLM deployment {deployment.name} recovered")
+                    deployment.ejections = 0
+                return
+
+            deployment.counts["failures"] += 1
+            if throttled:
+                deployment.ejected_until = max(deployment.ejected_until, now + (retry_after or 1.0))
+                return
+            deployment.consecutive_failures += 1
+            if probe or deployment.consecutive_failures >= self.eject_after:
+                cooldown = min(self.cooldown_max, self.cooldown * 2 ** deployment.ejections)
+                deployment.ejections += 1
+                deployment.ejected_until = max(deployment.ejected_until, now + cooldown)
+                deployment.consecutive_failures = 0
+                print(f"LLM deployment {deployment.name} ejected for {cooldown:.0f} s")
+
+    def _release(self, deployment, probe):
+        with self._lock:
+            deployment.in_flight -= 1
+            if probe:
+                deployment.probing = False
+
+    def _charge(self, choice, limiter, payload, kind):
+        """
+        Reserves upstream budget for an extra (hedge or failover) attempt on choice. Without
+        headroom the choice is handed back and None returned, so the attempt is not sent.
+        """
+        if choice is None or limiter is None or limiter.try_acquire(estimate_tokens(payload)) is not None:
+            return choice
+        deployment, probe = choice
+        self._release(deployment, probe)
+        with self._lock:
+            deployment.counts["requests"] -= 1
+            self._stats[f"{kind}_skipped"] += 1
+        return None
+
+    def hedge_delay(self, deployment, stream):
+        """Seconds to wait on an attempt before hedging: the deployment's recent p95 latency."""
+        samples = list(deployment.latencies[stream])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, _percentile(samples, HEDGE_PERCENTILE))
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _attempt(self, choice, payload, stream, on_throttled):
+        """One request to the deployment chosen by _choose(). Returns (response, error, retryable)."""
+        deployment, probe = choice
+        start = time.perf_counter()
+        try:
+            try:
+                response = azure_client.post(deployment.url(), headers=deployment.headers(), json=payload,
+                                             stream=stream, max_retries=0, on_throttled=on_throttled)
+            except requests.exceptions.RequestException as e:
+                self._record(deployment, probe, stream, None, failed=True)
+                return None, e, True
+            throttled = response.status_code == 429
+            retryable = throttled or response.status_code >= 500
+            retry_after = azure_client.parse_retry_after(response.headers.get("Retry-After")) if throttled else None
+            self._record(deployment, probe, stream, time.perf_counter() - start, retryable, throttled, retry_after)
+            return response, None, retryable
+        finally:
+            self._release(deployment, probe)
+
+    def _next(self, tried, stream, attempt, response=None):
+        """Choice for a failover attempt; backs off first if every deployment was already tried."""
+        choice = self._choose(tried, stream)
+        if choice is None:
+            time.sleep(azure_client.retry_delay(attempt, response))
+            choice = self._choose(set(), stream, last_resort=True)
+        return choice
+
+    def post(self, payload, stream=False, on_throttled=None, limiter=None):
+        """
+        POSTs a chat completion through the best deployment, like azure_client.post().
+        Returns the first successful response (or the last failing one once attempts run
+        out, for the caller's raise_for_status()). A losing hedged attempt can't be aborted
+        from another thread, so its response is closed and discarded when it arrives.
+        limiter (admission.UpstreamLimiter) is charged for hedges and failovers; the first
+        attempt is the caller's own reservation.
+        """
+        self._count("requests")
+        max_attempts = azure_client.MAX_RETRIES + 1
+        pending = {}
+        tried = set()
+        last_response, last_error = None, None
+        hedged = False
+
+        def launch(choice):
+            tried.add(choice[0].name)
+            started = []  # Set by the worker: a busy executor may queue the attempt for a while
+
+            def run():
+                started.append(time.monotonic())
+                return self._attempt(choice, payload, stream, on_throttled)
+
+            pending[self._executor.submit(run)] = (choice[0], started)
+
+        def discard(future):
+            response = future.result()[0]
+            if response is not None:
+                response.close()
+
+        launch(self._choose(tried, stream, last_resort=True))
+        attempts = 1
+        first = None
+        while pending:
+            timeout = None
+            if self.hedge and not hedged and len(pending) == 1:
+                deployment, started = next(iter(pending.values()))
+                delay = self.hedge_delay(deployment, stream)
+                timeout = max(0.0, started[0] + delay - time.monotonic()) if started else delay
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                started = next(iter(pending.values()))[1]
+                if not started or started[0] + delay > time.monotonic():
+                    continue  # The attempt sat in the executor queue: its hedge delay runs from when it started
+                hedged = True
+                choice = self._charge(self._choose(tried, stream), limiter, payload, "hedges")
+                if choice is not None:
+                    first = next(iter(pending.values()))[0]
+                    self._count("hedged")
+                    launch(choice)
+                continue
+
+            for future in done:
+                deployment, _ = pending.pop(future)
+                response, error, retryable = future.result()
+                if not retryable:
+                    with self._lock:
+                        deployment.counts["wins"] += 1
+                    if first is not None and deployment is not first:
+                        self._count("hedge_wins")
+                    for other in pending:
+                        self._count("cancelled")
+                        other.add_done_callback(discard)
+                    pending.clear()
+                    if last_response is not None:
+                        last_response.close()
+                    return response
+
+                if last_response is not None:
+                    last_response.close()
+                last_response, last_error = response, error
+                if pending:
+                    hedged = False  # A failed hedge: the survivor may be hedged again right away
+                elif attempts < max_attempts:
+                    choice = self._next(tried, stream, attempts - 1, response)
+                    choice = self._charge(choice, limiter, payload, "failovers")
+                    if choice is not None:
+                        self._count("failovers")
+                        launch(choice)
+                        attempts += 1
+
+        if last_error is not None:
+            raise last_error
+        return last_response
+
+    async def _attempt_async(self, session, choice, payload, on_throttled):
+        """One request to the deployment chosen by _choose(). Returns (data, error, retryable)."""
+        deployment, probe = choice
+        start = time.perf_counter()
+        try:
+            async with session.post(deployment.url(), headers=deployment.headers(), json=payload) as response:
+                if response.status < 300:
+                    data = await response.json()
+                    self._record(deployment, probe, False, time.perf_counter() - start, False)
+                    return data, None, False
+                error = UpstreamError(f"{response.status} {response.reason}: {await response.text()}")
+                retryable = response.status in azure_client.RETRY_STATUSES
+                throttled = response.status == 429
+                retry_after = None
+                if throttled:
+                    retry_after = azure_client.parse_retry_after(response.headers.get("Retry-After"))
+                    if on_throttled is not None:
+                        on_throttled(retry_after)
+                self._record(deployment, probe, False, time.perf_counter() - start, retryable, throttled, retry_after)
+                return None, error, retryable
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            self._record(deployment, probe, False, None, failed=True)
+            return None, e, True
+        finally:
+            self._release(deployment, probe)
+
+    async def post_async(self, session, payload, on_throttled=None, limiter=None):
+        """
+        Async counterpart of post() for an aiohttp session. Returns the parsed JSON of the
+        first successful response; the losing hedged attempt is cancelled, which aborts its
+        connection. Raises UpstreamError or the connection error of the last attempt.
+        limiter is charged for hedges and failovers, as in post().
+        """
+        self._count("requests")
+        max_attempts = azure_client.MAX_RETRIES + 1
+        pending = {}
+        tried = set()
+        last_error = None
+        hedged = False
+        first = None
+
+        def launch(choice):
+            tried.add(choice[0].name)
+            task = asyncio.ensure_future(self._attempt_async(session, choice, payload, on_throttled))
+            pending[task] = (choice[0], time.monotonic())
+
+        launch(self._choose(tried, False, last_resort=True))
+        attempts = 1
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and len(pending) == 1:
+                    deployment, started = next(iter(pending.values()))
+                    timeout = max(0.0, started + self.hedge_delay(deployment, False) - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    choice = self._charge(self._choose(tried, False), limiter, payload, "hedges")
+                    if choice is not None:
+                        first = next(iter(pending.values()))[0]
+                        self._count("hedged")
+                        launch(choice)
+                    continue
+
+                for task in done:
+                    deployment, _ = pending.pop(task)
+                    data, error, retryable = task.result()
+                    if error is None:
+                        with self._lock:
+                            deployment.counts["wins"] += 1
+                        if first is not None and deployment is not first:
+                            self._count("hedge_wins")
+                        return data
+                    last_error = error
+                    if not retryable:
+                        raise error
+                    if pending:
+                        hedged = False
+                    elif attempts < max_attempts:
+                        choice = self._choose(tried, False)
+                        if choice is None:
+                            await asyncio.sleep(azure_client.retry_delay(attempts - 1))
+                            choice = self._choose(set(), False, last_resort=True)
+                        choice = self._charge(choice, limiter, payload, "failovers")
+                        if choice is not None:
+                            self._count("failovers")
+                            launch(choice)
+                            attempts += 1
+            raise last_error
+        finally:
+            for task in pending:
+                self._count("cancelled")
+                task.cancel()
+
+    def stats(self):
+        """Router counters plus state, latency and error rate of every deployment."""
+        with self._lock:
+            now = time.monotonic()
+            result = dict(self._stats)
+            result["deployments"] = {}
+            for d in self.deployments:
+                samples = list(d.latencies[False])
+                result["deployments"][d.name] = dict(
+                    d.counts,
+                    state=d.state(now),
+                    in_flight=d.in_flight,
+                    error_rate=round(d.error_rate, 3),
+                    ejections=d.ejections,
+                    p50_ms=round(1000 * _percentile(samples, 50)) if samples else None,
+                    p95_ms=round(1000 * _percentile(samples, 95)) if samples else None,
+                )
+        return result
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+import numpy as np
+import requests
+from aiohttp import web
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from stub_check import point_app_at
+from stub_servers import start_azure_stub
+
+# Load test of the threaded Flask app against the asyncio app, both answering /ask
+# against a local Azure stub with a fixed response latency. The Flask app runs on a
+# fixed-size thread pool, like a gunicorn gthread worker, so its throughput is capped
+# at threads / latency; the async app should keep scaling with concurrency.
+#
+#   python loadtest.py --latency 1.0 --threads 8 --concurrency 1 8 32 128
+
+QUESTION = "Can my landlord evict me without notice?"
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server that handles requests on a fixed number of threads."""
+
+    request_queue_size = 256
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app, handler=QuietHandler)
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def start_flask(threads):
+    import app as flask_app
+    server = PooledWSGIServer("127.0.0.1", 0, flask_app.app, threads)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def start_async():
+    import async_app
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(async_app.create_app(), access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+async def run_load(base_url, concurrency, requests_per_client):
+    """Runs `concurrency` clients, each sending requests back to back. Returns latencies (ms), errors and wall time."""
+    latencies, errors = [], 0
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def client(client_id):
+            nonlocal errors
+            for n in range(requests_per_client):
+                # Distinct questions, so single-flight coalescing doesn't hide the concurrency limit
+                question = f"{QUESTION} (client {client_id}, request {n})"
+                start = time.perf_counter()
+                async with session.post(f"{base_url}/ask", json={"question": question},
+                                        headers={"X-Cache-Bypass": "1"}) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(concurrency)))
+        wall = time.perf_counter() - start
+    return np.array(latencies), errors, wall
+
+
+def wait_ready(base_url):
+    while True:
+        try:
+            if requests.get(f"{base_url}/ready").status_code == 200:
+                return
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrency scaling of threaded Flask versus asyncio /ask.")
+    parser.add_argument("--latency", type=float, default=1.0, help="stub Azure response time in seconds")
+    parser.add_argument("--threads", type=int, default=8, help="Flask worker threads")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=3, help="requests per client")
+    args = parser.parse_args()
+
+    stub = start_azure_stub(first_token_delay=args.latency, token_delay=0.0)
+    point_app_at(stub)
+
+    targets = {"flask": start_flask(args.threads), "async": start_async()}
+    for base_url in targets.values():
+        wait_ready(base_url)
+
+    print(f"Stub latency {args.latency:.2f} s, Flask threads {args.threads}")
+    print(f"{'server':7} {'clients':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for concurrency in args.concurrency:
+        for name, base_url in targets.items():
+            latencies, errors, wall = asyncio.run(run_load(base_url, concurrency, args.requests))
+            print(f"{name:7} {concurrency:>8} {len(latencies) / wall:>8.1f} {np.percentile(latencies, 50):>8.0f} "
+                  f"{np.percentile(latencies, 95):>8.0f} {errors:>7}")
+    stub.stop()
@@ -0,0 +1,207 @@
+import argparse
+import re
+import time
+import numpy as np
+
+# Filterable chunk metadata. Every chunk is tagged with the act it belongs to, the act's
+# year and the persona screens of the app it is relevant to (components/Tenants.jsx,
+# Students.jsx, ...). MetadataIndex keeps one sorted id list per field value, so a filter
+# resolves to the matching chunk ids with a few set operations and only those chunks are scored.
+
+FIELDS = ("act", "year", "persona", "source")
+
+# A chunk is tagged with a persona when its text or act name matches any of the persona's terms.
+PERSONA_TERMS = {
+    "tenants": r"tenan\w*|landlord|rent\b|rent control|evict\w*|lease\w*|housing|premises",
+    "students": r"student\w*|educat\w*|school\w*|college\w*|universit\w*|ragging|scholarship\w*",
+    "seniors": r"senior citizen\w*|elderly|old age|pension\w*|maintenance of parents|retire\w*",
+    "entrepreneurs": r"business\w*|compan(?:y|ies)|start-?ups?|contract\w*|gst|goods and services tax|"
+                     r"msme|trade ?marks?|patent\w*|partnership\w*|consumer\w*",
+    "families": r"marriage\w*|married|divorce\w*|dowry|domestic violence|child\w*|maternity|"
+                r"adoption|custody|succession|inherit\w*|women|wife|husband",
+    "professionals": r"employ\w*|workplace|wage\w*|salar\w*|labour|gratuity|provident fund|"
+                     r"sexual harassment|posh|information technology",
+}
+PERSONAS = tuple(PERSONA_TERMS)
+
+_PERSONA_PATTERNS = {persona: re.compile(rf"\b(?:{terms})", re.IGNORECASE) for persona, terms in PERSONA_TERMS.items()}
+_YEAR = re.compile(r"\b(1[6-9]\d\d|20\d\d)\b")
+
+
+def act_year(act):
+    """Year an act was passed, from its name ("Consumer Protection Act, 2019" -> 2019), or None."""
+    match = _YEAR.search(act or "")
+    return int(match.group(1)) if match else None
+
+
+def persona_tags(text, act=None):
+    """Personas (see PERSONA_TERMS) a chunk is relevant to, in PERSONAS order."""
+    haystack = f"{act or ''}\n{text}"
+    return [persona for persona, pattern in _PERSONA_PATTERNS.items() if pattern.search(haystack)]
+
+
+def tag_chunk(chunk):
+    """Adds year and personas to a chunk dict (text plus act/chapter/section/source/offset) in place."""
+    chunk["year"] = act_year(chunk.get("act"))
+    chunk["personas"] = persona_tags(chunk["text"], chunk.get("act"))
+    return chunk
+
+
+def _normalize_act(act):
+    return re.sub(r"\s+", " ", re.sub(r"^the\s+", "", str(act).strip().rstrip(".").lower()))
+
+
+def _act_keys(act):
+    """Lookup keys for an act: its normalized full name, and the name without the year."""
+    name = _normalize_act(act)
+    return {name, re.sub(r",?\s*\d{4}$", "", name)}
+
+
+def _normalize_value(field, value):
+    if field == "year":
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid year filter: {value!r}")
+    if field == "act":
+        return _normalize_act(value)
+    return str(value).strip().lower() if field == "persona" else str(value)
+
+
+def normalize_filters(filters):
+    """
+    Validates a filter dict, e.g. {"persona": "tenants", "act": ["Rent Control Act"], "year": 2005}.
+    Values within a field are alternatives, fields must all match. Returns a hashable, canonical
+    tuple usable as a cache key, or None when there is nothing to filter on.
+    Raises ValueError for unknown fields or malformed values. An already canonical tuple is returned as is.
+    """
+    if not filters:
+        return None
+    if isinstance(filters, tuple):
+        return filters
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object mapping field names to a value or list of values")
+    unknown = set(filters) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown filter field(s): {', '.join(sorted(unknown))} (expected {', '.join(FIELDS)})")
+
+    canonical = []
+    for field in FIELDS:
+        values = filters.get(field)
+        if values is None or values == []:
+            continue
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        canonical.append((field, tuple(sorted({_normalize_value(field, v) for v in values}, key=str))))
+    return tuple(canonical) or None
+
+
+class MetadataIndex:
+    """
+    Sorted id lists per metadata value, built once per corpus state.
+    Chunks without year/personas in their metadata (older snapshots, added chunks) are tagged on the fly.
+    """
+
+    def __init__(self, texts, metadata):
+        postings = {field: {} for field in FIELDS}
+        acts = {}
+        for i, (text, chunk_metadata) in enumerate(zip(texts, metadata)):
+            act = chunk_metadata.get("act")
+            if act:
+                acts[act] = acts.get(act, 0) + 1
+                for key in _act_keys(act):
+                    postings["act"].setdefault(key, []).append(i)
+            year = chunk_metadata["year"] if "year" in chunk_metadata else act_year(act)
+            if year is not None:
+                postings["year"].setdefault(year, []).append(i)
+            personas = chunk_metadata["personas"] if "personas" in chunk_metadata else persona_tags(text, act)
+            for persona in personas:
+                postings["persona"].setdefault(persona, []).append(i)
+            if chunk_metadata.get("source"):
+                postings["source"].setdefault(chunk_metadata["source"], []).append(i)
+
+        self.size = len(texts)
+        self._act_counts = acts
+        self.postings = {
+            field: {value: np.array(ids, dtype=np.int64) for value, ids in values.items()}
+            for field, values in postings.items()
+        }
+
+    def select(self, filters):
+        """
+        Sorted ids of the chunks matching filters (a dict, or the output of normalize_filters()).
+        Returns None when there is no filter, meaning every chunk.
+        """
+        canonical = normalize_filters(filters)
+        if not canonical:
+            return None
+        selected = None
+        for field, values in canonical:
+            lists = [self.postings[field].get(value) for value in values]
+            lists = [ids for ids in lists if ids is not None]
+            matched = np.unique(np.concatenate(lists)) if lists else np.empty(0, dtype=np.int64)
+            selected = matched if selected is None else np.intersect1d(selected, matched, assume_unique=True)
+            if not len(selected):
+                break
+        return selected
+
+    def facets(self):
+        """Number of chunks for every value of every field, for clients building filter menus."""
+        facets = {"act": dict(sorted(self._act_counts.items()))}
+        for field in FIELDS[1:]:
+            values = sorted(self.postings[field].items(), key=lambda item: str(item[0]))
+            facets[field] = {str(value): len(ids) for value, ids in values}
+        return facets
+
+
+def filter_latency_report(index, queries, k=3, fractions=(1.0, 0.5, 0.1, 0.01, 0.001), seed=0):
+    """
+    Per-query latency of search_subset() over random subsets of the given fractions of the corpus,
+    against an unfiltered search() and checked against masking the full score matrix.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(index)
+    rows = []
+    for fraction in (None,) + tuple(fractions):
+        subset = None if fraction is None else np.sort(rng.choice(n, max(1, int(n * fraction)), replace=False))
+        start = time.perf_counter()
+        for q in queries:
+            if subset is None:
+                index.search(q[None, :], k)
+            else:
+                index.search_subset(q[None, :], k, subset)
+        ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        exact = True
+        if subset is not None:
+            _, ids = index.search_subset(queries, k, subset)
+            masked = np.full((len(queries), n), -np.inf, dtype=np.float32)
+            full_scores, full_ids = index.search(queries, n)
+            np.put_along_axis(masked, full_ids, full_scores, axis=1)
+            keep = np.zeros(n, dtype=bool)
+            keep[subset] = True
+            masked[:, ~keep] = -np.inf
+            expected = np.argsort(-masked, axis=1, kind="stable")[:, :ids.shape[1]]
+            exact = bool(np.all(np.sort(ids, axis=1) == np.sort(expected, axis=1)))
+        rows.append({"filter": "none" if fraction is None else f"{fraction:.1%}",
+                     "chunks": n if subset is None else len(subset), "ms_per_query": ms, "exact": exact})
+    return rows
+
+
+if __name__ == "__main__":
+    from search_engine import ExactIndex
+
+    parser = argparse.ArgumentParser(description="Latency of metadata-filtered search against subset size.")
+    parser.add_argument("--n", type=int, default=100000, help="number of synthetic chunks")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((args.n + args.queries, args.dim)).astype(np.float32)
+    index = ExactIndex(data[:args.n])
+
+    print(f"{'filter':8} {'chunks':>8} {'ms/query':>9} {'exact':>6}")
+    for row in filter_latency_report(index, data[args.n:], k=args.k):
+        print(f"{row['filter']:8} {row['chunks']:>8} {row['ms_per_query']:>9.3f} {str(row['exact']):>6}")
@@ -0,0 +1,360 @@
+import bisect
+import contextvars
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+
+# In-process metrics in the Prometheus text format, without a client library.
+# Hot paths wrap their stages in stage("name"): one perf_counter pair and a histogram
+# bucket increment per stage, cheap enough to leave on. The stages of the current
+# request are also collected for its Server-Timing header. Counters that components
+# already keep in their stats() dicts are read only when /metrics is scraped.
+# A small sample of requests runs under cProfile; a sampled request slower than
+# METRICS_SLOW_REQUEST_MS has its profile written to METRICS_PROFILE_DIR.
+
+PREFIX = "legalease"
+SLOW_REQUEST_MS = float(os.getenv("METRICS_SLOW_REQUEST_MS", "2000"))  # slow requests are logged with their stages
+PROFILE_SAMPLE = float(os.getenv("METRICS_PROFILE_SAMPLE", "0"))         # fraction of requests profiled, e.g. 0.01
+PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", os.path.join("legal_data", ".profiles"))
+PROFILE_KEEP = int(os.getenv("METRICS_PROFILE_KEEP", "20"))              # newest profile dumps kept
+
+# Seconds; from sub-millisecond cache and kNN stages up to LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# stats() keys that are levels rather than running totals
+GAUGE_KEYS = {"size", "max_size", "hit_rate", "in_flight", "waiting", "queued", "mean_batch", "max_batch",
+              "mean_wait_ms", "tokens_available", "entries", "bytes", "connection_reuse", "error_rate",
+              "p50_ms", "p95_ms"}
+
+_NAME_INVALID = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self):
+        """(suffix, labels dict, value) for every sample, for render()."""
+        with self._lock:
+            items = list(self._values.items())
+        return [("", dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram; observe() takes seconds."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        self.observe_key(self._key(labels), value)
+
+    def observe_key(self, key, value):
+        """observe() with the label values already in labelnames order, for hot paths."""
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][slot] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, n) for key, (counts, total, n) in self._values.items()]
+        samples = []
+        for key, counts, total, n in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, n))
+        return samples
+
+
+class Registry:
+    """Metrics plus collectors: functions called at scrape time that return extra metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        for collect in collectors:
+            try:
+                metrics.extend(collect())
+            except Exception as e:  # One broken component must not take /metrics down
+                print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+        families = {}  # Samples of one name must be contiguous, e.g. a router metric over all deployments
+        for metric in metrics:
+            families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, family in families.items():
+            lines.append(f"# HELP {name} {family[0].help}")
+            lines.append(f"# TYPE {name} {family[0].kind}")
+            for metric in family:
+                for suffix, labels, value in metric.samples():
+                    lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    f"{PREFIX}_stage_seconds", "Time spent in each stage of request handling.", ("stage",)))
+REQUEST_SECONDS = registry.register(Histogram(
+    f"{PREFIX}_request_seconds", "Time until the response headers were ready (streams: until streaming began).",
+    ("route", "method")))
+RESPONSES = registry.register(Counter(
+    f"{PREFIX}_responses_total", "Responses by route and status code.", ("route", "method", "status")))
+SLOW_REQUESTS = registry.register(Counter(
+    f"{PREFIX}_slow_requests_total", "Requests slower than METRICS_SLOW_REQUEST_MS.", ("route",)))
+PROFILES = registry.register(Counter(
+    f"{PREFIX}_profiled_requests_total", "Requests run under the sampling profiler.", ()))
+
+
+class RequestTiming:
+    """Stage durations of one request, for its Server-Timing header."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.profiler = None
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Server-Timing header value, e.g. "retrieval;dur=12.3, llm;dur=812.0, total;dur=830.9"."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current = contextvars.ContextVar("legalease_request_timing", default=None)
+_profile_lock = threading.Lock()  # cProfile can only profile one request at a time
+
+
+def observe_stage(name, seconds):
+    """Records a stage duration measured elsewhere (e.g. by voice_pipeline.StageTimer)."""
+    STAGE_SECONDS.observe_key((name,), seconds)
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+class stage:
+    """Context manager timing its block into the stage histogram and the current request's Server-Timing."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe_stage(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def begin_request():
+    """Starts timing (and maybe profiling) the request on this thread or task. Returns a token for end_request()."""
+    timing = RequestTiming()
+    if PROFILE_SAMPLE > 0 and random.random() < PROFILE_SAMPLE and _profile_lock.acquire(blocking=False):
+        timing.profiler = cProfile.Profile()
+        try:
+            timing.profiler.enable()
+        except ValueError:  # Another profiler (e.g. a debugger) is active
+            timing.profiler = None
+            _profile_lock.release()
+    return _current.set(timing)
+
+
+def current_timing():
+    return _current.get()
+
+
+def end_request(token, route, method, status_code):
+    """
+    Records the request's duration and status and returns its Server-Timing header value.
+    A slow request is logged with its stages, and its profile is dumped if it was sampled.
+    """
+    timing = _current.get()
+    _current.reset(token)
+    if timing is None:
+        return None
+    if timing.profiler is not None:
+        timing.profiler.disable()
+        _profile_lock.release()
+        PROFILES.inc()
+    seconds = timing.elapsed()
+    REQUEST_SECONDS.observe(seconds, route=route, method=method)
+    RESPONSES.inc(route=route, method=method, status=str(status_code))
+    header = timing.server_timing()
+    if seconds * 1000 >= SLOW_REQUEST_MS:
+        SLOW_REQUESTS.inc(route=route)
+        print(f"Slow request: {method} {route} -> {status_code} in {seconds * 1000:.0f} ms ({header})")
+        if timing.profiler is not None:
+            dump_profile(timing.profiler, route, seconds)
+    return header
+
+
+def dump_profile(profiler, route, seconds):
+    """Writes a pstats file (load with `python -m pstats <file>`) and keeps only the newest PROFILE_KEEP."""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{_NAME_INVALID.sub('_', route).strip('_') or 'root'}-{seconds * 1000:.0f}ms.prof"
+        path = os.path.join(PROFILE_DIR, name)
+        profiler.dump_stats(path)
+        print(f"Profile of slow request written to {path}")
+        dumps = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".prof"))
+        for old in dumps[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+            os.remove(os.path.join(PROFILE_DIR, old))
+    except OSError as e:
+        print(f"Could not write request profile: {e}")
+
+
+def _metric_name(*parts):
+    return _NAME_INVALID.sub("_", "_".join(str(p) for p in parts if p)).lower()
+
+
+def stats_metrics(component, stats, labels=None):
+    """
+    Metrics for a component's stats() dict: numeric values become counters
+    (<prefix>_<component>_<key>_total) or, for GAUGE_KEYS, gauges. Nested dicts, such as the
+    router's per-deployment figures, become the same metrics labelled with their key.
+    """
+    metrics = []
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            for name, nested in value.items():
+                if isinstance(nested, dict):
+                    metrics.extend(stats_metrics(f"{component}_{key}", nested, dict(labels or {}, name=name)))
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        if not isinstance(value, (int, float)):
+            continue
+        if key in GAUGE_KEYS:
+            metric = Gauge(_metric_name(PREFIX, component, key), f"{component} {key}.", tuple(labels or ()))
+            metric.set(value, **(labels or {}))
+        else:
+            metric = Counter(_metric_name(PREFIX, component, key, "total"), f"{component} {key}.", tuple(labels or ()))
+            metric.inc(value, **(labels or {}))
+        metrics.append(metric)
+    return metrics
+
+
+def register_stats(component, stats_fn):
+    """Exposes a component's stats() (a function returning a dict) on /metrics."""
+    registry.add_collector(lambda: stats_metrics(component, stats_fn()))
+
+
+def register_value(name, help_text, value_fn, counter=False):
+    """Exposes value_fn() as a gauge (or counter), read at scrape time; a None value is left out."""
+    def collect():
+        value = value_fn()
+        if value is None:
+            return []
+        if counter:
+            metric = Counter(f"{PREFIX}_{name}", help_text)
+            metric.inc(value)
+        else:
+            metric = Gauge(f"{PREFIX}_{name}", help_text)
+            metric.set(value)
+        return [metric]
+    registry.add_collector(collect)
+
+
+def _resident_memory():
+    """Resident set size in bytes (current on Linux, peak elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if os.uname().sysname == "Darwin" else peak * 1024  # bytes on macOS, KiB on Linux
+        except (ImportError, AttributeError):
+            return None
+
+
+_started = time.time()
+register_value("process_resident_memory_bytes", "Resident memory of this process.", _resident_memory)
+register_value("process_cpu_seconds_total", "CPU time used by this process.", lambda: sum(os.times()[:2]), counter=True)
+register_value("process_start_time_seconds", "Unix time this process started.", lambda: _started)
+
+
+def render():
+    return registry.render()
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,91 @@
+import os
+import re
+
+try:
+    import tiktoken  # Optional: exact token counts for the GPT deployment
+except ImportError:
+    tiktoken = None
+
+# Context tokens allowed per prompt, and how many candidate chunks retrieval should offer
+PROMPT_CONTEXT_BUDGET = int(os.getenv("PROMPT_CONTEXT_BUDGET", "1500"))
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "8"))
+# Chunks whose word-trigram Jaccard similarity with an already selected chunk reaches this are dropped
+DEDUP_THRESHOLD = float(os.getenv("PROMPT_DEDUP_THRESHOLD", "0.8"))
+TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER", "cl100k_base")
+
+# Chat format overhead per message (role and separators), as documented for gpt-3.5/gpt-4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Number of tokens in text. Uses tiktoken when installed; otherwise estimates
+    from word and character counts, which is close for English legal prose.
+    """
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        return len(_encoding.encode(text))
+    return max(len(text.split()) * 4 // 3, len(text) // 4)
+
+
+def count_message_tokens(messages):
+    """Prompt tokens of a chat completion request."""
+    return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages) + 3
+
+
+def _shingles(text, n=3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < n:
+        return {tuple(words)}
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _truncate(text, max_tokens):
+    """Cuts text to roughly max_tokens, on a word boundary."""
+    words = text.split()
+    while words and count_tokens(" ".join(words)) > max_tokens:
+        words = words[:max(1, int(len(words) * 0.9))] if len(words) > 1 else []
+    return " ".join(words)
+
+
+def pack_context(chunks, scores, budget=PROMPT_CONTEXT_BUDGET, dedup_threshold=DEDUP_THRESHOLD):
+    """
+    Chooses which retrieved chunks go into the prompt.
+    Chunks are taken best score first; near-duplicates of an already chosen chunk are skipped,
+    and chunks that no longer fit in the token budget are left out. If even the best chunk is
+    over budget it is truncated, so the prompt never goes out without context.
+    Returns (selected_chunks, stats) where stats counts tokens kept and cut.
+    """
+    order = sorted(range(len(chunks)), key=lambda i: -scores[i])
+    selected, selected_shingles = [], []
+    stats = {"candidate_tokens": 0, "context_tokens": 0, "duplicates_dropped": 0, "over_budget_dropped": 0}
+    separator_tokens = count_tokens("\n\n")
+
+    for i in order:
+        chunk = chunks[i]
+        tokens = count_tokens(chunk)
+        stats["candidate_tokens"] += tokens
+
+        shingles = _shingles(chunk)
+        if any(len(shingles & other) / len(shingles | other) >= dedup_threshold for other in selected_shingles):
+            stats["duplicates_dropped"] += 1
+            continue
+
+        cost = tokens + (separator_tokens if selected else 0)
+        if stats["context_tokens"] + cost > budget:
+            if selected:
+                stats["over_budget_dropped"] += 1
+                continue
+            chunk = _truncate(chunk, budget)
+            cost = count_tokens(chunk)
+
+        selected.append(chunk)
+        selected_shingles.append(shingles)
+        stats["context_tokens"] += cost
+
+    stats["context_tokens_saved"] = stats["candidate_tokens"] - stats["context_tokens"]
+    return selected, stats
@@ -0,0 +1,73 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_query(text):
+    """
+    Canonical cache key for a question: lower-cased, whitespace collapsed and
+    surrounding punctuation dropped, so "Tenant eviction rights?" and
+    "tenant  eviction rights" share an entry.
+    """
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.strip(" ?!.,;:'\"")
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live.
+    max_size bounds the number of entries; ttl (seconds, 0 or None for no expiry)
+    bounds their age. Hit, miss, eviction and expiry counters are kept for monitoring.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl or None
+        self._entries = OrderedDict()  # key -> (stored_at, value)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, key):
+        """Returns the cached value for key, or None on a miss or expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            stored_at, value = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        """Stores value under key, evicting the least recently used entries beyond max_size."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        """Drops every entry, e.g. after the index they refer to was rebuilt."""
+        with self._lock:
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), max_size=self.max_size)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
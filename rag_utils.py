@@ -1,51 +1,614 @@
+import itertools
 import os
-from sentence_transformers import SentenceTransformer
-from sklearn.neighbors import NearestNeighbors
+import threading
+import time
 import numpy as np
+from embedding_cache import encode_with_cache
+from search_engine import ExactIndex, LayeredIndex, normalize
+from ann_index import IVFIndex, vectors_digest
+from ingest import CHUNKER_VERSION, DATA_DIR, encode_parallel, iter_chunks, iter_corpus, iter_documents
+from snapshot import (SNAPSHOT_DIR, SnapshotError, corpus_fingerprint, prune_snapshots, publish_snapshot, read_snapshot,
+                      resolve_snapshot)
+from embedding_batcher import EmbeddingBatcher
+from query_cache import LRUCache, normalize_query
+from metadata_index import MetadataIndex, normalize_filters
+import metrics
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Index backend: "exact" (brute force) or "ivf" (approximate, for very large corpora)
+INDEX_BACKEND = os.getenv("RAG_INDEX_BACKEND", "exact")
+# Stored vector precision: "float32", "float16" (half the memory) or "int8" (a quarter)
+INDEX_STORAGE = os.getenv("RAG_INDEX_STORAGE", "float32")
+IVF_LISTS = int(os.getenv("RAG_IVF_LISTS", "0")) or None  # default: sqrt(number of chunks)
+IVF_PROBE = int(os.getenv("RAG_IVF_PROBE", "8"))
+# Optional path to persist the IVF index so restarts skip k-means
+IVF_INDEX_PATH = os.getenv("RAG_IVF_INDEX_PATH")
+# Query run once after loading so the first real request doesn't pay for cold caches; empty disables it
+WARMUP_QUERY = os.getenv("RAG_WARMUP_QUERY", "What are my rights as a tenant?")
+# Concurrent single-query encodes are grouped into one model call; a max size of 1 disables batching
+BATCH_MAX_SIZE = int(os.getenv("RAG_BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("RAG_BATCH_MAX_WAIT_MS", "5"))
+# Repeated questions skip encoding and scoring; TTL is in seconds (0 = no expiry)
+QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("RAG_QUERY_CACHE_TTL", "3600"))
+# Pointer to the snapshot written after every build and compaction (a <version>.snap file next to it),
+# loaded at startup while the corpus is unchanged; empty disables snapshots
+SNAPSHOT_PATH = os.getenv("RAG_SNAPSHOT_PATH", os.path.join(SNAPSHOT_DIR, "CURRENT"))
+# Incremental updates are folded into a rebuilt index once tombstoned plus appended chunks exceed this fraction
+COMPACT_RATIO = float(os.getenv("RAG_COMPACT_RATIO", "0.2"))
+# Seconds between scans of the corpus directory for edited documents; 0 disables the watcher
+WATCH_INTERVAL = float(os.getenv("RAG_WATCH_INTERVAL", "0"))
+
+class RAGState:
+    """
+    Everything a search reads: chunk texts, per-chunk metadata (act, chapter, section,
+    source file, byte offset, year and personas), normalized vectors and the index over them.
+    A reload or incremental update builds a new RAGState and swaps the global reference,
+    so a request that captured the old one keeps reading a consistent corpus until it finishes.
+    After incremental updates, texts and metadata also hold the appended chunks while vectors
+    is still the base array; index is then a LayeredIndex holding the rest.
+    Chunk ids are row numbers: incremental updates keep them, a rebuild, reload or compaction
+    renumbers them. id_versions holds every version whose ids still mean the same chunks here.
+    """
+    def __init__(self, texts, metadata, vectors, index, version, id_versions=None):
+        self.texts = texts
+        self.metadata = metadata
+        self.vectors = vectors
+        self.index = index
+        self.version = version
+        self.id_versions = id_versions or frozenset([version])
+        self._metadata_index = None
+
+    @property
+    def metadata_index(self):
+        """Id lists per act/year/persona/source for filtered search, built on first use."""
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex(self.texts, self.metadata)
+        return self._metadata_index
 
 # Global variables
-texts = []
-vectors = None
-nn_model = None
-model = SentenceTransformer('all-MiniLM-L6-v2')
+state = None
+_model = None
+_model_lock = threading.Lock()
+_reload_lock = threading.Lock()  # Held by whatever is building the next state: load, reload, update or compaction
+_version_counter = itertools.count(1)  # Keeps derived and fallback versions unique within the process
+watcher = None
+
+query_batcher = EmbeddingBatcher(
+    lambda batch: get_model().encode(batch, convert_to_numpy=True),
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+)
+
+# (state version, normalized query, k, filters) -> (query vector, chunk ids, scores); cleared whenever the state is swapped
+query_cache = LRUCache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+# Query cache and batcher counters, and the size of the live index, on /metrics
+metrics.register_stats("query_cache", query_cache.stats)
+metrics.register_stats("query_batcher", query_batcher.stats)
+metrics.register_value("index_chunks", "Row ids in the live index, tombstoned ones included.",
+                       lambda: len(state.index) if state is not None else None)
+metrics.register_value("index_live_chunks", "Chunks searchable in the live index.",
+                       lambda: getattr(state.index, "live", len(state.index)) if state is not None else None)
+metrics.register_value("index_bytes", "Memory held by the live index's vectors.",
+                       lambda: getattr(state.index, "nbytes", None) if state is not None else None)
+
+# Loading progress, reported by the readiness endpoint
+status = {"state": "idle", "stage": None, "chunks": 0, "error": None, "started_at": None, "ready_at": None,
+          "version": None, "reloading": False, "reload_error": None, "reloaded_at": None}
+
+def get_model():
+    """
+    Returns the sentence-transformers model, loading it on first use.
+    The import itself is deferred too, since importing torch takes seconds.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(MODEL_NAME)
+    return _model
 
-def load_documents():
+def build_state(data_dir=DATA_DIR, fingerprint=None):
     """
-    Loads and encodes legal documents from bareacts.txt using sentence-transformers
-    and builds a nearest neighbor search index.
+    Loads every legal document under data_dir, chunks it on Act/Chapter/Section/Article
+    boundaries, encodes the chunks using sentence-transformers and builds the vector search index.
+    The result is also written to SNAPSHOT_PATH, so the next start can skip all of this.
     """
-    global texts, vectors, nn_model
+    if not os.path.isdir(data_dir):
+        raise FileNotFoundError(f"{data_dir}/ directory not found")
 
-    file_path = os.path.join("legal_data", "bareacts.txt")
-    if not os.path.exists(file_path):
-        raise FileNotFoundError("bareacts.txt not found in legal_data/")
+    # Stream the corpus file by file; only the chunk texts and their metadata are kept
+    status["stage"] = "reading"
+    new_texts, new_metadata = [], []
+    for chunk in iter_corpus(data_dir):
+        new_texts.append(chunk.pop("text"))
+        new_metadata.append(chunk)
+        status["chunks"] = len(new_texts)
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        raw_text = f.read()
+    if not new_texts:
+        raise ValueError(f"No valid chunks found in {data_dir}/")
 
-    # Split by double newlines
-    texts = [chunk.strip() for chunk in raw_text.split("\n\n") if chunk.strip()]
-    
-    if not texts:
-        raise ValueError("No valid chunks found in bareacts.txt")
+    # Embed the text, reusing cached embeddings for chunks that have not changed.
+    # The model is only loaded if some chunk actually needs encoding.
+    status["stage"] = "encoding"
+    print(f"Encoding {len(new_texts)} legal chunks...")
+    # Vectors are normalized once here, not per query, and stored that way in the snapshot
+    new_vectors = normalize(encode_with_cache(
+        new_texts,
+        lambda batch: encode_parallel(batch, MODEL_NAME, lambda b: get_model().encode(b, convert_to_numpy=True)),
+        MODEL_NAME,
+    ))
 
-    # Embed the text
-    print(f"Encoding {len(texts)} legal chunks...")
-    vectors = model.encode(texts, convert_to_numpy=True)
+    status["stage"] = "snapshot"
+    version = _publish(new_texts, new_metadata, new_vectors, fingerprint)
 
-    # Build Nearest Neighbors index
-    nn_model = NearestNeighbors(n_neighbors=3, metric='cosine')
-    nn_model.fit(vectors)
-    print("NearestNeighbors index built.")
+    # Build the search index
+    status["stage"] = "indexing"
+    new_index = build_index(new_vectors, normalized=True)
+    print(f"Search index built ({INDEX_BACKEND}).")
+    return RAGState(new_texts, new_metadata, new_vectors, new_index, version or _fallback_version("built"))
 
-def search(query, k=3):
+def state_from_snapshot(path):
     """
-    Returns top-k most relevant chunks for the given query using cosine similarity.
+    Builds the search state from a snapshot file. Its vectors stay memory-mapped;
+    only the index (and quantization, if configured) is computed.
+    """
+    status["stage"] = "snapshot"
+    snap = read_snapshot(path)
+    if snap.model != MODEL_NAME:
+        raise SnapshotError(f"{path} was built with {snap.model}, this server uses {MODEL_NAME}")
+    status["chunks"] = len(snap)
+    status["stage"] = "indexing"
+    new_index = build_index(snap.vectors, normalized=True)
+    print(f"Loaded snapshot {snap.version} ({len(snap)} chunks) from {path}.")
+    return RAGState(snap.texts, snap.metadata, snap.vectors, new_index, snap.version)
+
+def _publish(texts, metadata, vectors, fingerprint):
+    """
+    Writes the snapshot of a state about to be swapped in. Returns its version, or None if
+    snapshots are disabled or the write failed: the state is served anyway, only the next
+    start has to rebuild.
+    """
+    if not SNAPSHOT_PATH:
+        return None
+    try:
+        version, path = publish_snapshot(SNAPSHOT_PATH, texts, metadata, vectors, MODEL_NAME, fingerprint)
+    except (OSError, ValueError) as e:
+        print(f"Snapshot could not be written ({e}), serving without one.")
+        return None
+    print(f"Snapshot {version} written to {path}.")
+    return version
+
+def _fingerprint(data_dir):
+    """Snapshot fingerprint of the corpus under data_dir as this version of the chunker reads it."""
+    return corpus_fingerprint(iter_documents(data_dir), f"chunker-{CHUNKER_VERSION}") if os.path.isdir(data_dir) else None
+
+def load_state(data_dir=DATA_DIR, snapshot_path=None):
     """
-    global texts, vectors, nn_model
-    if nn_model is None:
+    Returns a new RAGState: from snapshot_path if given, otherwise from SNAPSHOT_PATH when
+    it was built from the corpus as it is on disk now, otherwise by rebuilding from data_dir.
+    """
+    if snapshot_path:
+        return state_from_snapshot(snapshot_path)
+
+    fingerprint = _fingerprint(data_dir)
+    path = resolve_snapshot(SNAPSHOT_PATH) if SNAPSHOT_PATH else None
+    if path and os.path.exists(path):
+        try:
+            snap = read_snapshot(path)
+            if snap.fingerprint == fingerprint and snap.model == MODEL_NAME:
+                return state_from_snapshot(path)
+            print("Snapshot does not match the corpus on disk, rebuilding.")
+        except (OSError, SnapshotError, KeyError) as e:
+            print(f"Snapshot could not be read ({e}), rebuilding.")
+    return build_state(data_dir, fingerprint)
+
+def swap_state(new_state):
+    """
+    Makes new_state the one every subsequent search uses, then deletes superseded snapshot
+    files (only now, since the previous state may have had one memory-mapped).
+    """
+    global state
+    state = new_state
+    query_cache.clear()
+    status["version"] = new_state.version
+    if SNAPSHOT_PATH:
+        prune_snapshots(SNAPSHOT_PATH)
+
+def current_state():
+    """The state searches should use; capture it once per request."""
+    current = state
+    if current is None:
         raise RuntimeError("Index not loaded. Call load_documents() first.")
+    return current
+
+def load_documents(data_dir=DATA_DIR, snapshot_path=None):
+    """
+    Loads the corpus (from a snapshot when possible, see load_state) and makes it the searched one.
+    """
+    swap_state(load_state(data_dir, snapshot_path))
+
+def start_background_load(data_dir=DATA_DIR, warmup_query=WARMUP_QUERY):
+    """
+    Loads the documents, the model and the index on a daemon thread and returns immediately.
+    Progress is published in status; status["state"] becomes "ready" once a warmup query
+    has gone through search(), or "failed" with status["error"] set.
+    """
+    def run():
+        with _reload_lock:  # A reload requested during startup is refused rather than raced
+            try:
+                load_documents(data_dir)
+                if warmup_query:
+                    status["stage"] = "warmup"
+                    search(warmup_query)
+                    current_state().metadata_index
+                status.update(state="ready", stage=None, ready_at=time.time())
+                print("RAG model initialized successfully.")
+                if WATCH_INTERVAL > 0:
+                    start_watcher(data_dir)
+            except Exception as e:
+                status.update(state="failed", error=f"{type(e).__name__}: {e}")
+                print(f"Error initializing RAG model: {e}")
+
+    status.update(state="loading", stage="starting", error=None, started_at=time.time(), ready_at=None)
+    thread = threading.Thread(target=run, name="rag-loader", daemon=True)
+    thread.start()
+    return thread
+
+def start_reload(data_dir=DATA_DIR, snapshot_path=None, warmup_query=WARMUP_QUERY):
+    """
+    Builds or loads a new state on a daemon thread, warms it up and swaps it in.
+    search() keeps serving the current state until the swap. Returns False without
+    doing anything if a reload is already running. Outcome is published in status.
+    """
+    if not _reload_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            new_state = load_state(data_dir, snapshot_path)
+            if warmup_query:
+                retrieve(warmup_query, current=new_state)
+                new_state.metadata_index
+            previous = status["version"]
+            swap_state(new_state)
+            status.update(reload_error=None, reloaded_at=time.time())
+            print(f"RAG state reloaded: {previous} -> {new_state.version}")
+        except Exception as e:
+            status["reload_error"] = f"{type(e).__name__}: {e}"
+            print(f"Error reloading RAG state, still serving {status['version']}: {e}")
+        finally:
+            status.update(reloading=False, stage=None)
+            _reload_lock.release()
+
+    status["reloading"] = True
+    thread = threading.Thread(target=run, name="rag-reloader", daemon=True)
+    thread.start()
+    return True
+
+def _fallback_version(prefix):
+    return f"{prefix}-{time.time():.0f}-{next(_version_counter)}"
+
+def _next_version(version):
+    # The suffix is never reused, so a version from before a reload of the same snapshot stays distinct
+    return f"{version.partition('+')[0]}+{next(_version_counter)}"
+
+def _check_ids_version(current, version):
+    if version not in current.id_versions:
+        raise KeyError(f"Chunk ids from version {version} are stale: the index was renumbered "
+                       f"(now at {current.version}); look the chunk up again")
+
+def _check_live(current, chunk_id):
+    deleted = current.index.deleted if isinstance(current.index, LayeredIndex) else frozenset()
+    if not 0 <= chunk_id < len(current.texts) or chunk_id in deleted:
+        raise KeyError(f"No live chunk with id {chunk_id}")
+
+def apply_changes(added=(), deleted=(), updated_metadata=None, base_version=None, ids_version=None):
+    """
+    Applies chunk-level changes without a rebuild: added is a list of chunk dicts (text plus
+    act/chapter/section/source/offset), deleted a list of chunk ids to tombstone, and
+    updated_metadata maps ids whose text is unchanged to new metadata. Only added texts are
+    encoded. The result is swapped in as a new state, so searches see all changes or none.
+    ids_version is the version the ids in deleted were read from; a KeyError is raised if the
+    index has been renumbered since (by a compaction or reload), rather than tombstoning
+    whatever chunks now carry those ids.
+    Returns (ids of the added chunks, new version), or None if base_version was given and the
+    state has moved on since (the caller should recompute its changes).
+    """
+    added = [dict(chunk) for chunk in added]
+    new_texts = [chunk.pop("text") for chunk in added]
+    new_vectors = normalize(get_model().encode(new_texts, convert_to_numpy=True)) if added else None
+
+    with _reload_lock:
+        current = current_state()
+        if base_version is not None and current.version != base_version:
+            return None
+        if ids_version is not None:
+            _check_ids_version(current, ids_version)
+        index = current.index
+        if not isinstance(index, LayeredIndex):
+            index = LayeredIndex(index, len(current.vectors))
+        missing = [i for i in deleted if not 0 <= i < len(index) or i in index.deleted]
+        if missing:
+            raise KeyError(f"No live chunk with id {missing[0]}")
+
+        first_id = len(current.texts)
+        texts = current.texts + new_texts
+        metadata = list(current.metadata) + added
+        for i, chunk_metadata in (updated_metadata or {}).items():
+            metadata[i] = chunk_metadata
+        new_index = index.with_changes(new_vectors, deleted)
+        version = _next_version(current.version)
+        swap_state(RAGState(texts, metadata, current.vectors, new_index, version, current.id_versions | {version}))
+        needs_compaction = len(new_index.added) + len(new_index.deleted) > COMPACT_RATIO * max(1, new_index.live)
+
+    if needs_compaction:
+        start_compaction()
+    return list(range(first_id, first_id + len(added))), version
+
+def add_chunks(chunks):
+    """
+    Adds chunk dicts (text plus metadata) to the live index. Returns (their ids, version):
+    pass the version along with the ids to update_chunk/delete_chunk.
+    """
+    return apply_changes(added=chunks)
+
+def update_chunk(chunk_id, text, version, **metadata):
+    """
+    Replaces a chunk's text (and optionally metadata fields). version is the state version
+    chunk_id was read from (RAGState.version, or as returned by add_chunks/update_chunk).
+    Returns (id of the new text, new version). Raises KeyError if the id is stale, out of
+    range or already deleted.
+    """
+    current = current_state()
+    _check_ids_version(current, version)
+    _check_live(current, chunk_id)
+    chunk = dict(current.metadata[chunk_id], **metadata)
+    chunk["text"] = text
+    ids, version = apply_changes(added=[chunk], deleted=[chunk_id], ids_version=version)
+    return ids[0], version
+
+def delete_chunk(chunk_id, version):
+    """
+    Removes a chunk from search results; its row is reclaimed at the next compaction. version
+    is as for update_chunk. Returns the new version. Raises KeyError as update_chunk does.
+    """
+    current = current_state()
+    _check_ids_version(current, version)
+    _check_live(current, chunk_id)
+    return apply_changes(deleted=[chunk_id], ids_version=version)[1]
+
+def compact():
+    """
+    Rebuilds the index from the live chunks only: tombstoned rows are dropped, appended vectors
+    join the base, and ids are renumbered. The result is snapshotted and swapped in.
+    Returns False if there was nothing to compact.
+    """
+    with _reload_lock:
+        current = current_state()
+        index = current.index
+        if not isinstance(index, LayeredIndex):
+            return False
+        status["stage"] = "compacting"
+        live = [i for i in range(len(index)) if i not in index.deleted]
+        all_vectors = np.concatenate([current.vectors, index.added]) if len(index.added) else current.vectors
+        vectors = np.ascontiguousarray(all_vectors[live], dtype=np.float32)
+        texts = [current.texts[i] for i in live]
+        metadata = [current.metadata[i] for i in live]
+
+        version = _publish(texts, metadata, vectors, _fingerprint(DATA_DIR)) if SNAPSHOT_PATH else None
+        swap_state(RAGState(texts, metadata, vectors, build_index(vectors, normalized=True),
+                            version or _fallback_version("compacted")))
+        status["stage"] = None
+        print(f"Index compacted: {len(index) - len(live)} tombstones dropped, {len(live)} chunks live.")
+        return True
+
+def start_compaction():
+    """Runs compact() on a daemon thread."""
+    def run():
+        try:
+            compact()
+        except Exception as e:
+            status["stage"] = None
+            print(f"Error compacting the index: {e}")
+
+    thread = threading.Thread(target=run, name="rag-compactor", daemon=True)
+    thread.start()
+    return thread
+
+def sync_documents(paths, data_dir=DATA_DIR):
+    """
+    Brings the chunks of the given documents in line with their contents on disk; a path that
+    no longer exists drops all of its chunks. Chunks whose text is unchanged keep their vector
+    (only their metadata is refreshed), so an edited amendment costs one encode per changed chunk.
+    Returns (added, deleted) chunk counts.
+    """
+    new_chunks = {}
+    for path in paths:
+        source = os.path.relpath(path, data_dir)
+        new_chunks[source] = list(iter_chunks(path, data_dir)) if os.path.isfile(path) else []
+
+    for _ in range(3):
+        current = current_state()
+        tombstones = current.index.deleted if isinstance(current.index, LayeredIndex) else frozenset()
+        old = {source: {} for source in new_chunks}  # source -> text -> live ids
+        for i, chunk_metadata in enumerate(current.metadata):
+            by_text = old.get(chunk_metadata.get("source"))
+            if by_text is not None and i not in tombstones:
+                by_text.setdefault(current.texts[i], []).append(i)
+
+        added, deleted, updated = [], [], {}
+        for source, chunks in new_chunks.items():
+            for chunk in chunks:
+                ids = old[source].get(chunk["text"])
+                if ids:
+                    i = ids.pop(0)
+                    chunk_metadata = {key: value for key, value in chunk.items() if key != "text"}
+                    if chunk_metadata != current.metadata[i]:
+                        updated[i] = chunk_metadata
+                else:
+                    added.append(chunk)
+            deleted.extend(i for ids in old[source].values() for i in ids)
+
+        if not (added or deleted or updated):
+            return 0, 0
+        if apply_changes(added, deleted, updated, base_version=current.version) is not None:
+            return len(added), len(deleted)
+    raise RuntimeError("Index kept changing while syncing documents")
+
+class CorpusWatcher:
+    """
+    Polls data_dir every interval seconds and applies edited, new and removed documents
+    as chunk-level deltas through sync_documents().
+    """
+    def __init__(self, data_dir=DATA_DIR, interval=WATCH_INTERVAL):
+        self.data_dir = data_dir
+        self.interval = interval
+        self._files = self._scan()
+        self._stop = threading.Event()
+
+    def _scan(self):
+        files = {}
+        for path in iter_documents(self.data_dir):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def poll(self):
+        """Scans once and syncs changed documents. Returns the changed paths."""
+        files = self._scan()
+        changed = sorted(p for p in set(files) | set(self._files) if files.get(p) != self._files.get(p))
+        if changed:
+            added, deleted = sync_documents(changed, self.data_dir)
+            print(f"Corpus watcher: {len(changed)} document(s) changed, {added} chunks added, {deleted} removed.")
+        self._files = files
+        return changed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Corpus watcher error: {e}")
+
+    def start(self):
+        threading.Thread(target=self._run, name="rag-watcher", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+def start_watcher(data_dir=DATA_DIR, interval=WATCH_INTERVAL):
+    """Starts the corpus watcher (once) and returns it."""
+    global watcher
+    if watcher is None:
+        watcher = CorpusWatcher(data_dir, interval or 2.0).start()
+    return watcher
+
+def is_ready():
+    """True once the index is loaded and warmed up."""
+    return status["state"] == "ready"
+
+def build_index(vectors, normalized=False):
+    """
+    Builds the search index for vectors using the configured INDEX_BACKEND.
+    For "ivf", a saved index at IVF_INDEX_PATH is reused only if it was built from exactly these vectors.
+    """
+    if INDEX_BACKEND == "exact":
+        return ExactIndex(vectors, storage=INDEX_STORAGE, normalized=normalized)
+    if INDEX_BACKEND == "ivf":
+        if IVF_INDEX_PATH and os.path.exists(IVF_INDEX_PATH):
+            saved = IVFIndex.load(IVF_INDEX_PATH)
+            if saved.storage == INDEX_STORAGE and len(saved) == len(vectors) and saved.digest == vectors_digest(vectors):
+                saved.n_probe = IVF_PROBE
+                return saved
+            print("Saved IVF index does not match the corpus, rebuilding.")
+        ivf = IVFIndex(vectors, n_lists=IVF_LISTS, n_probe=IVF_PROBE, storage=INDEX_STORAGE)
+        if IVF_INDEX_PATH:
+            ivf.save(IVF_INDEX_PATH)
+        return ivf
+    raise ValueError(f"Unknown RAG_INDEX_BACKEND: {INDEX_BACKEND}")
+
+def encode_queries(queries):
+    """
+    Encodes query texts. A single query (the /ask case) goes through the shared batcher,
+    so concurrent requests are encoded together; larger lists are already a batch.
+    """
+    queries = list(queries)
+    if len(queries) == 1 and BATCH_MAX_SIZE > 1:
+        return query_batcher.encode(queries[0])[None, :]
+    return get_model().encode(queries, convert_to_numpy=True)
+
+def search(query, k=3, filters=None):
+    """
+    Returns top-k most relevant chunks for the given query using cosine similarity.
+    filters restricts the search to matching chunks, e.g. {"persona": "tenants"} or
+    {"act": "Consumer Protection Act", "year": [2019]}; see metadata_index.normalize_filters().
+    """
+    return search_batch([query], k, filters)[0]
+
+def search_batch(queries, k=3, filters=None):
+    """
+    Returns the top-k most relevant chunks for each query in queries.
+    Queries seen recently are answered from query_cache; the rest are encoded
+    together and scored in a single matrix multiply.
+    """
+    current = current_state()
+    return [[current.texts[i] for i in ids] for _, ids, _ in retrieve_batch(queries, k, current, filters)]
+
+def retrieve(query, k=3, current=None, filters=None):
+    """
+    Returns (query_vector, chunk_ids, scores) for a single query.
+    """
+    return retrieve_batch([query], k, current, filters)[0]
+
+def get_texts(chunk_ids, current=None):
+    """
+    Returns the chunk texts for ids produced by retrieve(). Pass the same state
+    as to retrieve(), so a reload in between cannot mismatch ids and texts.
+    """
+    current = current or current_state()
+    return [current.texts[i] for i in chunk_ids]
+
+def retrieve_batch(queries, k=3, current=None, filters=None):
+    """
+    Returns one (query_vector, chunk_ids, scores) tuple per query, using query_cache.
+    Searches current (default: the live state), so ids refer to its texts.
+    With filters, only the matching chunks are scored (an empty match gives no results).
+    Raises ValueError for invalid filters.
+    """
+    current = current or current_state()
+    filters = normalize_filters(filters)
 
-    query_vec = model.encode([query])
-    distances, indices = nn_model.kneighbors(query_vec, n_neighbors=k)
-    return [texts[i] for i in indices[0]]
+    queries = list(queries)
+    keys = [(current.version, normalize_query(q), k, filters) for q in queries]
+    results = [query_cache.get(key) for key in keys]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if missing:
+        with metrics.stage("query_encode"):
+            query_vecs = encode_queries([queries[i] for i in missing])
+        subset = None
+        if filters:
+            with metrics.stage("filter"):
+                subset = current.metadata_index.select(filters)
+        with metrics.stage("knn"):
+            if subset is None:
+                scores, indices = current.index.search(query_vecs, k)
+            else:
+                scores, indices = current.index.search_subset(query_vecs, k, subset)
+        for row, i in enumerate(missing):
+            # Approximate backends mark unfilled slots with -1
+            found = indices[row] >= 0
+            results[i] = (
+                query_vecs[row],
+                tuple(int(j) for j in indices[row][found]),
+                tuple(float(x) for x in scores[row][found]),
+            )
+            query_cache.put(keys[i], results[i])
+    return results
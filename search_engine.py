@@ -0,0 +1,253 @@
+import argparse
+import time
+import numpy as np
+
+STORAGE_TYPES = ("float32", "float16", "int8")
+
+# Rows upcast per block when scoring compact storage, bounding the float32 temporary.
+SCORE_BLOCK_SIZE = 32768
+# A filtered search gathers and scores only the subset's rows while it is smaller than this
+# fraction of the index; past it, copying the rows costs more than scoring everything.
+SUBSET_GATHER_FRACTION = 0.25
+
+
+def normalize(vectors):
+    """
+    Returns a float32 copy of vectors with every row scaled to unit L2 norm.
+    Rows with zero norm are left as zeros so they never match anything.
+    """
+    vectors = np.array(vectors, dtype=np.float32, copy=True, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def top_k(scores, k):
+    """
+    Picks the k highest scores in every row of a (n_queries, n_items) score matrix.
+    Uses argpartition so only the k winners are sorted.
+    Returns (top_scores, top_ids), both (n_queries, k) and ordered best first.
+    """
+    n_items = scores.shape[1]
+    k = min(k, n_items)
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.float32), empty.astype(np.int64)
+
+    if k < n_items:
+        candidate_ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidate_ids = np.broadcast_to(np.arange(n_items), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidate_ids, axis=1)
+
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return (
+        np.take_along_axis(candidate_scores, order, axis=1),
+        np.take_along_axis(candidate_ids, order, axis=1),
+    )
+
+
+def quantize(vectors, storage="float32"):
+    """
+    Converts normalized float32 vectors to the given storage type.
+    Returns (data, scales); scales is a per-dimension float32 array for int8 and None otherwise.
+    int8 is symmetric scalar quantization: each dimension is scaled so its largest magnitude maps to 127.
+    """
+    if storage == "float32":
+        return np.ascontiguousarray(vectors, dtype=np.float32), None
+    if storage == "float16":
+        return vectors.astype(np.float16), None
+    if storage == "int8":
+        scales = np.abs(vectors).max(axis=0) / 127.0 if len(vectors) else np.ones(vectors.shape[1])
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        data = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+        return data, scales
+    raise ValueError(f"Unknown storage type: {storage} (expected one of {STORAGE_TYPES})")
+
+
+def score(queries, data, scales=None):
+    """
+    Dot-product scores of normalized float32 queries against stored vectors.
+    For int8 the per-dimension scales are folded into the queries, so the stored codes
+    are never dequantized; compact rows are only upcast one block at a time for the multiply.
+    """
+    if scales is not None:
+        queries = queries * scales
+    if data.dtype == np.float32:
+        return queries @ data.T
+
+    scores = np.empty((queries.shape[0], data.shape[0]), dtype=np.float32)
+    for start in range(0, data.shape[0], SCORE_BLOCK_SIZE):
+        block = data[start:start + SCORE_BLOCK_SIZE]
+        scores[:, start:start + len(block)] = queries @ block.T.astype(np.float32)
+    return scores
+
+
+class ExactIndex:
+    """
+    Exact cosine-similarity search. Vectors are normalized once at build time,
+    so a query is a single matrix multiply followed by a top-k selection.
+    storage selects float32, float16 or int8 for the stored vectors. Already normalized float32
+    vectors (e.g. memory-mapped from a snapshot) are used without a copy for float32 storage.
+    """
+
+    def __init__(self, vectors, storage="float32", normalized=False):
+        self.storage = storage
+        self.vectors, self.scales = quantize(vectors if normalized else normalize(vectors), storage)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def nbytes(self):
+        """Memory held by the stored vectors (and int8 scales)."""
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def search(self, queries, k):
+        """
+        Scores every query in one matrix multiply.
+        Returns (scores, ids) arrays of shape (n_queries, k), best match first.
+        """
+        return top_k(score(normalize(queries), self.vectors, self.scales), k)
+
+    def search_subset(self, queries, k, ids):
+        """
+        search() restricted to the given row ids (e.g. a metadata filter's matches).
+        A small subset's rows are gathered and scored alone, so the cost shrinks with the subset;
+        a large one is scored in a full pass and its columns picked out.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        queries = normalize(queries)
+        if len(ids) > SUBSET_GATHER_FRACTION * len(self):
+            scores = score(queries, self.vectors, self.scales)[:, ids]
+        else:
+            scores = score(queries, self.vectors[ids], self.scales)
+        top_scores, picked = top_k(scores, k)
+        return top_scores, ids[picked]
+
+
+class LayeredIndex:
+    """
+    Incremental view over an immutable base index: vectors appended since the base was built
+    are scored exactly in a small side array (row ids continue after the base), and deleted
+    rows are tombstoned and filtered out of results. Instances are never modified;
+    with_changes() returns a new one, so a search never sees a half-applied update.
+    Rebuilding the base from the live rows (compaction) bounds the side array and tombstones.
+    """
+
+    def __init__(self, base, base_size, added=None, deleted=frozenset()):
+        self.base = base
+        self.base_size = base_size
+        self.added = added if added is not None else np.empty((0, 0), dtype=np.float32)
+        self.deleted = frozenset(deleted)
+        self._added_index = ExactIndex(self.added, normalized=True) if len(self.added) else None
+        self._deleted_ids = np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted))
+
+    def __len__(self):
+        """Number of row ids, tombstoned ones included."""
+        return self.base_size + len(self.added)
+
+    @property
+    def live(self):
+        return len(self) - len(self.deleted)
+
+    @property
+    def nbytes(self):
+        return getattr(self.base, "nbytes", 0) + self.added.nbytes + self._deleted_ids.nbytes
+
+    def with_changes(self, added=None, deleted=()):
+        """New index with normalized float32 rows appended (ids len(self) onwards) and ids tombstoned."""
+        new_added = self.added
+        if added is not None and len(added):
+            new_added = np.concatenate([self.added, added]) if len(self.added) else np.asarray(added, dtype=np.float32)
+        return LayeredIndex(self.base, self.base_size, new_added, self.deleted | set(deleted))
+
+    def search(self, queries, k):
+        """Same contract as ExactIndex.search(); unfilled slots are id -1 with score -inf."""
+        # Ask the base for enough extra candidates to make up for tombstoned hits
+        base_scores, base_ids = self.base.search(queries, k + len(self.deleted))
+        parts_scores, parts_ids = [base_scores], [base_ids]
+        if self._added_index is not None:
+            added_scores, added_ids = self._added_index.search(queries, k + len(self.deleted))
+            parts_scores.append(added_scores)
+            parts_ids.append(added_ids + self.base_size)
+
+        scores = np.concatenate(parts_scores, axis=1).astype(np.float32)
+        ids = np.concatenate(parts_ids, axis=1)
+        dead = (ids < 0) | np.isin(ids, self._deleted_ids)
+        scores[dead] = -np.inf
+        top_scores, picked = top_k(scores, k)
+        top_ids = np.take_along_axis(ids, picked, axis=1)
+        top_ids[np.isneginf(top_scores)] = -1
+        return top_scores, top_ids
+
+    def search_subset(self, queries, k, ids):
+        """search_subset() over base and appended rows; tombstoned ids are dropped from the subset first."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self._deleted_ids):
+            ids = ids[~np.isin(ids, self._deleted_ids)]
+        base_ids = ids[ids < self.base_size]
+        added_ids = ids[ids >= self.base_size] - self.base_size
+
+        parts_scores = [np.empty((len(queries), 0), dtype=np.float32)]
+        parts_ids = [np.empty((len(queries), 0), dtype=np.int64)]
+        if len(base_ids):
+            base_scores, found = self.base.search_subset(queries, k, base_ids)
+            parts_scores.append(base_scores)
+            parts_ids.append(found)
+        if len(added_ids):
+            added_scores, found = self._added_index.search_subset(queries, k, added_ids)
+            parts_scores.append(added_scores)
+            parts_ids.append(found + self.base_size)
+
+        scores = np.concatenate(parts_scores, axis=1).astype(np.float32)
+        ids = np.concatenate(parts_ids, axis=1)
+        top_scores, picked = top_k(scores, k)
+        return top_scores, np.take_along_axis(ids, picked, axis=1)
+
+
+def quantization_report(vectors, queries, k=3):
+    """
+    Compares float16 and int8 storage against float32 for the given corpus.
+    Returns one dict per storage type with memory use, recall@k against float32 and mean query latency.
+    """
+    def recall(ids, reference):
+        return sum(len(np.intersect1d(a, b)) for a, b in zip(ids, reference)) / reference.size
+
+    report = []
+    reference_ids = None
+    for storage in STORAGE_TYPES:
+        index = ExactIndex(vectors, storage=storage)
+        start = time.perf_counter()
+        _, ids = index.search(queries, k)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        if reference_ids is None:
+            reference_ids, reference_bytes = ids, index.nbytes
+        report.append({
+            "storage": storage,
+            "megabytes": index.nbytes / 2**20,
+            "memory_saved": 1 - index.nbytes / reference_bytes,
+            f"recall@{k}": recall(ids, reference_ids),
+            "ms_per_query": elapsed_ms,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and recall@k of float16/int8 storage against float32.")
+    parser.add_argument("--n", type=int, default=100000, help="number of synthetic chunks")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    # Clustered random vectors stand in for MiniLM embeddings of the corpus.
+    rng = np.random.default_rng(0)
+    topics = rng.standard_normal((max(16, args.n // 500), args.dim)).astype(np.float32)
+    data = topics[rng.integers(0, len(topics), args.n + args.queries)]
+    data += 0.6 * rng.standard_normal(data.shape).astype(np.float32)
+
+    print(f"{'storage':8} {'MB':>8} {'saved':>7} {'recall@' + str(args.k):>9} {'ms/query':>9}")
+    for row in quantization_report(data[:args.n], data[args.n:], k=args.k):
+        print(f"{row['storage']:8} {row['megabytes']:>8.1f} {row['memory_saved']:>7.1%} "
+              f"{row[f'recall@{args.k}']:>9.3f} {row['ms_per_query']:>9.3f}")
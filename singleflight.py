@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls: while fn is running for a key, other callers with the
+    same key wait for that run instead of starting their own, and all receive its result
+    or its exception. Nothing is cached once the call finishes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "coalesced": 0, "errors": 0}
+
+    def do(self, key, fn):
+        """Runs fn() once per key at a time. Returns (result, shared), shared=True for waiting callers."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["calls"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
+
+
+class _AsyncCall:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight; must be used from a single event loop. The call runs
+    in its own task, so a cancelled caller (the first one included) does not cancel it for the
+    others; it is only cancelled once every caller has gone.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._stats = {"calls": 0, "coalesced": 0, "errors": 0}
+
+    async def _run(self, key, coro_fn):
+        try:
+            return await coro_fn()
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            call = self._calls.get(key)
+            if call is not None and call.task is asyncio.current_task():
+                del self._calls[key]
+
+    async def do(self, key, coro_fn):
+        """Awaits coro_fn() once per key at a time. Returns (result, shared)."""
+        call = self._calls.get(key)
+        shared = call is not None
+        if shared:
+            self._stats["coalesced"] += 1
+        else:
+            call = self._calls[key] = _AsyncCall(asyncio.ensure_future(self._run(key, coro_fn)))
+            self._stats["calls"] += 1
+        call.waiters += 1
+        try:
+            # shield: a cancelled caller must not cancel the shared call
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                if self._calls.get(key) is call:
+                    del self._calls[key]  # A later caller starts afresh instead of joining a cancelled call
+                call.task.cancel()
+
+    def stats(self):
+        return dict(self._stats, in_flight=len(self._calls))
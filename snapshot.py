@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+import numpy as np
+
+# Versioned single-file snapshot of a loaded corpus: chunk texts, per-chunk metadata,
+# the normalized float32 embeddings and the id of the model that produced them.
+#
+#   magic (8 bytes) | format version (uint32) | header length (uint64) | JSON header | padding | vectors
+#
+# The vectors start on a 64-byte boundary and are memory-mapped on load, so opening a
+# snapshot costs a JSON parse of the texts rather than a copy of the embedding matrix.
+
+SNAPSHOT_DIR = os.path.join("legal_data", ".snapshots")
+MAGIC = b"LEGALSNP"
+FORMAT_VERSION = 1
+_PREAMBLE = struct.Struct("<8sIQ")
+# Files written by publish_snapshot(): <version>.snap, or <version>-<n>.snap if that name is taken
+VERSIONED_NAME = re.compile(r"^\d{8}T\d{6}-[0-9a-f]{8}(?:-\d+)?\.snap$")
+_ALIGNMENT = 64
+
+
+class SnapshotError(ValueError):
+    """The file is not a snapshot this code can read, or it is truncated."""
+
+
+class Snapshot:
+    """A loaded snapshot. vectors is a read-only memory map into the file."""
+
+    def __init__(self, path, header, vectors):
+        self.path = path
+        self.version = header["version"]
+        self.model = header["model"]
+        self.created_at = header["created_at"]
+        self.fingerprint = header.get("fingerprint")
+        self.texts = header["texts"]
+        self.metadata = header["metadata"]
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.texts)
+
+
+def corpus_fingerprint(paths, salt=""):
+    """
+    Cheap identity of a corpus: a digest over every document's path, size and modification time.
+    A snapshot whose fingerprint matches the corpus on disk can be loaded instead of rebuilt.
+    salt identifies the code that chunked it, so a chunker change also forces a rebuild.
+    """
+    digest = hashlib.sha256(salt.encode("utf-8"))
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write_snapshot(path, texts, metadata, vectors, model_name, fingerprint=None):
+    """
+    Writes a snapshot of normalized float32 vectors with their texts and metadata.
+    The file is written under a temporary name, flushed to disk and renamed, so a
+    reader never opens a half-written snapshot. Returns the snapshot version.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if vectors.ndim != 2 or len(vectors) != len(texts) or len(metadata) != len(texts):
+        raise ValueError("texts, metadata and vectors must have one entry per chunk")
+
+    digest = hashlib.sha256(model_name.encode("utf-8"))
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+    version = time.strftime("%Y%m%dT%H%M%S") + "-" + digest.hexdigest()[:8]
+
+    header = json.dumps({
+        "version": version,
+        "model": model_name,
+        "created_at": time.time(),
+        "fingerprint": fingerprint,
+        "count": len(texts),
+        "dim": int(vectors.shape[1]),
+        "dtype": "float32",
+        "texts": texts,
+        "metadata": metadata,
+    }).encode("utf-8")
+    vectors_offset = -(-(_PREAMBLE.size + len(header)) // _ALIGNMENT) * _ALIGNMENT
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(b"\0" * (vectors_offset - _PREAMBLE.size - len(header)))
+        f.write(vectors.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return version
+
+
+def publish_snapshot(pointer_path, texts, metadata, vectors, model_name, fingerprint=None):
+    """
+    Writes a snapshot to a new versioned file next to pointer_path, then atomically points
+    pointer_path (a one-line text file) at it. Snapshot files are never overwritten, so the
+    one the live state has memory-mapped (which Windows refuses to replace) stays untouched
+    until prune_snapshots() removes it. Returns (version, snapshot path).
+    """
+    directory = os.path.dirname(pointer_path) or "."
+    staging = os.path.join(directory, f".staging-{os.getpid()}-{threading.get_ident()}.snap")
+    try:
+        version = write_snapshot(staging, texts, metadata, vectors, model_name, fingerprint)
+    except BaseException:
+        for leftover in (staging, staging + ".tmp"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    path, n = os.path.join(directory, f"{version}.snap"), 1
+    while os.path.exists(path):
+        path, n = os.path.join(directory, f"{version}-{n}.snap"), n + 1
+    os.replace(staging, path)
+
+    tmp_pointer = pointer_path + ".tmp"
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(path) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, pointer_path)
+    return version, path
+
+
+def resolve_snapshot(pointer_path):
+    """
+    Path of the snapshot pointer_path names, or None if there is none. A pointer_path that
+    is itself a snapshot (the single-file layout used before versioned files) is returned as is.
+    """
+    try:
+        with open(pointer_path, "rb") as f:
+            head = f.read(256)
+    except FileNotFoundError:
+        return None
+    if head.startswith(MAGIC):
+        return pointer_path
+    name = head.decode("utf-8", errors="replace").strip()
+    return os.path.join(os.path.dirname(pointer_path) or ".", name) if name else None
+
+
+def prune_snapshots(pointer_path, keep=()):
+    """
+    Deletes versioned snapshots next to pointer_path other than the current one and keep.
+    A file that cannot be deleted yet (still mapped on Windows) is left for the next call.
+    Returns the number of files removed.
+    """
+    directory = os.path.dirname(pointer_path) or "."
+    keep = {os.path.abspath(p) for p in keep if p}
+    current = resolve_snapshot(pointer_path)
+    if current:
+        keep.add(os.path.abspath(current))
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(directory, name)
+        if VERSIONED_NAME.match(name) and os.path.abspath(path) not in keep:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def read_snapshot(path):
+    """Opens a snapshot, memory-mapping its vectors. Raises SnapshotError if the file is not usable."""
+    with open(path, "rb") as f:
+        preamble = f.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size:
+            raise SnapshotError(f"{path} is truncated")
+        magic, format_version, header_length = _PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a LegalEase snapshot")
+        if format_version != FORMAT_VERSION:
+            raise SnapshotError(f"{path} has snapshot format {format_version}, expected {FORMAT_VERSION}")
+        try:
+            header = json.loads(f.read(header_length).decode("utf-8"))
+        except ValueError as e:
+            raise SnapshotError(f"{path} has a corrupt header: {e}")
+
+    vectors_offset = -(-(_PREAMBLE.size + header_length) // _ALIGNMENT) * _ALIGNMENT
+    shape = (header["count"], header["dim"])
+    if os.path.getsize(path) < vectors_offset + shape[0] * shape[1] * 4:
+        raise SnapshotError(f"{path} is truncated")
+    if shape[0] == 0:
+        vectors = np.empty(shape, dtype=np.float32)
+    else:
+        vectors = np.memmap(path, dtype=np.float32, mode="r", offset=vectors_offset, shape=shape)
+    return Snapshot(path, header, vectors)
@@ -0,0 +1,732 @@
+import base64
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from werkzeug.serving import make_server
+
+import azure_client
+import metrics
+import translation_service
+import tts_cache
+from admission import UpstreamLimiter
+from llm_router import Deployment, LLMRouter
+from bhashini_config import BhashiniConfigError, PipelineConfigCache
+from snapshot import write_snapshot
+from translation_service import TranslationMemory, TranslationService
+from tts_cache import TTSCache
+from stub_servers import start_azure_stub, start_bhashini_stub
+
+# Runs the Flask app against local stub servers (see stub_servers.py) and reports
+# latency figures. No Azure or Bhashini credentials are needed.
+
+QUESTION = "Can my landlord evict me without notice?"
+
+
+def start_app_server():
+    """
+    Imports app.py, serves it on an ephemeral local port in a background thread
+    and waits for /ready. Returns (server, base_url).
+    """
+    import app as flask_app
+    server = make_server("127.0.0.1", 0, flask_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    deadline = time.time() + 300
+    while requests.get(f"{base_url}/ready").status_code != 200:
+        if time.time() > deadline:
+            raise RuntimeError("App did not become ready within 5 minutes")
+        time.sleep(0.5)
+    return server, base_url
+
+
+def point_app_at(*stubs, **router_options):
+    """Routes the app's Azure OpenAI calls to one or more stub servers. Returns the new router."""
+    import app as flask_app
+    deployments = [Deployment(f"stub-{i}", stub.url, "stub-deployment", "stub-key", "2024-02-15-preview")
+                   for i, stub in enumerate(stubs)]
+    flask_app.router = LLMRouter(deployments, **router_options)
+    return flask_app.router
+
+
+def read_sse(response):
+    """Yields (event, data) pairs from a streaming text/event-stream response."""
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            yield event or "message", json.loads(line[len("data:"):].strip())
+            event = None
+
+
+def check_streaming(base_url):
+    """
+    Compares time-to-first-token of /ask/stream with the full latency of /ask,
+    then verifies that a connection dropped mid-stream surfaces as an error event.
+    """
+    print("\n--- Streaming /ask/stream against the Azure stub ---")
+    stub = start_azure_stub(first_token_delay=0.3, token_delay=0.03)
+    point_app_at(stub)
+    no_cache = {"X-Cache-Bypass": "1"}
+    try:
+        start = time.perf_counter()
+        response = requests.post(f"{base_url}/ask", json={"question": QUESTION}, headers=no_cache)
+        blocking_ms = (time.perf_counter() - start) * 1000
+        print(f"/ask status {response.status_code}, full answer after {blocking_ms:.0f} ms")
+
+        start = time.perf_counter()
+        first_token_ms = None
+        tokens = 0
+        with requests.post(f"{base_url}/ask/stream", json={"question": QUESTION}, headers=no_cache, stream=True) as response:
+            for event, data in read_sse(response):
+                if event == "message":
+                    tokens += 1
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                elif event == "done":
+                    break
+        total_ms = (time.perf_counter() - start) * 1000
+        print(f"/ask/stream time-to-first-token {first_token_ms:.0f} ms, {tokens} tokens, complete after {total_ms:.0f} ms")
+
+        stub.config["fail_after_tokens"] = 3
+        with requests.post(f"{base_url}/ask/stream", json={"question": QUESTION}, headers=no_cache, stream=True) as response:
+            events = [event for event, _ in read_sse(response)]
+        if events and events[-1] == "error":
+            print(f"Mid-stream upstream failure reported as an error event after {events.count('message')} tokens.")
+        else:
+            print(f"ERROR: mid-stream failure was not reported; events: {events}")
+    finally:
+        stub.stop()
+
+
+def check_upstream_client(base_url, n_requests=20):
+    """
+    Sends sequential /ask requests and reports how many upstream connections were opened,
+    then checks that 429s carrying Retry-After are retried instead of failing the request.
+    """
+    print("\n--- Pooled Azure client against the Azure stub ---")
+    stub = start_azure_stub(first_token_delay=0.01, token_delay=0.0)
+    point_app_at(stub)
+    no_cache = {"X-Cache-Bypass": "1"}
+    try:
+        before = azure_client.stats()
+        for _ in range(n_requests):
+            requests.post(f"{base_url}/ask", json={"question": QUESTION}, headers=no_cache).raise_for_status()
+        after = azure_client.stats()
+        opened = after["connections_opened"] - before["connections_opened"]
+        print(f"{n_requests} answers over {opened} new upstream connection(s); overall reuse {after['connection_reuse']:.0%}")
+
+        stub.config.update(status=429, retry_after=1, fail_first=stub.request_count + 2)
+        before_count = stub.request_count
+        start = time.perf_counter()
+        response = requests.post(f"{base_url}/ask", json={"question": QUESTION}, headers=no_cache)
+        elapsed = time.perf_counter() - start
+        retries = stub.request_count - before_count - 1
+        print(f"Two 429s with Retry-After: 1 -> status {response.status_code} after {retries} retries in {elapsed:.1f} s")
+    finally:
+        stub.stop()
+
+
+def check_coalescing(base_url, n_clients=20):
+    """
+    Fires identical questions concurrently and checks they reach the Azure stub as one call,
+    for a successful answer and for an upstream error that every caller must see.
+    """
+    print("\n--- Single-flight coalescing against the Azure stub ---")
+    import app as flask_app
+    stub = start_azure_stub(first_token_delay=0.5, token_delay=0.0)
+    point_app_at(stub)
+    no_cache = {"X-Cache-Bypass": "1"}
+
+    def fire():
+        with ThreadPoolExecutor(max_workers=n_clients) as pool:
+            futures = [pool.submit(requests.post, f"{base_url}/ask", json={"question": QUESTION}, headers=no_cache)
+                       for _ in range(n_clients)]
+            return [f.result() for f in futures]
+
+    try:
+        responses = fire()
+        statuses = sorted({r.status_code for r in responses})
+        print(f"{n_clients} concurrent identical questions -> {stub.request_count} upstream call(s), statuses {statuses}")
+
+        stub.config["status"] = 400  # Not retried, so every waiter must receive the leader's error
+        before = stub.request_count
+        responses = fire()
+        statuses = sorted({r.status_code for r in responses})
+        print(f"Upstream 400 -> {stub.request_count - before} upstream call(s), statuses {statuses}")
+        print(f"Single-flight stats: {flask_app.inflight.stats()}")
+    finally:
+        stub.stop()
+
+
+def check_admission(base_url, n_clients=30):
+    """
+    Sends a burst of distinct questions to an Azure stub that enforces a token quota, first
+    with no local budget (the limiter only pauses after upstream 429s) and then with the
+    limiter configured to the same quota. With the budget, excess requests should be shed
+    quickly as 503 + Retry-After instead of piling up 429s upstream.
+    """
+    print("\n--- Admission control against a quota-enforcing Azure stub ---")
+    import app as flask_app
+    window = 5
+    token_quota = 6000  # about four requests per window at ~1200 estimated tokens each
+    stub = start_azure_stub(first_token_delay=0.2, token_delay=0.0, token_quota=token_quota, quota_window=window)
+    point_app_at(stub)
+    no_cache = {"X-Cache-Bypass": "1"}
+    original_limiter = flask_app.upstream_limiter
+
+    def burst(label):
+        before = stub.state.get("quota_rejections", 0)
+        with ThreadPoolExecutor(max_workers=n_clients) as pool:
+            start = time.perf_counter()
+            futures = [pool.submit(requests.post, f"{base_url}/ask", json={"question": f"{QUESTION} ({label} {i})"},
+                                   headers=no_cache) for i in range(n_clients)]
+            responses = [f.result() for f in futures]
+            elapsed = time.perf_counter() - start
+        counts = {}
+        for r in responses:
+            counts[r.status_code] = counts.get(r.status_code, 0) + 1
+        retry_after = sorted({r.headers["Retry-After"] for r in responses if r.status_code == 503})
+        print(f"{label}: statuses {counts}, upstream 429s {stub.state.get('quota_rejections', 0) - before}, "
+              f"Retry-After {retry_after or '-'}, burst took {elapsed:.1f} s")
+
+    try:
+        flask_app.upstream_limiter = UpstreamLimiter(tpm=0, rpm=0)
+        burst("429 pause only")
+        time.sleep(window)
+        flask_app.upstream_limiter = UpstreamLimiter(tpm=token_quota * 60 // window, window=window, queue_size=8, max_wait=3)
+        burst("with budget")
+        print(f"Limiter stats: {flask_app.upstream_limiter.stats()}")
+    finally:
+        flask_app.upstream_limiter = original_limiter
+        stub.stop()
+
+
+def check_routing(base_url):
+    """
+    Runs /ask against three Azure stubs: a fast one, a slow one and one returning 500s.
+    The failing stub should be ejected and traffic should settle on the fast one. A stall
+    on the fast stub should then be hedged to the slow one, but not while the admission quota
+    has no headroom, and once the failing stub is fixed it should be probed and readmitted
+    after its cooldown.
+    """
+    print("\n--- Multi-deployment routing against three Azure stubs ---")
+    import app as flask_app
+    fast = start_azure_stub(first_token_delay=0.05, token_delay=0.0)
+    slow = start_azure_stub(first_token_delay=0.6, token_delay=0.0)
+    failing = start_azure_stub(status=500)
+    cooldown = 1
+    router = point_app_at(fast, slow, failing, cooldown=cooldown)
+    names = {"stub-0": "fast", "stub-1": "slow", "stub-2": "failing"}
+    no_cache = {"X-Cache-Bypass": "1"}
+
+    def ask(n, label):
+        statuses, latencies = [], []
+        for i in range(n):
+            start = time.perf_counter()
+            response = requests.post(f"{base_url}/ask", json={"question": f"{QUESTION} ({label} {i})"}, headers=no_cache)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses.append(response.status_code)
+        return statuses, latencies
+
+    def report(label, statuses, latencies):
+        deployments = router.stats()["deployments"]
+        summary = ", ".join(f"{names[name]} {d['requests']} req/{d['state']}" for name, d in deployments.items())
+        print(f"{label}: statuses {sorted(set(statuses))}, max {max(latencies):.0f} ms; {summary}")
+
+    try:
+        statuses, latencies = ask(20, "warm-up")
+        report("20 requests", statuses, latencies)
+
+        fast.config["first_token_delay"] = 3.0  # The fast deployment stalls
+        statuses, latencies = ask(1, "stall")
+        stats = router.stats()
+        print(f"Stalled fast stub: answered in {latencies[0]:.0f} ms, hedged {stats['hedged']}, "
+              f"hedge wins {stats['hedge_wins']}, cancelled {stats['cancelled']}")
+
+        # A quota of one request per burst window leaves no headroom for a hedge after admission
+        original_limiter = flask_app.upstream_limiter
+        flask_app.upstream_limiter = UpstreamLimiter(tpm=0, rpm=6, window=10)
+        try:
+            statuses, latencies = ask(1, "stall without headroom")
+            stats = router.stats()
+            print(f"Stalled fast stub, quota exhausted: answered in {latencies[0]:.0f} ms, hedged {stats['hedged']}, "
+                  f"hedges skipped {stats['hedges_skipped']}; limiter {flask_app.upstream_limiter.stats()['extra_refused']} refused")
+        finally:
+            flask_app.upstream_limiter = original_limiter
+        fast.config["first_token_delay"] = 0.05
+
+        failing.config["status"] = 200
+        while router.stats()["deployments"]["stub-2"]["state"] == "ejected":
+            time.sleep(0.2)
+        statuses, latencies = ask(5, "recovery")
+        report("Failing stub fixed", statuses, latencies)
+    finally:
+        for stub in (fast, slow, failing):
+            stub.stop()
+
+
+def check_reload(base_url, n_clients=8):
+    """
+    Writes a snapshot holding the current corpus plus one extra chunk and hot-loads it through
+    POST /admin/reload while clients keep asking questions. Every request should succeed and
+    /ready should report the new snapshot version once it has been swapped in.
+    """
+    print("\n--- Hot reload from a snapshot while serving ---")
+    import numpy as np
+    import rag_utils
+    stub = start_azure_stub(first_token_delay=0.02, token_delay=0.0)
+    point_app_at(stub)
+    current = rag_utils.current_state()
+    texts = list(current.texts) + ["Section 999. A test provision added by the reload check."]
+    metadata = list(current.metadata) + [{"act": None, "chapter": None, "section": "999", "source": "reload-check", "offset": 0}]
+    vectors = np.vstack([current.vectors, current.vectors[:1]])
+    path = os.path.join(tempfile.mkdtemp(), "reload-check.snap")
+    new_version = write_snapshot(path, texts, metadata, vectors, rag_utils.MODEL_NAME)
+
+    statuses = []
+    stop = threading.Event()
+
+    def client(client_id):
+        n = 0
+        while not stop.is_set():
+            response = requests.post(f"{base_url}/ask", json={"question": f"{QUESTION} (reload {client_id} {n})"},
+                                     headers={"X-Cache-Bypass": "1"})
+            statuses.append(response.status_code)
+            n += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(n_clients)]
+    try:
+        old_version = requests.get(f"{base_url}/ready").json()["version"]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+        start = time.perf_counter()
+        response = requests.post(f"{base_url}/admin/reload", json={"snapshot": path})
+        while True:
+            ready = requests.get(f"{base_url}/ready").json()
+            if not ready["reloading"]:
+                break
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        time.sleep(0.5)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        stub.stop()
+
+    counts = {}
+    for code in statuses:
+        counts[code] = counts.get(code, 0) + 1
+    swapped = ready["version"] == new_version
+    print(f"/admin/reload -> {response.status_code}; {old_version} -> {ready['version']} "
+          f"({'swapped' if swapped else 'NOT swapped: ' + str(ready['reload_error'])}) in {elapsed * 1000:.0f} ms")
+    print(f"{len(statuses)} /ask requests during the reload, statuses {counts}; "
+          f"{len(rag_utils.current_state().texts)} chunks now served")
+
+
+def check_filters(base_url):
+    """
+    Lists the filter facets, then asks the same question unfiltered, restricted to the tenants
+    persona and restricted to named acts, checking that every retrieved chunk matches its filter.
+    Act names must come out of bareacts.txt whole, with or without a year.
+    An unknown filter field must be rejected with 400.
+    """
+    print("\n--- Metadata-filtered retrieval ---")
+    import rag_utils
+    stub = start_azure_stub(first_token_delay=0.02, token_delay=0.0)
+    point_app_at(stub)
+    try:
+        facets = requests.get(f"{base_url}/filters").json()
+        print(f"{len(facets['act'])} acts, {len(facets['year'])} years; personas {facets['persona']}")
+        expected = ["Right to Information Act, 2005", "Protection of Children from Sexual Offences (POCSO) Act, 2012",
+                    "Scheduled Castes and Scheduled Tribes (Prevention of Atrocities) Act, 1989", "Rent Control Act",
+                    "Juvenile Justice Act", "Indian Succession Act"]
+        print(f"act names missing from the facets: {[act for act in expected if act not in facets['act']]}")
+        for filters in (None, {"persona": "tenants"}, {"act": ["Rent Control Act"]},
+                        {"act": "Right to Information Act"}, {"persona": ["seniors", "students"], "year": 2005}):
+            current = rag_utils.current_state()
+            subset = current.metadata_index.select(filters)
+            start = time.perf_counter()
+            _, ids, _ = rag_utils.retrieve(QUESTION, k=5, current=current, filters=filters)
+            elapsed = (time.perf_counter() - start) * 1000
+            outside = [] if subset is None else [i for i in ids if i not in set(subset.tolist())]
+            response = requests.post(f"{base_url}/ask", json={"question": QUESTION, "filters": filters},
+                                     headers={"X-Cache-Bypass": "1"})
+            print(f"filters={filters}: {len(current.texts) if subset is None else len(subset)} candidates, "
+                  f"{len(ids)} retrieved in {elapsed:.1f} ms, {len(outside)} outside the filter; /ask -> {response.status_code}")
+        response = requests.post(f"{base_url}/ask", json={"question": QUESTION, "filters": {"topic": "rent"}})
+        print(f"unknown filter field -> {response.status_code} {response.json()['error']}")
+    finally:
+        stub.stop()
+
+
+def check_incremental(n_clients=4):
+    """
+    Adds, updates and deletes chunks (directly and by editing a watched document) while
+    clients search, then forces a compaction. No search may return a tombstoned id of the
+    state it searched, and a query for a deleted provision must stop finding it.
+    """
+    print("\n--- Incremental index updates while searching ---")
+    import rag_utils
+    violations, searches = [], [0]
+    stop = threading.Event()
+
+    def client():
+        while not stop.is_set():
+            current = rag_utils.current_state()
+            _, ids, _ = rag_utils.retrieve(QUESTION, k=5, current=current)
+            deleted = getattr(current.index, "deleted", frozenset())
+            violations.extend(i for i in ids if i in deleted or i >= len(current.texts))
+            searches[0] += 1
+
+    data_dir = tempfile.mkdtemp()
+    path = os.path.join(data_dir, "amendment.txt")
+    threads = [threading.Thread(target=client) for _ in range(n_clients)]
+    compact_ratio = rag_utils.COMPACT_RATIO
+    rag_utils.COMPACT_RATIO = 1e9  # compaction is forced explicitly below
+    try:
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        ids, version = rag_utils.add_chunks([{"text": "Section 998. Tenants must receive thirty days notice before eviction.",
+                                              "act": None, "chapter": None, "section": "998", "source": "incremental-check",
+                                              "offset": 0}])
+        updated_text = "Section 998. Tenants must receive sixty days notice before eviction."
+        new_id, version = rag_utils.update_chunk(ids[0], updated_text, version)
+        found_updated = new_id in rag_utils.retrieve(updated_text, k=5)[1]
+        rag_utils.delete_chunk(new_id, version)
+        gone = new_id not in rag_utils.retrieve(updated_text, k=5)[1]
+        direct_ms = (time.perf_counter() - start) * 1000
+
+        watcher = rag_utils.CorpusWatcher(data_dir, interval=0)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("Section 1. Rent may be revised once a year.\n\nSection 2. Deposits are capped at two months rent.\n")
+        watcher.poll()
+        time.sleep(0.01)  # make sure the edit gets a new mtime
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("Section 1. Rent may be revised once a year.\n\nSection 2. Deposits are capped at three months rent.\n")
+        watcher.poll()
+        live_sources = [m["source"] for i, m in enumerate(rag_utils.current_state().metadata)
+                        if i not in rag_utils.current_state().index.deleted]
+        after_edit = live_sources.count("amendment.txt")
+        os.remove(path)
+        watcher.poll()
+        before = rag_utils.current_state()
+        compacted = rag_utils.compact()
+        after = rag_utils.current_state()
+        try:
+            rag_utils.delete_chunk(0, before.version)  # ids from before the compaction mean other chunks now
+            stale_rejected = False
+        except KeyError:
+            stale_rejected = True
+        time.sleep(0.2)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        rag_utils.COMPACT_RATIO = compact_ratio
+
+    print(f"add/update/delete applied in {direct_ms:.0f} ms; updated chunk found: {found_updated}, "
+          f"deleted chunk gone: {gone}")
+    print(f"watcher: {after_edit} live chunks for the edited document, "
+          f"{sum(m['source'] == 'amendment.txt' for m in after.metadata)} after it was removed")
+    print(f"compaction {'ran' if compacted else 'did NOT run'}: {len(before.texts)} -> {len(after.texts)} rows "
+          f"({before.version} -> {after.version}); stale id rejected: {stale_rejected}")
+    print(f"{searches[0]} searches during the updates, {len(violations)} returned a deleted chunk")
+
+
+def check_bhashini_config(n_clients=20):
+    """
+    Exercises the Bhashini pipeline config cache against a ULCA stub: concurrent cold lookups
+    should cost one getModelsPipeline call, warm and restarted caches none, an ageing entry
+    should refresh in the background, and an expired one should be served while ULCA is down.
+    """
+    print("\n--- Bhashini pipeline config cache ---")
+    stub = start_bhashini_stub()
+    endpoint = f"{stub.url}/ulca/apis/v0/model/getModelsPipeline"
+    path = os.path.join(tempfile.mkdtemp(), "pipeline_configs.json")
+    try:
+        cache = PipelineConfigCache(path, endpoint=endpoint, ttl=1.0, refresh_ahead=0.5, stale_grace=60)
+        with ThreadPoolExecutor(max_workers=n_clients) as pool:
+            configs = list(pool.map(lambda _: cache.get("translation", "en", "hi"), range(n_clients)))
+        print(f"{n_clients} concurrent cold lookups -> {stub.request_count} config call(s), "
+              f"serviceId {configs[0].service_id}")
+
+        before = stub.request_count
+        start = time.perf_counter()
+        for _ in range(1000):
+            cache.get("translation", "en", "hi")
+        warm_us = (time.perf_counter() - start) * 1e6 / 1000
+        cache.prefetch([("asr", "hi"), ("tts", "hi"), ("translation", "hi", "en")])
+        restarted = PipelineConfigCache(path, endpoint=endpoint, ttl=1.0)
+        restarted.get("asr", "hi")
+        print(f"warm lookup {warm_us:.1f} us; 3 new keys prefetched in {stub.request_count - before} call(s); "
+              f"restarted cache served {restarted.stats()['hits']} hit(s) from disk")
+
+        time.sleep(0.6)
+        before = stub.request_count
+        start = time.perf_counter()
+        cache.get("translation", "en", "hi")
+        ageing_ms = (time.perf_counter() - start) * 1000
+        time.sleep(0.3)
+        print(f"ageing entry returned in {ageing_ms:.2f} ms, background refreshes: {stub.request_count - before}")
+
+        stub.config["config_status"] = 500
+        time.sleep(1.1)
+        stale = cache.get("translation", "en", "hi")
+        print(f"ULCA down, expired entry served: {stale.service_id} (stats {cache.stats()})")
+        stub.config.pop("config_status")
+        stub.config["unsupported"] = ["xx"]
+        try:
+            cache.get("translation", "en", "xx")
+            print("unsupported language pair: NOT rejected")
+        except BhashiniConfigError as e:
+            print(f"unsupported language pair -> BhashiniConfigError: {e}")
+    finally:
+        stub.stop()
+
+
+def check_translation(n_sentences=120, n_unique=40):
+    """
+    Translates an answer of n_sentences (n_unique distinct ones) through a Bhashini stub:
+    one request per sentence as check2 does, then batched with bounded concurrency, then
+    again from the translation memory. Also checks recovery from a rotated inference key.
+    """
+    print("\n--- Bhashini translation: batching, concurrency and translation memory ---")
+    stub = start_bhashini_stub(inference_delay=0.05, segment_delay=0.002)
+    directory = tempfile.mkdtemp()
+    configs = PipelineConfigCache(os.path.join(directory, "pipeline_configs.json"),
+                                  endpoint=f"{stub.url}/ulca/apis/v0/model/getModelsPipeline")
+    sentences = [f"Under section {i % n_unique} a tenant may not be evicted without notice."
+                 for i in range(n_sentences)]
+    text = " ".join(sentences)
+    try:
+        configs.get("translation", "en", "hi")
+        rows = []
+        for label, service in (
+            ("one per request", TranslationService(TranslationMemory(":memory:"), configs, batch_segments=1, max_concurrency=1)),
+            ("batched", TranslationService(TranslationMemory(os.path.join(directory, "tm.sqlite3")), configs,
+                                           batch_segments=16, max_concurrency=4)),
+        ):
+            if label == "one per request":
+                # No deduplication either: every sentence is its own call, like check_bhashini_translation()
+                start = time.perf_counter()
+                for sentence in sentences:
+                    service._translate_batch([sentence], "en", "hi")
+                rows.append((label, time.perf_counter() - start, service.stats()["requests"]))
+                continue
+            stub.state["max_in_flight"] = 0
+            start = time.perf_counter()
+            translated = service.translate(text, "en", "hi")
+            rows.append((label, time.perf_counter() - start, service.stats()["requests"]))
+            requests_before = service.stats()["requests"]
+            start = time.perf_counter()
+            again = service.translate(text, "en", "hi")
+            rows.append(("from memory", time.perf_counter() - start, service.stats()["requests"] - requests_before))
+        for label, elapsed, n_requests in rows:
+            print(f"{label:16} {elapsed * 1000:8.0f} ms {n_requests:4d} inference requests")
+        print(f"max concurrent inference requests: {stub.state['max_in_flight']} (cap 4); "
+              f"{len(service.memory)} segments in memory; output intact: "
+              f"{translated == again and translated.count('[hi] ') == n_sentences}")
+
+        stub.config["inference_key"] = "rotated-key"
+        rotated = service.translate("A brand new sentence after key rotation.", "en", "hi")
+        print(f"after inference key rotation: {rotated!r}")
+    finally:
+        stub.stop()
+
+
+def check_voice(base_url):
+    """
+    Runs /ask/voice in Hindi against Azure and Bhashini stubs and reports when the first
+    sentence's audio arrived compared with the whole answer, plus the per-stage timings.
+    """
+    print("\n--- Voice pipeline: ASR -> RAG -> Azure -> translation -> TTS ---")
+    answer = ("A landlord cannot evict a tenant without notice. The Rent Control Act requires a valid ground. "
+              "The Rent Controller must pass an order first. You may contest the eviction before the Controller. "
+              "Please contact a legal aid center for help.")
+    azure = start_azure_stub(answer=answer, first_token_delay=0.3, token_delay=0.03)
+    bhashini = start_bhashini_stub(inference_delay=0.08, tts_char_delay=0.001)
+    point_app_at(azure)
+    directory = tempfile.mkdtemp()
+    translation_service._service = TranslationService(
+        TranslationMemory(os.path.join(directory, "tm.sqlite3")),
+        PipelineConfigCache(os.path.join(directory, "pipeline_configs.json"),
+                            endpoint=f"{bhashini.url}/ulca/apis/v0/model/getModelsPipeline"),
+    )
+    tts_cache._cache = TTSCache(os.path.join(directory, "tts"))
+    try:
+        start = time.perf_counter()
+        response = requests.post(f"{base_url}/ask/voice", stream=True, headers={"X-Cache-Bypass": "1"},
+                                 json={"audio": "UklGRiQAAABXQVZF", "audio_format": "wav", "language": "hi"})
+        arrivals, audio_urls, done = [], [], None
+        for event, data in read_sse(response):
+            elapsed = (time.perf_counter() - start) * 1000
+            if event == "transcript":
+                print(f"transcript at {elapsed:.0f} ms: {data['text']!r}")
+            elif event == "message":
+                arrivals.append(elapsed)
+                audio_urls.append(data["audio_url"])
+            elif event == "done":
+                done = (elapsed, data)
+            elif event == "error":
+                print(f"error event: {data['error']}")
+        if done:
+            elapsed, data = done
+            print(f"{len(arrivals)} sentences; first audio at {arrivals[0]:.0f} ms, last at {arrivals[-1]:.0f} ms, "
+                  f"done at {elapsed:.0f} ms")
+            print(f"server timings: {data['timings']}")
+            serial = data["timings"].get("llm_done_ms", 0) + data["timings"].get("translation_ms", 0) + data["timings"].get("tts_ms", 0)
+            print(f"without overlap the first audio would wait for the whole answer: ~{serial:.0f} ms")
+            audio = requests.get(f"{base_url}{audio_urls[0]}")
+            print(f"first sentence audio: {audio.status_code} {audio.headers.get('Content-Type')}, {len(audio.content)} bytes")
+        response = requests.post(f"{base_url}/ask/voice", json={"language": "hi"})
+        print(f"no audio -> {response.status_code}")
+    finally:
+        translation_service._service = None
+        tts_cache._cache = None
+        azure.stop()
+        bhashini.stop()
+
+
+def check_tts(base_url, n_repeats=20):
+    """
+    Speaks the same answer sentence through /tts repeatedly and reports how many TTS calls
+    reached Bhashini, the payload against base64 JSON, Range handling and LRU eviction.
+    """
+    print("\n--- TTS cache: content-addressed audio, binary delivery ---")
+    bhashini = start_bhashini_stub(inference_delay=0.2, tts_char_delay=0.002)
+    directory = tempfile.mkdtemp()
+    service = TranslationService(
+        TranslationMemory(os.path.join(directory, "tm.sqlite3")),
+        PipelineConfigCache(os.path.join(directory, "pipeline_configs.json"),
+                            endpoint=f"{bhashini.url}/ulca/apis/v0/model/getModelsPipeline"),
+    )
+    translation_service._service = service
+    tts_cache._cache = TTSCache(os.path.join(directory, "tts"), service=service)
+    sentence = "एक मकान मालिक नोटिस के बिना किरायेदार को बेदखल नहीं कर सकता। " * 4
+    try:
+        def speak():
+            start = time.perf_counter()
+            response = requests.post(f"{base_url}/tts", json={"text": sentence, "language": "hi"})
+            return response, (time.perf_counter() - start) * 1000
+
+        response, first_ms = speak()
+        repeats = [speak() for _ in range(n_repeats)]
+        tts_calls = sum(1 for path, body in bhashini.requests
+                        if path.endswith("/inference/pipeline") and body["pipelineTasks"][0]["taskType"] == "tts")
+        hit_ms = sorted(ms for _, ms in repeats)[len(repeats) // 2]
+        print(f"first: {response.status_code} {response.headers.get('Content-Type')} "
+              f"{response.headers.get('X-TTS-Cache')} in {first_ms:.0f} ms; "
+              f"{n_repeats} repeats: median {hit_ms:.1f} ms, all hits: "
+              f"{all(r.headers.get('X-TTS-Cache') == 'hit' for r, _ in repeats)}")
+        print(f"Bhashini TTS calls for {1 + n_repeats} requests: {tts_calls}")
+        as_json = len(json.dumps({"audioContent": base64.b64encode(response.content).decode("ascii")}))
+        print(f"payload: {len(response.content)} bytes binary vs {as_json} bytes as base64 JSON")
+
+        url = response.headers["Content-Location"]
+        ranged = requests.get(f"{base_url}{url}", headers={"Range": "bytes=4-13"})
+        print(f"Range bytes=4-13 -> {ranged.status_code} {ranged.headers.get('Content-Range')}, "
+              f"matches: {ranged.content == response.content[4:14]}")
+        etag = requests.get(f"{base_url}{url}").headers.get("ETag")
+        print(f"If-None-Match -> {requests.get(f'{base_url}{url}', headers={'If-None-Match': etag}).status_code}")
+        missing = requests.get(f"{base_url}/audio/{'0' * 64}.wav")
+        print(f"unknown id -> {missing.status_code}")
+
+        small = TTSCache(os.path.join(directory, "small"), max_bytes=3 * len(response.content), service=service)
+        for i in range(6):
+            small.get(f"{sentence} ({i})", "hi")
+        small.get(f"{sentence} (5)", "hi")
+        print(f"bounded cache after 6 sentences: {small.stats()}")
+        reopened = TTSCache(os.path.join(directory, "small"), max_bytes=small.max_bytes, service=service)
+        print(f"reopened from disk: {reopened.stats()['entries']} entries, "
+              f"last sentence hit: {reopened.get(f'{sentence} (5)', 'hi')[3]}")
+    finally:
+        translation_service._service = None
+        tts_cache._cache = None
+        bhashini.stop()
+
+
+def check_metrics(base_url, n_requests=20):
+    """
+    Reads the Server-Timing header of /ask, scrapes /metrics, measures what a stage()
+    costs and has a sampled slow request write its profile.
+    """
+    print("\n--- Metrics: Server-Timing, /metrics, profiling ---")
+    stub = start_azure_stub(first_token_delay=0.05, token_delay=0.0)
+    point_app_at(stub)
+    try:
+        for i in range(n_requests):
+            response = requests.post(f"{base_url}/ask", json={"question": f"{QUESTION} ({i % 5})"},
+                                     headers={"X-Cache-Bypass": "1"} if i % 2 else {})
+        print(f"Server-Timing: {response.headers.get('Server-Timing')}")
+        requests.get(f"{base_url}/no-such-route")
+
+        start = time.perf_counter()
+        scrape = requests.get(f"{base_url}/metrics")
+        scrape_ms = (time.perf_counter() - start) * 1000
+        lines = scrape.text.splitlines()
+        families = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+        names = [line.split("{")[0].split()[0] for line in lines if not line.startswith("#")]
+        print(f"/metrics: {scrape.status_code} {scrape.headers.get('Content-Type')}, {len(families)} metrics, "
+              f"{len(lines)} lines in {scrape_ms:.1f} ms; one TYPE line per metric: {len(families) == len(set(families))}")
+        for prefix in ("legalease_stage_seconds_count", "legalease_responses_total", "legalease_answer_cache_hits_total",
+                       "legalease_azure_throttled_total", "legalease_index_chunks", "legalease_process_resident_memory_bytes"):
+            print("  " + next((line for line in lines if line.startswith(prefix)), f"MISSING {prefix}"))
+        stages = sorted({line.split('stage="')[1].split('"')[0] for line in lines
+                         if line.startswith("legalease_stage_seconds_count")})
+        print(f"stages seen: {', '.join(stages)}; every sample belongs to a declared metric: "
+              f"{all(any(n == f or n.startswith(f + '_') for f in families) for n in names)}")
+
+        n = 200000
+        start = time.perf_counter()
+        for _ in range(n):
+            with metrics.stage("overhead_check"):
+                pass
+        print(f"stage() overhead: {(time.perf_counter() - start) * 1e9 / n:.0f} ns per stage")
+
+        directory = tempfile.mkdtemp()
+        saved = metrics.PROFILE_SAMPLE, metrics.SLOW_REQUEST_MS, metrics.PROFILE_DIR
+        metrics.PROFILE_SAMPLE, metrics.SLOW_REQUEST_MS, metrics.PROFILE_DIR = 1.0, 10, directory
+        try:
+            requests.post(f"{base_url}/ask", json={"question": QUESTION}, headers={"X-Cache-Bypass": "1"})
+        finally:
+            metrics.PROFILE_SAMPLE, metrics.SLOW_REQUEST_MS, metrics.PROFILE_DIR = saved
+        dumps = os.listdir(directory)
+        if dumps:
+            import pstats
+            top = pstats.Stats(os.path.join(directory, dumps[0]))
+            print(f"slow request profile: {dumps[0]} ({top.total_calls} calls recorded)")
+        else:
+            print("ERROR: no profile written for a sampled slow request")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    print("--- LegalEase local stub checks ---")
+    server, base_url = start_app_server()
+    try:
+        check_streaming(base_url)
+        check_upstream_client(base_url)
+        check_coalescing(base_url)
+        check_admission(base_url)
+        check_routing(base_url)
+        check_reload(base_url)
+        check_filters(base_url)
+        check_incremental()
+        check_bhashini_config()
+        check_translation()
+        check_voice(base_url)
+        check_tts(base_url)
+        check_metrics(base_url)
+    finally:
+        server.shutdown()
+    print("\n--- Stub checks complete ---")
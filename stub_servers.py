@@ -0,0 +1,268 @@
+import base64
+import json
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-ins for the upstream APIs, used by stub_check.py to exercise the app
+# without real credentials. Behaviour is driven by StubServer.config and can be
+# changed while the server is running.
+
+DEFAULT_ANSWER = (
+    "Under the Rent Control Act a landlord cannot evict a tenant without a valid ground "
+    "and an order from the Rent Controller. Please consult a legal aid center for advice."
+)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # The default backlog of 5 stalls load tests on SYN retries
+
+
+class StubServer:
+    """
+    Runs handler_class on 127.0.0.1 (an ephemeral port by default) in a daemon thread.
+    Handlers read self.server.stub.config on every request and call record() for bookkeeping.
+    """
+
+    def __init__(self, handler_class, port=0, **config):
+        self.config = config
+        self.request_count = 0
+        self.requests = []  # (path, json body) of every request
+        self.state = {}     # Handler state kept across requests, guarded by lock
+        self.lock = threading.Lock()
+        self.httpd = _Server(("127.0.0.1", port), handler_class)
+        self.httpd.stub = self
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, path, body):
+        with self.lock:
+            self.request_count += 1
+            self.requests.append((path, body))
+            return self.request_count
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoints
+
+    def log_message(self, format, *args):
+        pass  # Keep check output readable
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw else {}
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class AzureStubHandler(_JSONHandler):
+    """
+    Mimics the Azure OpenAI chat completions API. Config keys:
+      answer              text of the completion (split into word tokens)
+      first_token_delay   seconds before the first token (default 0.2)
+      token_delay         seconds between tokens (default 0.01)
+      status              HTTP status to return instead of a completion (e.g. 429, 500)
+      fail_first          only the first N requests get `status`; later ones succeed
+      retry_after         Retry-After header sent with an error status
+      fail_after_tokens   drop the connection after this many streamed tokens
+      token_quota         tokens (prompt + max_tokens, as Azure estimates them) allowed per quota_window
+      request_quota       requests allowed per quota_window
+      quota_window        seconds of the sliding quota window (default 60); over quota -> 429 + Retry-After
+    """
+
+    def over_quota(self, body, config):
+        """Charges the request against the sliding-window quota. Returns Retry-After seconds if over it, else None."""
+        if "token_quota" not in config and "request_quota" not in config:
+            return None
+        prompt_chars = sum(len(m.get("content", "")) for m in body.get("messages", []))
+        cost = prompt_chars // 4 + body.get("max_tokens", 0)
+        window = config.get("quota_window", 60)
+        stub = self.server.stub
+        with stub.lock:
+            log = stub.state.setdefault("quota_log", deque())  # (time, tokens) of accepted requests
+            now = time.monotonic()
+            while log and now - log[0][0] >= window:
+                log.popleft()
+            used = sum(tokens for _, tokens in log)
+            if used + cost > config.get("token_quota", float("inf")) or len(log) >= config.get("request_quota", float("inf")):
+                stub.state["quota_rejections"] = stub.state.get("quota_rejections", 0) + 1
+                return max(1, math.ceil(log[0][0] + window - now)) if log else 1
+            log.append((now, cost))
+            return None
+
+    def do_POST(self):
+        stub = self.server.stub
+        config = stub.config
+        body = self.read_json()
+        request_number = stub.record(self.path, body)
+
+        status = config.get("status", 200)
+        if status != 200 and request_number <= config.get("fail_first", float("inf")):
+            headers = {"Retry-After": config["retry_after"]} if "retry_after" in config else None
+            self.send_json(status, {"error": {"code": str(status), "message": "stub error"}}, headers)
+            return
+        retry_after = self.over_quota(body, config)
+        if retry_after is not None:
+            self.send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}}, {"Retry-After": retry_after})
+            return
+
+        answer = config.get("answer", DEFAULT_ANSWER)
+        words = answer.split(" ")
+        tokens = [w if i == 0 else " " + w for i, w in enumerate(words)]
+        first_token_delay = config.get("first_token_delay", 0.2)
+        token_delay = config.get("token_delay", 0.01)
+        prompt_chars = sum(len(m.get("content", "")) for m in body.get("messages", []))
+        usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": len(tokens)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not body.get("stream"):
+            time.sleep(first_token_delay + token_delay * len(tokens))
+            self.send_json(200, {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        # Azure opens with a chunk carrying only content filter results and no choices
+        self.wfile.write(b'data: {"choices": [], "prompt_filter_results": []}\n\n')
+        self.wfile.flush()
+        time.sleep(first_token_delay)
+        for i, token in enumerate(tokens):
+            if config.get("fail_after_tokens") is not None and i >= config["fail_after_tokens"]:
+                return  # Connection closes without [DONE], like an upstream reset
+            event = {"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(token_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_azure_stub(**config):
+    """Starts an Azure OpenAI stub; see AzureStubHandler for config keys."""
+    return StubServer(AzureStubHandler, **config)
+
+
+class BhashiniStubHandler(_JSONHandler):
+    """
+    Mimics the ULCA getModelsPipeline endpoint (any path ending in /getModelsPipeline),
+    offering one model per requested task and language pair, and the pipeline inference
+    endpoint it points at. Translation returns "[<target>] <source>" for every input, ASR
+    returns the configured transcript and TTS returns "audio" bytes spelling out the text.
+    Config keys:
+      config_delay        seconds before the config response (default 0.05)
+      config_status       HTTP status to return instead of a config (e.g. 500)
+      unsupported         language codes for which no model is offered
+      inference_delay     seconds per inference request (default 0.05)
+      segment_delay       extra seconds per input segment (default 0.002)
+      inference_status    HTTP status to return instead of a result
+      inference_key       required Authorization value (default "stub-inference-key"); others get 401
+      transcript          text ASR returns (default: a tenant's question)
+      tts_char_delay      extra seconds per character synthesized (default 0.0005)
+    The highest number of concurrent inference requests is kept in state["max_in_flight"].
+    """
+
+    def models_pipeline(self, body, config):
+        time.sleep(config.get("config_delay", 0.05))
+        if config.get("config_status", 200) != 200:
+            self.send_json(config["config_status"], {"message": "stub error"})
+            return
+        entries = []
+        for task in body.get("pipelineTasks", []):
+            language = task.get("config", {}).get("language", {})
+            if {language.get("sourceLanguage"), language.get("targetLanguage")} & set(config.get("unsupported", ())):
+                entries.append({"taskType": task["taskType"], "config": []})
+                continue
+            pair = "-".join(filter(None, (language.get("sourceLanguage"), language.get("targetLanguage"))))
+            entries.append({"taskType": task["taskType"], "config": [{
+                "serviceId": f"stub/{task['taskType']}-{pair}",
+                "modelId": f"stub-model-{task['taskType']}-{pair}",
+                "language": language,
+            }]})
+        self.send_json(200, {
+            "pipelineResponseConfig": entries,
+            "pipelineInferenceAPIEndPoint": {
+                "callbackUrl": f"{self.server.stub.url}/services/inference/pipeline",
+                "inferenceApiKey": {"name": "Authorization", "value": config.get("inference_key", "stub-inference-key")},
+            },
+        })
+
+    def inference(self, body, config):
+        inputs = body.get("inputData", {}).get("input", [])
+        time.sleep(config.get("inference_delay", 0.05) + config.get("segment_delay", 0.002) * len(inputs))
+        if self.headers.get("Authorization") != config.get("inference_key", "stub-inference-key"):
+            self.send_json(401, {"message": "invalid inference key"})
+            return
+        if config.get("inference_status", 200) != 200:
+            self.send_json(config["inference_status"], {"message": "stub error"})
+            return
+        task = body["pipelineTasks"][0]
+        language = task["config"]["language"]
+        if task["taskType"] == "translation":
+            output = [{"source": item["source"], "target": f"[{language['targetLanguage']}] {item['source']}"}
+                      for item in inputs]
+            self.send_json(200, {"pipelineResponse": [{"taskType": "translation", "output": output}]})
+        elif task["taskType"] == "asr":
+            transcript = config.get("transcript", "Can my landlord evict me without notice?")
+            self.send_json(200, {"pipelineResponse": [{"taskType": "asr", "output": [{"source": transcript}]}]})
+        elif task["taskType"] == "tts":
+            text = " ".join(item["source"] for item in inputs)
+            time.sleep(config.get("tts_char_delay", 0.0005) * len(text))
+            audio = base64.b64encode(b"RIFF-stub-wav:" + text.encode("utf-8")).decode("ascii")
+            self.send_json(200, {"pipelineResponse": [{
+                "taskType": "tts",
+                "config": {"language": language, "audioFormat": "wav", "encoding": "base64", "samplingRate": 22050},
+                "audio": [{"audioContent": audio}],
+            }]})
+        else:
+            self.send_json(400, {"message": f"stub does not implement {task['taskType']}"})
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self.read_json()
+        stub.record(self.path, body)
+        if self.path.endswith("/getModelsPipeline"):
+            self.models_pipeline(body, stub.config)
+        elif self.path.endswith("/inference/pipeline"):
+            with stub.lock:
+                stub.state["in_flight"] = stub.state.get("in_flight", 0) + 1
+                stub.state["max_in_flight"] = max(stub.state.get("max_in_flight", 0), stub.state["in_flight"])
+            try:
+                self.inference(body, stub.config)
+            finally:
+                with stub.lock:
+                    stub.state["in_flight"] -= 1
+        else:
+            self.send_json(404, {"message": f"stub has no {self.path}"})
+
+
+def start_bhashini_stub(**config):
+    """Starts a Bhashini stub; see BhashiniStubHandler for config keys."""
+    return StubServer(BhashiniStubHandler, **config)
@@ -0,0 +1,254 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from azure_client import RETRY_STATUSES, retry_delay
+from bhashini_config import pipeline_configs
+
+# Bhashini translation with batching, bounded concurrency and a translation memory.
+# Text is split into sentences; sentences already in the on-disk memory are reused,
+# the rest are packed into size-bounded pipeline requests (inputData.input takes a
+# list) that run in parallel up to BHASHINI_MAX_CONCURRENCY, and every result is
+# written back to the memory so repeated legal phrasing is translated once.
+
+BATCH_SEGMENTS = int(os.getenv("BHASHINI_BATCH_SEGMENTS", "32"))    # sentences per inference request
+BATCH_CHARS = int(os.getenv("BHASHINI_BATCH_CHARS", "4000"))        # characters per inference request
+MAX_CONCURRENCY = int(os.getenv("BHASHINI_MAX_CONCURRENCY", "4"))   # inference requests in flight per process
+INFERENCE_TIMEOUT = float(os.getenv("BHASHINI_INFERENCE_TIMEOUT", "30"))
+MAX_RETRIES = int(os.getenv("BHASHINI_MAX_RETRIES", "2"))
+MEMORY_PATH = os.getenv("TRANSLATION_MEMORY_PATH", os.path.join("legal_data", ".bhashini", "translation_memory.sqlite3"))
+
+# Sentence ends: ., ?, ! and the Devanagari danda, unless the period closes a common legal abbreviation
+SENTENCE_END = re.compile(r"(?<=[.?!।])(?<!\bSec\.)(?<!\bNo\.)(?<!\bArt\.)(?<!\bi\.e\.)(?<!\be\.g\.)(?<!\bvs\.)\s+")
+
+
+class TranslationError(Exception):
+    """The inference endpoint failed or returned an unusable response."""
+
+
+def split_sentences(text):
+    """Splits text into sentences, keeping paragraph breaks as separate lists. Returns [[sentence, ...], ...]."""
+    return [[s for s in SENTENCE_END.split(paragraph.strip()) if s] for paragraph in text.split("\n")]
+
+
+def segment_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TranslationMemory:
+    """
+    SQLite store of translated segments keyed by (text hash, source, target, serviceId),
+    so a model upgrade (new serviceId) does not reuse the old model's output.
+    """
+
+    def __init__(self, path=MEMORY_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")  # Readers in other workers don't block the writer
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS segments ("
+                " text_hash TEXT NOT NULL, source TEXT NOT NULL, target TEXT NOT NULL, service_id TEXT NOT NULL,"
+                " translation TEXT NOT NULL, created_at REAL NOT NULL,"
+                " PRIMARY KEY (text_hash, source, target, service_id))"
+            )
+
+    def get_many(self, texts, source, target, service_id):
+        """Returns {text: translation} for the texts already in the memory."""
+        hashes = {segment_hash(text): text for text in texts}
+        found = {}
+        items = list(hashes)
+        with self._lock:
+            for start in range(0, len(items), 500):  # Stay under SQLite's bound-parameter limit
+                chunk = items[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, translation FROM segments WHERE source = ? AND target = ? AND service_id = ?"
+                    f" AND text_hash IN ({','.join('?' * len(chunk))})",
+                    (source, target, service_id, *chunk),
+                ).fetchall()
+                found.update((hashes[h], translation) for h, translation in rows)
+        return found
+
+    def put_many(self, translations, source, target, service_id):
+        """Stores {text: translation} pairs."""
+        now = time.time()
+        rows = [(segment_hash(text), source, target, service_id, translation, now)
+                for text, translation in translations.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+
+def make_batches(segments, max_segments=BATCH_SEGMENTS, max_chars=BATCH_CHARS):
+    """Packs segments, in order, into lists of at most max_segments and (unless a single segment is longer) max_chars."""
+    batches, batch, chars = [], [], 0
+    for segment in segments:
+        if batch and (len(batch) >= max_segments or chars + len(segment) > max_chars):
+            batches.append(batch)
+            batch, chars = [], 0
+        batch.append(segment)
+        chars += len(segment)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class TranslationService:
+    """
+    Translates segments through the Bhashini pipeline. Configs come from config_cache, results
+    are kept in memory; at most max_concurrency inference requests run at once across all callers.
+    """
+
+    def __init__(self, memory=None, config_cache=pipeline_configs, batch_segments=BATCH_SEGMENTS,
+                 batch_chars=BATCH_CHARS, max_concurrency=MAX_CONCURRENCY, timeout=INFERENCE_TIMEOUT):
+        self.memory = memory if memory is not None else TranslationMemory()
+        self.config_cache = config_cache
+        self.batch_segments = batch_segments
+        self.batch_chars = batch_chars
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="bhashini-translate")
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max_concurrency, max_retries=0)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._stats = {"segments": 0, "memory_hits": 0, "translated": 0, "requests": 0, "retries": 0, "errors": 0}
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self._stats[name] += amount
+
+    def _post(self, config, payload):
+        """
+        POSTs one inference request, retrying connection errors and retryable statuses.
+        Read timeouts are not retried, like azure_client.post().
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            self._count(requests=1)
+            try:
+                response = self._session.post(config.inference_endpoint, headers=config.headers(), json=payload,
+                                              timeout=self.timeout)
+            except requests.exceptions.ConnectionError as e:
+                if attempt == MAX_RETRIES:
+                    raise TranslationError(f"Bhashini inference unreachable: {e}")
+                self._count(retries=1)
+                time.sleep(retry_delay(attempt))
+                continue
+            except requests.exceptions.RequestException as e:
+                raise TranslationError(f"Bhashini inference failed: {e}")
+            if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                return response
+            self._count(retries=1)
+            time.sleep(retry_delay(attempt, response))
+            response.close()
+
+    def run_task(self, task, source, target, input_data, **task_config):
+        """
+        Runs one Bhashini pipeline task (asr, translation or tts) through the pooled session.
+        input_data is the request's inputData; task_config adds to the task's config (e.g. gender).
+        Returns (serviceId used, the task's pipelineResponse entry). A 401/403 means the inference
+        key rotated, so the config is fetched again and the call retried once.
+        """
+        config = self.config_cache.get(task, source, target)
+        language = {"sourceLanguage": source}
+        if target and task == "translation":
+            language["targetLanguage"] = target
+        payload = {
+            "pipelineTasks": [{"taskType": task, "config": dict(task_config, language=language, serviceId=config.service_id)}],
+            "inputData": input_data,
+        }
+        response = self._post(config, payload)
+        if response.status_code in (401, 403):
+            response.close()
+            self.config_cache.invalidate(task, source, target)
+            config = self.config_cache.get(task, source, target)
+            payload["pipelineTasks"][0]["config"]["serviceId"] = config.service_id
+            response = self._post(config, payload)
+        try:
+            response.raise_for_status()
+            return config.service_id, response.json()["pipelineResponse"][0]
+        except (requests.exceptions.HTTPError, ValueError, KeyError, IndexError, TypeError) as e:
+            raise TranslationError(f"Bhashini {task} failed: {e}")
+
+    def _translate_batch(self, batch, source, target):
+        """Translates one batch with a single inference request. Returns (serviceId used, translations in order)."""
+        service_id, result = self.run_task("translation", source, target,
+                                           {"input": [{"source": segment} for segment in batch]})
+        try:
+            translations = [item["target"] for item in result["output"]]
+        except (KeyError, TypeError) as e:
+            raise TranslationError(f"Bhashini translation failed: {e}")
+        if len(translations) != len(batch):
+            raise TranslationError(f"Bhashini returned {len(translations)} translations for {len(batch)} segments")
+        return service_id, translations
+
+    def translate_segments(self, segments, source, target):
+        """
+        Translates a list of segments (sentences), returning translations in the same order.
+        Repeated and remembered segments are not sent; the rest go out in parallel batches.
+        Raises TranslationError or bhashini_config.BhashiniConfigError.
+        """
+        segments = list(segments)
+        if source == target:
+            return segments
+        unique = list(dict.fromkeys(s for s in segments if s.strip()))
+        service_id = self.config_cache.get("translation", source, target).service_id
+        known = self.memory.get_many(unique, source, target, service_id)
+        missing = [s for s in unique if s not in known]
+        self._count(segments=len(segments), memory_hits=len(unique) - len(missing))
+
+        if missing:
+            batches = make_batches(missing, self.batch_segments, self.batch_chars)
+            futures = [self._executor.submit(self._translate_batch, batch, source, target) for batch in batches]
+            try:
+                for batch, future in zip(batches, futures):
+                    batch_service_id, translations = future.result()
+                    translated = dict(zip(batch, translations))
+                    self.memory.put_many(translated, source, target, batch_service_id)
+                    known.update(translated)
+            except Exception:
+                self._count(errors=1)
+                for future in futures:
+                    future.cancel()
+                raise
+            self._count(translated=len(missing))
+        return [known.get(s, s) for s in segments]
+
+    def translate(self, text, source, target):
+        """Translates a text sentence by sentence, keeping its line breaks."""
+        paragraphs = split_sentences(text)
+        translations = iter(self.translate_segments([s for p in paragraphs for s in p], source, target))
+        return "\n".join(" ".join(next(translations) for _ in paragraph) for paragraph in paragraphs)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+_service = None
+_service_lock = threading.Lock()
+metrics.register_stats("translation", lambda: _service.stats() if _service is not None else {})  # Empty until first use
+
+
+def get_translation_service():
+    """Returns the process-wide TranslationService, creating it (and the memory file) on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = TranslationService()
+    return _service
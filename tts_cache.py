@@ -0,0 +1,173 @@
+import base64
+import binascii
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from singleflight import SingleFlight
+from translation_service import TranslationError, get_translation_service
+
+# Content-addressed cache of synthesized speech. Bhashini TTS returns base64 audio inside
+# JSON; the decoded bytes are stored on disk under a key derived from the text, language,
+# voice and serviceId, served to clients as plain binary files (with Range support) and
+# evicted least-recently-used first once the cache exceeds TTS_CACHE_MAX_BYTES.
+
+TTS_GENDER = os.getenv("BHASHINI_TTS_GENDER", "female")
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join("legal_data", ".bhashini", "tts"))
+MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+AUDIO_MIMETYPES = {"wav": "audio/wav", "mp3": "audio/mpeg", "ogg": "audio/ogg", "flac": "audio/flac"}
+
+
+def synthesize(text, language, service=None, gender=TTS_GENDER):
+    """Speaks text with Bhashini TTS. Returns (decoded audio bytes, audio format). Raises TranslationError."""
+    service = service or get_translation_service()
+    _, result = service.run_task("tts", language, None, {"input": [{"source": text}]}, gender=gender)
+    try:
+        audio = result["audio"][0]
+        audio_format = (result.get("config") or {}).get("audioFormat") or audio.get("audioFormat") or "wav"
+        return base64.b64decode(audio["audioContent"], validate=True), str(audio_format).lower()
+    except (KeyError, IndexError, TypeError, AttributeError, binascii.Error, ValueError) as e:
+        raise TranslationError(f"Bhashini tts failed: {e}")
+
+
+def audio_key(text, language, gender, service_id):
+    """Content address of an utterance: the same text spoken by the same model and voice shares one file."""
+    digest = hashlib.sha256()
+    for part in (service_id, language, gender, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TTSCache:
+    """
+    Decoded TTS audio on disk, one file per key (<dir>/<key[:2]>/<key>.<format>), with an
+    in-memory LRU index. File modification times record use, so recency survives restarts.
+    Concurrent requests for the same missing utterance share one synthesis call.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES, service=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.service = service
+        self._entries = OrderedDict()  # key -> (path, size, audio format), least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = SingleFlight()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                key, _, audio_format = name.partition(".")
+                if len(key) != 64 or audio_format not in AUDIO_MIMETYPES:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, key, path, stat.st_size, audio_format))
+        for _, key, path, size, audio_format in sorted(found):
+            self._entries[key] = (path, size, audio_format)
+            self._bytes += size
+
+    def _service(self):
+        return self.service or get_translation_service()
+
+    def lookup(self, key):
+        """Returns (path, audio format) for a cached key and marks it used, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            os.utime(entry[0])
+        except OSError:
+            with self._lock:
+                if self._entries.get(key) == entry:
+                    del self._entries[key]
+                    self._bytes -= entry[1]
+            return None
+        return entry[0], entry[2]
+
+    def _store(self, key, audio, audio_format):
+        # The format comes from the Bhashini response and ends up in a file name
+        if audio_format not in AUDIO_MIMETYPES:
+            raise TranslationError(f"Bhashini tts returned an unsupported audio format: {audio_format!r}")
+        path = os.path.join(self.directory, key[:2], f"{key}.{audio_format}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (path, len(audio), audio_format)
+            self._bytes += len(audio)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (old_path, size, _) = self._entries.popitem(last=False)
+                self._bytes -= size
+                self._stats["evictions"] += 1
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)  # A response already streaming the file keeps its open handle
+            except OSError:
+                pass
+        return path
+
+    def get(self, text, language, gender=TTS_GENDER):
+        """
+        Returns (key, path, audio format, hit) for the spoken text, synthesizing and storing
+        it on a miss. Raises translation_service.TranslationError or BhashiniConfigError.
+        """
+        service = self._service()
+        service_id = service.config_cache.get("tts", language).service_id
+        key = audio_key(text, language, gender, service_id)
+        cached = self.lookup(key)
+        if cached is not None:
+            with self._lock:
+                self._stats["hits"] += 1
+            return key, cached[0], cached[1], True
+
+        def synthesize_and_store():
+            stored = self.lookup(key)  # A run that finished since the lookup above already has it
+            if stored is not None:
+                return stored
+            audio, audio_format = synthesize(text, language, service, gender)
+            return self._store(key, audio, audio_format), audio_format
+
+        (path, audio_format), _ = self._inflight.do(key, synthesize_and_store)
+        with self._lock:
+            self._stats["misses"] += 1
+        return key, path, audio_format, False
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+metrics.register_stats("tts_cache", lambda: _cache.stats() if _cache is not None else {})  # Empty until first use
+
+
+def get_tts_cache():
+    """Returns the process-wide TTSCache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TTSCache()
+    return _cache
@@ -0,0 +1,135 @@
+import itertools
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+from translation_service import SENTENCE_END, get_translation_service
+from tts_cache import TTS_GENDER, get_tts_cache
+
+# Voice round trip for /ask/voice: Bhashini ASR, then the usual RAG answer, then translation
+# back to the caller's language and TTS. The answer is cut into sentences as it streams
+# from the LLM, and each sentence is translated and synthesized on a worker pool while
+# later sentences are still being generated, so the first audio is ready long before the
+# full answer is.
+
+ANSWER_LANGUAGE = "en"  # Language of the corpus and of the LLM's answers
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", "8"))  # sentence translation + TTS jobs run at once
+ASR_SAMPLING_RATE = int(os.getenv("BHASHINI_ASR_SAMPLING_RATE", "16000"))
+
+# A sentence ends at sentence punctuation followed by whitespace, or at a line break
+_SENTENCE_BREAK = re.compile(rf"{SENTENCE_END.pattern}|\s*\n\s*")
+
+_executor = ThreadPoolExecutor(max_workers=VOICE_WORKERS, thread_name_prefix="voice")
+
+
+class StageTimer:
+    """Per-request latency breakdown in milliseconds, written from several threads."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Adds the block's duration to timings[name_ms]; a stage run once per sentence is summed."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.timings[f"{name}_ms"] = self.timings.get(f"{name}_ms", 0.0) + elapsed
+            metrics.observe_stage(f"voice_{name}", elapsed / 1000)
+
+    def mark(self, name):
+        """Records timings[name_ms] as the time since the request started, the first time it is called."""
+        elapsed = (time.perf_counter() - self.started) * 1000
+        with self._lock:
+            self.timings.setdefault(f"{name}_ms", elapsed)
+
+    def report(self):
+        with self._lock:
+            report = {name: round(ms, 1) for name, ms in self.timings.items()}
+        report["total_ms"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return report
+
+
+class SentenceSplitter:
+    """Cuts a stream of text deltas into sentences as soon as each one is complete."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, delta):
+        """Adds a delta and returns the sentences it completed."""
+        self._buffer += delta
+        parts = _SENTENCE_BREAK.split(self._buffer)
+        self._buffer = parts.pop()  # The last part has no break after it yet
+        return [part.strip() for part in parts if part and part.strip()]
+
+    def flush(self):
+        """Returns whatever is left once the stream has ended."""
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+
+def recognize(audio, audio_format, language, service=None):
+    """Transcribes base64 audio with Bhashini ASR. Returns the transcript ("" if nothing was recognized)."""
+    service = service or get_translation_service()
+    _, result = service.run_task("asr", language, None, {"audio": [{"audioContent": audio}]},
+                                 audioFormat=audio_format, samplingRate=ASR_SAMPLING_RATE)
+    return " ".join(item.get("source", "") for item in result.get("output") or []).strip()
+
+
+def speak(deltas, language, timer, service=None, tts=None, gender=TTS_GENDER):
+    """
+    Consumes answer text deltas (e.g. LLM tokens) and yields one dict per sentence, in order:
+    index, text, translation, audio_id, audio_format and audio_cached. The audio itself is in
+    the TTS cache (tts_cache.TTSCache) under audio_id. Each sentence is translated and
+    synthesized on the worker pool as soon as it is complete; finished sentences are yielded
+    between deltas, so audio for the first sentence goes out while the rest is generated.
+    """
+    service = service or get_translation_service()
+    tts = tts or get_tts_cache()
+
+    def voice(index, sentence):
+        translation = sentence
+        if language != ANSWER_LANGUAGE:
+            with timer.stage("translation"):
+                translation = service.translate(sentence, ANSWER_LANGUAGE, language)
+        with timer.stage("tts"):
+            audio_id, _, audio_format, cached = tts.get(translation, language, gender)
+        return {"index": index, "text": sentence, "translation": translation,
+                "audio_id": audio_id, "audio_format": audio_format, "audio_cached": cached}
+
+    splitter = SentenceSplitter()
+    pending = deque()
+    indexes = itertools.count()
+
+    def submit(sentences):
+        for sentence in sentences:
+            timer.mark("first_sentence")
+            pending.append(_executor.submit(voice, next(indexes), sentence))
+
+    def next_result():
+        result = pending.popleft().result()
+        timer.mark("first_audio")
+        return result
+
+    try:
+        for delta in deltas:
+            submit(splitter.feed(delta))
+            while pending and pending[0].done():
+                yield next_result()
+        submit(splitter.flush())
+        while pending:
+            yield next_result()
+    finally:
+        for future in pending:
+            future.cancel()